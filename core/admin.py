@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
 from django.conf import settings
-from .models import Lezione, Disponibilita, Profilo, GiornoChiusura, Impostazioni
+from .models import Lezione, LezioneArchiviata, Disponibilita, Profilo, GiornoChiusura, Impostazioni, Movimento, EstrattoConto, VariazioneLezione
 from .utils import invia_email_custom
 
 
@@ -17,7 +19,7 @@ class DisponibilitaAdmin(admin.ModelAdmin):
 
 @admin.register(Profilo)
 class ProfiloAdmin(admin.ModelAdmin):
-    list_display = ('user', 'tariffa_specifica', 'telefono', 'scuola')
+    list_display = ('user', 'tariffa_specifica', 'saldo', 'lezioni_da_saldare', 'telefono', 'scuola')
     list_editable = ('tariffa_specifica',)
     search_fields = ('user__username', 'user__first_name', 'user__last_name', 'telefono')
 
@@ -69,4 +71,78 @@ class LezioneAdmin(admin.ModelAdmin):
                         context={'lezione': obj}
                     )
 
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(LezioneArchiviata)
+class LezioneArchiviataAdmin(admin.ModelAdmin):
+    list_display = ('id', 'studente', 'data_inizio', 'luogo', 'prezzo', 'stato', 'pagata', 'archiviata_il')
+    list_filter = ('stato', 'pagata')
+    search_fields = ('studente__username', 'studente__first_name', 'studente__last_name')
+    date_hierarchy = 'data_inizio'
+
+    # L'archivio è in sola lettura: si popola solo tramite 'manage.py archivia_lezioni'
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Movimento)
+class MovimentoAdmin(admin.ModelAdmin):
+    list_display = ('creato_il', 'studente', 'tipo', 'importo', 'lezioni', 'saldo_dopo', 'lezione_rif', 'registrato_da', 'nota')
+    list_filter = ('tipo',)
+    search_fields = ('studente__username', 'studente__first_name', 'studente__last_name')
+    date_hierarchy = 'creato_il'
+
+    # Il registro si scrive solo dall'applicazione (conferme, pagamenti, storni): qui si consulta
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class UtenteAdmin(UserAdmin):
+    def get_deleted_objects(self, objs, request):
+        eliminati, conteggi, permessi_mancanti, protetti = super().get_deleted_objects(objs, request)
+        # Il registro non si cancella a mano, ma quello di uno studente eliminato se ne va con lui in cascata
+        permessi_mancanti.discard(Movimento._meta.verbose_name)
+        return eliminati, conteggi, permessi_mancanti, protetti
+
+
+@admin.register(VariazioneLezione)
+class VariazioneLezioneAdmin(admin.ModelAdmin):
+    list_display = ('id', 'creata_il', 'operazione', 'lezione_id', 'studente_id', 'modifiche')
+    list_filter = ('operazione',)
+    search_fields = ('=lezione_id', '=studente_id')
+
+    # Registro append-only: lo scrivono Lezione.save() e gli update sul queryset
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(EstrattoConto)
+class EstrattoContoAdmin(admin.ModelAdmin):
+    list_display = ('mese', 'studente', 'numero_lezioni', 'ore', 'totale', 'da_pagare', 'generato_il', 'inviato_il')
+    list_filter = ('mese',)
+    search_fields = ('studente__username', 'studente__first_name', 'studente__last_name')
+    readonly_fields = [f.name for f in EstrattoConto._meta.fields]
+
+    # Gli estratti si rigenerano con 'manage.py genera_estratti'
+    def has_add_permission(self, request):
+        return False
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # Registro i signal che tengono aggiornati l'indice di ricerca, la cache della heatmap, gli ETag
+        # e gli eventi live della dashboard docente
+        from . import etag, eventi, heatmap, search  # noqa: F401
@@ -0,0 +1,116 @@
+"""
+Riscaldamento dei worker all'avvio (chiamato da ripetizioni/wsgi.py e asgi.py).
+
+Sull'hosting economico i worker vengono riciclati spesso e la prima richiesta dopo un riavvio
+pagava tutto il lavoro "una tantum": compilare i template, costruire i resolver degli URL,
+aprire il DB. Qui lo faccio prima di accettare richieste, così lo paga l'avvio e non l'utente.
+I tempi di ogni fase si misurano con 'manage.py startup_profile'.
+
+Disattivabile con RISCALDAMENTO_AVVIO=False. Un errore qui non deve mai impedire l'avvio del worker.
+"""
+import logging
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateSyntaxError, engines
+from django.template.loader import get_template
+from django.urls import get_resolver, resolve, Resolver404
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Percorsi risolti per costruire (e mettere in cache) i pattern compilati del resolver
+PERCORSI_CALDI = ['/', '/prenota/', '/htmx/get-orari/', '/dashboard-docente/', '/accounts/login/']
+
+
+def _template_progetto():
+    """Nomi dei template nelle DIRS del progetto (quelli delle app, es. admin, si caricano quando servono)."""
+    nomi = []
+    for backend in settings.TEMPLATES:
+        for cartella in backend.get('DIRS', []):
+            cartella = Path(cartella)
+            # Anche i .txt: le versioni testuali delle email
+            nomi += sorted(str(p.relative_to(cartella)) for p in cartella.rglob('*')
+                           if p.suffix in ('.html', '.txt'))
+    return nomi
+
+
+def precarica_template():
+    """Compila tutti i template del progetto: finiscono nel cached loader di Django."""
+    compilati = 0
+    for nome in _template_progetto():
+        try:
+            get_template(nome)
+            compilati += 1
+        except TemplateSyntaxError:
+            # Lo vedrà chi apre la pagina, con il traceback completo: qui non blocco l'avvio
+            logger.exception("Template non compilabile durante il riscaldamento: %s", nome)
+    return compilati
+
+
+def prepara_url():
+    resolver = get_resolver()
+    # reverse_dict popola le tabelle usate da reverse()/{% url %}, resolve() compila le regex dei pattern
+    resolver.reverse_dict
+    for percorso in PERCORSI_CALDI:
+        try:
+            resolve(percorso)
+        except Resolver404:
+            pass
+
+
+def importa_moduli_pigri():
+    """Moduli che Django importa solo alla prima richiesta: context processor, storage dei messaggi, sessioni."""
+    for backend in engines.all():
+        if hasattr(backend, 'engine'):
+            # cached_property: importa i context processor configurati
+            backend.engine.template_context_processors
+    import_string(settings.MESSAGE_STORAGE)
+    import_string(settings.SESSION_ENGINE + '.SessionStore')
+    import_string(settings.SESSION_SERIALIZER)
+
+
+def prepara_db():
+    """Apre il DB e legge le tabelle di configurazione (la tariffa finisce nella cache locale del worker)."""
+    from .models import Impostazioni, Disponibilita, GiornoChiusura
+
+    Impostazioni.tariffa_corrente()
+    list(Disponibilita.objects.all())
+    GiornoChiusura.objects.exists()
+
+
+FASI = [
+    ('template', precarica_template),
+    ('url', prepara_url),
+    ('moduli', importa_moduli_pigri),
+    ('db', prepara_db),
+]
+
+
+def riscalda():
+    """Esegue le fasi di riscaldamento. Ritorna {fase: secondi}; le fasi fallite valgono None."""
+    tempi = {}
+    for nome, fase in FASI:
+        inizio = time.perf_counter()
+        try:
+            fase()
+            tempi[nome] = time.perf_counter() - inizio
+        except Exception as e:
+            # Tipico: DB non ancora migrato al primo deploy. La prima richiesta farà il lavoro come prima
+            logger.warning("Riscaldamento: fase '%s' fallita: %s", nome, e)
+            tempi[nome] = None
+    # Niente connessioni aperte nel processo che carica l'app: con gunicorn --preload verrebbero
+    # ereditate dai worker dopo il fork. Ogni richiesta aprirà la sua, il file è già nella cache del SO.
+    connections.close_all()
+    return tempi
+
+
+def riscalda_se_attivo():
+    if settings.RISCALDAMENTO_AVVIO:
+        tempi = riscalda()
+        logger.info("Riscaldamento completato: %s", ", ".join(
+            f"{nome} {secondi * 1000:.0f} ms" if secondi is not None else f"{nome} fallita"
+            for nome, secondi in tempi.items()
+        ))
@@ -0,0 +1,139 @@
+"""
+Cache condivisa tra worker e piccole cache in-process coordinate tramite "version keys".
+
+Ogni scope (es. 'config') ha un numero di versione salvato nella cache condivisa (settings.CACHES).
+Chi modifica i dati chiama bump_versione(scope); ogni worker confronta la versione che ha in
+memoria con quella condivisa e, se è cambiata, butta via la sua copia locale.
+Così N processi gunicorn/uvicorn vedono gli stessi dati senza dover interrogare il DB ogni volta.
+"""
+import asyncio
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+PREFISSO = 'ver:'
+
+
+def versione(scope):
+    """Versione corrente dello scope (una sola lettura dalla cache condivisa)."""
+    chiave = PREFISSO + scope
+    valore = cache.get(chiave)
+    if valore is None:
+        # add() è atomico: se due worker partono insieme, uno solo inizializza la chiave
+        cache.add(chiave, 1, timeout=None)
+        valore = cache.get(chiave, 1)
+    return valore
+
+
+def versioni(*scopes):
+    """Versioni di più scope con una sola lettura (get_many) dalla cache condivisa."""
+    chiavi = [PREFISSO + scope for scope in scopes]
+    trovati = cache.get_many(chiavi)
+    for chiave in chiavi:
+        if chiave not in trovati:
+            cache.add(chiave, 1, timeout=None)
+            trovati[chiave] = cache.get(chiave, 1)
+    return [trovati[chiave] for chiave in chiavi]
+
+
+def bump_versione(scope):
+    """Invalida tutte le copie (locali e condivise) legate allo scope."""
+    chiave = PREFISSO + scope
+    try:
+        return cache.incr(chiave)
+    except ValueError:
+        # Chiave assente (cache appena svuotata): la ricreo con un valore nuovo
+        cache.add(chiave, 2, timeout=None)
+        return cache.get(chiave, 2)
+
+
+def bump_dopo_commit(*scopes):
+    """
+    bump_versione al commit della transazione in corso (subito se non ce n'è una). Se incrementassi prima,
+    una richiesta che arriva tra il bump e il commit metterebbe la versione nuova sui dati vecchi
+    (ETag, cache locali) e resterebbe così fino alla scrittura successiva. Con un rollback non si incrementa nulla.
+    """
+    def incrementa():
+        for scope in scopes:
+            bump_versione(scope)
+    transaction.on_commit(incrementa)
+
+
+class CacheLocale:
+    """
+    Memo in-process valido finché la versione condivisa dello scope non cambia.
+    Il valore vive nella memoria del worker, il controllo di validità costa una get sulla cache condivisa.
+    """
+
+    def __init__(self, scope):
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._valori = {}
+
+    def get(self, chiave, calcola):
+        corrente = versione(self.scope)
+        trovato = self._valori.get(chiave)
+        if trovato is not None and trovato[0] == corrente:
+            return trovato[1]
+
+        valore = calcola()
+        with self._lock:
+            self._valori[chiave] = (corrente, valore)
+        return valore
+
+    def svuota(self):
+        with self._lock:
+            self._valori.clear()
+
+
+# --- COALESCING ---
+# Richieste identiche che arrivano insieme nello stesso processo: la prima calcola, le altre aspettano
+# il suo risultato invece di rifare le stesse query.
+
+class _InVolo:
+    def __init__(self):
+        self.pronto = threading.Event()
+        self.risultato = None
+        self.errore = None
+
+
+_in_volo = {}
+_in_volo_lock = threading.Lock()
+_in_volo_async = {}
+
+
+def condividi_calcolo(chiave, calcola):
+    """Esegue calcola() una volta sola per i thread che chiedono la stessa chiave in contemporanea."""
+    with _in_volo_lock:
+        volo = _in_volo.get(chiave)
+        primo = volo is None
+        if primo:
+            volo = _in_volo[chiave] = _InVolo()
+
+    if not primo:
+        volo.pronto.wait()
+        if volo.errore is not None:
+            raise volo.errore
+        return volo.risultato
+
+    try:
+        volo.risultato = calcola()
+        return volo.risultato
+    except Exception as e:
+        volo.errore = e
+        raise
+    finally:
+        with _in_volo_lock:
+            del _in_volo[chiave]
+        volo.pronto.set()
+
+
+async def acondividi_calcolo(chiave, acalcola):
+    """Come condividi_calcolo, per le coroutine dello stesso event loop: acalcola() è una funzione async."""
+    task = _in_volo_async.get(chiave)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = _in_volo_async[chiave] = asyncio.ensure_future(acalcola())
+        task.add_done_callback(lambda t: _in_volo_async.pop(chiave, None) if _in_volo_async.get(chiave) is t else None)
+    # shield: se il client che ha avviato il calcolo si disconnette, gli altri ricevono comunque il risultato
+    return await asyncio.shield(task)
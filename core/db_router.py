@@ -0,0 +1,94 @@
+"""
+Instradamento delle letture su una replica del database.
+
+- Le scritture vanno SEMPRE su 'default'.
+- Le letture vanno sulla replica solo dentro una view/queryset marcata come "sola lettura"
+  (decoratore usa_replica o helper sola_lettura) e solo se la replica è configurata.
+- Dopo un POST il browser riceve un cookie di "pin" per qualche secondo: in quella finestra
+  anche le view di sola lettura leggono da 'default', così l'utente vede subito le sue modifiche
+  anche se la replica è in ritardo.
+"""
+import contextvars
+import functools
+import time
+
+from django.conf import settings
+
+REPLICA = 'replica'
+COOKIE_PIN = 'db_pin'
+
+# ContextVar e non threading.local: funziona anche con le view async (asgiref propaga il contesto)
+_lettura_su_replica = contextvars.ContextVar('lettura_su_replica', default=False)
+
+
+def replica_configurata():
+    return REPLICA in settings.DATABASES
+
+
+def alias_lettura():
+    """Alias da usare per le letture nel contesto corrente."""
+    if _lettura_su_replica.get() and replica_configurata():
+        return REPLICA
+    return 'default'
+
+
+def sola_lettura(queryset):
+    """Manda il queryset sulla replica se il contesto lo consente (utile fuori dalle view, es. export)."""
+    return queryset.using(alias_lettura())
+
+
+def _pinnata(request):
+    scadenza = request.COOKIES.get(COOKIE_PIN)
+    try:
+        return scadenza is not None and float(scadenza) > time.time()
+    except ValueError:
+        return False
+
+
+def usa_replica(view):
+    """Le GET della view leggono dalla replica (salvo pin read-your-own-writes attivo)."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or _pinnata(request):
+            return view(request, *args, **kwargs)
+
+        token = _lettura_su_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _lettura_su_replica.reset(token)
+
+    return wrapper
+
+
+class ReplicaPinMiddleware:
+    """Dopo ogni richiesta che scrive (POST & co.) imposta il cookie di pin sul primario."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and replica_configurata():
+            secondi = settings.REPLICA_PIN_SECONDI
+            response.set_cookie(COOKIE_PIN, str(time.time() + secondi), max_age=secondi, httponly=True, samesite='Lax')
+        return response
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        # Le sessioni cambiano a ogni login/logout: le leggo sempre dal primario
+        if model._meta.app_label == 'sessions':
+            return 'default'
+        return alias_lettura()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replica e primario contengono gli stessi dati
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -0,0 +1,143 @@
+"""
+Estratti conto mensili per studente (vedi 'manage.py genera_estratti').
+
+- UNA query raggruppabile: lezioni confermate del mese (tabella calda + archivio) ordinate per studente.
+- Per ogni studente calcolo un'impronta dei dati: se coincide con quella salvata l'estratto non si tocca,
+  quindi rigenerare un mese è idempotente e non rispedisce nulla.
+- Il render lavora su dati semplici (dict, Decimal, datetime): con molti studenti va in un process pool.
+"""
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import Lezione, LezioneArchiviata, EstrattoConto
+from .utils import html_a_testo
+
+TEMPLATE = 'emails/estratto_conto.html'
+# Da incrementare quando cambia il template: forza la rigenerazione di tutti gli estratti
+VERSIONE_MODELLO = 1
+
+_CAMPI = ('studente_id', 'studente__first_name', 'studente__last_name', 'studente__email',
+          'data_inizio', 'durata_ore', 'prezzo', 'pagata')
+
+
+def intervallo_mese(mese):
+    """Inizio (incluso) e fine (esclusa) del mese come datetime aware nel fuso locale."""
+    primo = mese.replace(day=1)
+    prossimo = (primo + timedelta(days=32)).replace(day=1)
+    tz = timezone.get_current_timezone()
+    return (timezone.make_aware(datetime.combine(primo, time.min), tz),
+            timezone.make_aware(datetime.combine(prossimo, time.min), tz))
+
+
+def dati_mese(mese):
+    """Un dict per studente con le lezioni confermate del mese e i totali. Una sola query (UNION)."""
+    inizio, fine = intervallo_mese(mese)
+    filtro = {'stato': 'CONFERMATA', 'data_inizio__gte': inizio, 'data_inizio__lt': fine}
+    # order_by() vuoto sulle due metà: SQLite non accetta ORDER BY dentro una UNION
+    righe = Lezione.objects.filter(**filtro).order_by().values_list(*_CAMPI).union(
+        LezioneArchiviata.objects.filter(**filtro).order_by().values_list(*_CAMPI), all=True
+    ).order_by('studente_id', 'data_inizio')
+
+    estratti = []
+    for studente_id, lezioni in groupby(righe, key=lambda r: r[0]):
+        lezioni = list(lezioni)
+        _, nome, cognome, email = lezioni[0][:4]
+        voci = [
+            {'data_inizio': inizio_l, 'durata_ore': durata, 'prezzo': prezzo or Decimal(0), 'pagata': pagata}
+            for _, _, _, _, inizio_l, durata, prezzo, pagata in lezioni
+        ]
+        estratti.append({
+            'studente_id': studente_id,
+            'studente': {'first_name': nome, 'last_name': cognome, 'email': email},
+            'mese': mese.replace(day=1),
+            'lezioni': voci,
+            'numero_lezioni': len(voci),
+            'ore': sum((v['durata_ore'] for v in voci), Decimal(0)),
+            'totale': sum((v['prezzo'] for v in voci), Decimal(0)),
+            'da_pagare': sum((v['prezzo'] for v in voci if not v['pagata']), Decimal(0)),
+        })
+    return estratti
+
+
+def impronta(dati):
+    serializzato = json.dumps([VERSIONE_MODELLO, dati], sort_keys=True, default=str)
+    return hashlib.sha256(serializzato.encode()).hexdigest()
+
+
+def render_estratto(dati):
+    """(studente_id, html, testo). Funzione di modulo, così il process pool la può serializzare."""
+    html = get_template(TEMPLATE).render(dati)
+    return dati['studente_id'], html, html_a_testo(html)
+
+
+def _inizializza_worker():
+    # Con lo start method 'spawn' (macOS/Windows) il processo figlio parte da zero
+    import django
+    django.setup()
+
+
+def renderizza(lista, processi=1, soglia_pool=100):
+    """Render di tutti gli estratti; oltre `soglia_pool` estratti e con più processi usa un pool."""
+    if processi > 1 and len(lista) >= soglia_pool:
+        with ProcessPoolExecutor(max_workers=processi, initializer=_inizializza_worker) as pool:
+            return list(pool.map(render_estratto, lista, chunksize=max(1, len(lista) // (processi * 4))))
+    return [render_estratto(dati) for dati in lista]
+
+
+def genera(mese, processi=1, forza=False):
+    """
+    Genera/aggiorna gli estratti del mese. Ritorna (creati_o_aggiornati, invariati, rimossi).
+    Un estratto rigenerato torna "da inviare"; quelli invariati mantengono la data di invio.
+    """
+    mese = mese.replace(day=1)
+    estratti = dati_mese(mese)
+    salvati = dict(EstrattoConto.objects.filter(mese=mese).values_list('studente_id', 'impronta'))
+
+    da_generare = []
+    impronte = {}
+    for dati in estratti:
+        impronte[dati['studente_id']] = impronta(dati)
+        if forza or salvati.get(dati['studente_id']) != impronte[dati['studente_id']]:
+            da_generare.append(dati)
+
+    adesso = timezone.now()
+    per_studente = {dati['studente_id']: dati for dati in da_generare}
+    oggetti = [
+        EstrattoConto(
+            studente_id=studente_id, mese=mese, html=html, testo=testo,
+            numero_lezioni=per_studente[studente_id]['numero_lezioni'],
+            ore=per_studente[studente_id]['ore'],
+            totale=per_studente[studente_id]['totale'],
+            da_pagare=per_studente[studente_id]['da_pagare'],
+            impronta=impronte[studente_id], generato_il=adesso, inviato_il=None,
+        )
+        for studente_id, html, testo in renderizza(da_generare, processi)
+    ]
+    if oggetti:
+        EstrattoConto.objects.bulk_create(
+            oggetti, update_conflicts=True, unique_fields=['studente', 'mese'],
+            update_fields=['numero_lezioni', 'ore', 'totale', 'da_pagare', 'html', 'testo',
+                           'impronta', 'generato_il', 'inviato_il'],
+        )
+
+    # Studenti che nel frattempo non hanno più lezioni nel mese: tolgo l'estratto se non è mai partito
+    rimossi, _ = EstrattoConto.objects.filter(mese=mese, inviato_il__isnull=True) \
+        .exclude(studente_id__in=list(impronte)).delete()
+
+    return len(oggetti), len(estratti) - len(oggetti), rimossi
+
+
+def mese_precedente(oggi=None):
+    oggi = oggi or timezone.localdate()
+    return (oggi.replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+def mese_da_stringa(valore):
+    return date(*map(int, valore.split('-')), 1)
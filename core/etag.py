@@ -0,0 +1,109 @@
+"""
+ETag "di versione" per le pagine che vengono ricaricate di continuo (dashboard e frammenti HTMX).
+
+Ogni pagina dipende da pochi scope di core.cache (es. 'studente:42', 'docente', 'calendario'),
+incrementati dai signal qui sotto quando cambiano i dati. L'ETag è fatto con le versioni degli scope:
+se il browser manda lo stesso If-None-Match, condition() risponde 304 prima di eseguire la view,
+quindi senza query e senza render. Il controllo costa una get_many sulla cache condivisa.
+
+Le scritture in blocco che saltano i signal (queryset.update, bulk_create) devono chiamare bump_dopo_commit
+a mano: il pagamento di un saldo passa da Movimento, che qui è coperto. Gli incrementi partono sempre
+dopo il commit: prima, una GET concorrente darebbe alla pagina vecchia l'ETag nuovo (e poi tanti 304 sbagliati).
+"""
+import time
+import zlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import versioni, bump_dopo_commit
+from .models import Lezione, Profilo, Disponibilita, GiornoChiusura, Impostazioni, Movimento
+
+SCOPE_DOCENTE = 'docente'
+SCOPE_CALENDARIO = 'calendario'
+SCOPE_ORARI = 'orari'  # lo stesso della heatmap: disponibilità e chiusure
+
+
+def scope_studente(user_id):
+    return f'studente:{user_id}'
+
+
+def _etag(request, scopes, *extra):
+    # Messaggi flash in attesa: la pagina va generata per mostrarli (e consumarli)
+    if hasattr(request, '_messages') and len(get_messages(request)):
+        return None
+    # Il token CSRF nei form della pagina in cache deve restare valido: dopo un login il cookie cambia
+    csrf = zlib.crc32(request.COOKIES.get(settings.CSRF_COOKIE_NAME, '').encode())
+    parti = [settings.ETAG_RILASCIO, *versioni(*scopes), csrf, *extra]
+    return '"' + '-'.join(str(p) for p in parti) + '"'
+
+
+def _mezzora():
+    # Le lezioni iniziano alle :00 e alle :30: a ogni mezz'ora una lezione può passare da "futura" a "passata"
+    return int(time.time() // 1800)
+
+
+def etag_dashboard(request, *args, **kwargs):
+    return _etag(request, [scope_studente(request.user.pk)], _mezzora())
+
+
+def etag_dashboard_docente(request, *args, **kwargs):
+    return _etag(request, [SCOPE_DOCENTE], _mezzora())
+
+
+def etag_orari(request, *args, **kwargs):
+    return _etag(request, [SCOPE_CALENDARIO, SCOPE_ORARI])
+
+
+def etag_prossimi_slot(request, *args, **kwargs):
+    # Gli slot già iniziati spariscono dalla lista: la mezz'ora corrente fa parte della versione
+    return _etag(request, [SCOPE_CALENDARIO, SCOPE_ORARI], _mezzora())
+
+
+# --- INVALIDAZIONE ---
+
+@receiver(post_save, sender=Lezione)
+@receiver(post_delete, sender=Lezione)
+def bump_lezione(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_dopo_commit(scope_studente(instance.studente_id), SCOPE_DOCENTE, SCOPE_CALENDARIO)
+
+
+@receiver(post_save, sender=Movimento)
+def bump_movimento(sender, instance, raw=False, **kwargs):
+    # Copre i saldi aggiornati in blocco (Movimento.salda, import CSV)
+    if raw:
+        return
+    bump_dopo_commit(scope_studente(instance.studente_id), SCOPE_DOCENTE)
+
+
+@receiver(post_save, sender=Profilo)
+@receiver(post_delete, sender=Profilo)
+def bump_profilo(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_dopo_commit(scope_studente(instance.user_id), SCOPE_DOCENTE)
+
+
+@receiver(post_save, sender=User)
+def bump_utente(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Il login salva solo last_login: nessuna pagina lo mostra
+    if raw or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    bump_dopo_commit(scope_studente(instance.pk), SCOPE_DOCENTE)
+
+
+@receiver(post_save, sender=Disponibilita)
+@receiver(post_delete, sender=Disponibilita)
+@receiver(post_save, sender=GiornoChiusura)
+@receiver(post_delete, sender=GiornoChiusura)
+@receiver(post_save, sender=Impostazioni)
+@receiver(post_delete, sender=Impostazioni)
+def bump_configurazione(sender, raw=False, **kwargs):
+    # 'orari' lo incrementa già la heatmap; la dashboard docente mostra orari, chiusure e tariffa
+    if not raw:
+        bump_dopo_commit(SCOPE_DOCENTE)
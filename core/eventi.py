@@ -0,0 +1,129 @@
+"""
+Notifiche live alla dashboard del docente via Server-Sent Events (solo sotto ASGI, vedi views.eventi_docente).
+
+Pub/sub in memoria: ogni browser dello staff collegato ha una asyncio.Queue sull'event loop del worker;
+i signal di Lezione pubblicano dopo il commit (da qualunque thread) con call_soon_threadsafe.
+L'evento porta già l'HTML della riga da inserire, generato una volta sola per tutti gli iscritti,
+e solo se qualcuno è collegato: senza dashboard aperte il costo è un controllo su un set.
+
+Limite: il pub/sub è per processo. Con più worker ASGI un browser riceve solo le lezioni salvate
+dal suo worker (le altre le vede al prossimo caricamento della pagina).
+"""
+import asyncio
+import json
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+
+from .models import Lezione
+from .righe import righe_lezioni
+
+MAX_CODA = 100
+# Commento SSE periodico: tiene aperta la connessione attraverso proxy e load balancer
+HEARTBEAT_SECONDI = 15
+RICONNESSIONE_MS = 5000
+
+_iscritti = set()
+_lock = threading.Lock()
+
+
+def iscrivi():
+    """Da chiamare dentro l'event loop: ritorna l'iscrizione da passare a disiscrivi()."""
+    iscrizione = (asyncio.get_running_loop(), asyncio.Queue(MAX_CODA))
+    with _lock:
+        _iscritti.add(iscrizione)
+    return iscrizione
+
+
+def disiscrivi(iscrizione):
+    with _lock:
+        _iscritti.discard(iscrizione)
+
+
+def ci_sono_iscritti():
+    return bool(_iscritti)
+
+
+def _consegna(coda, evento):
+    if coda.full():
+        # Browser che non legge più (tab in background, rete lenta): invece di perdere eventi a caso
+        # butto la coda e gli chiedo di ricaricare la pagina
+        while not coda.empty():
+            coda.get_nowait()
+        evento = {'tipo': 'ricarica'}
+    coda.put_nowait(evento)
+
+
+def pubblica(evento):
+    """Thread-safe: si può chiamare dai thread delle view sincrone."""
+    with _lock:
+        iscritti = list(_iscritti)
+    for loop, coda in iscritti:
+        try:
+            loop.call_soon_threadsafe(_consegna, coda, evento)
+        except RuntimeError:
+            # Event loop già chiuso (worker in spegnimento)
+            disiscrivi((loop, coda))
+
+
+def formatta(evento):
+    """Un evento nel formato SSE. I dati sono JSON su una riga: l'HTML non spezza il messaggio."""
+    dati = {k: v for k, v in evento.items() if k != 'tipo'}
+    return f"event: {evento['tipo']}\ndata: {json.dumps(dati)}\n\n"
+
+
+async def flusso():
+    """Generatore async per StreamingHttpResponse; la disconnessione del client lo cancella."""
+    # Iscrizione al primo giro, non alla creazione: una risposta mai trasmessa non lascia code appese
+    iscrizione = iscrivi()
+    _, coda = iscrizione
+    try:
+        yield f"retry: {RICONNESSIONE_MS}\n\n"
+        while True:
+            try:
+                evento = await asyncio.wait_for(coda.get(), HEARTBEAT_SECONDI)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield formatta(evento)
+    finally:
+        disiscrivi(iscrizione)
+
+
+def evento_lezione(lezione_id):
+    """
+    'richiesta' con la riga HTML se la lezione è (ancora) in attesa, altrimenti 'rimossa':
+    il browser la toglie dalla lista delle richieste se c'era.
+    """
+    righe = righe_lezioni(Lezione.objects.filter(pk=lezione_id))
+    lezione = righe[0] if righe else None
+    if lezione is None:
+        return {'tipo': 'rimossa', 'id': lezione_id, 'stato': None}
+    if lezione.stato != 'RICHIESTA':
+        return {'tipo': 'rimossa', 'id': lezione_id, 'stato': lezione.stato}
+    return {
+        'tipo': 'richiesta',
+        'id': lezione_id,
+        'stato': lezione.stato,
+        'html': render_to_string('core/partials/richiesta.html', {'lezione': lezione}),
+    }
+
+
+@receiver(post_save, sender=Lezione)
+def notifica_lezione_salvata(sender, instance, raw=False, **kwargs):
+    if raw or not ci_sono_iscritti():
+        return
+    lezione_id = instance.pk
+    # Dopo il commit: la riga letta da evento_lezione è quella definitiva (e un rollback non notifica nulla)
+    transaction.on_commit(lambda: pubblica(evento_lezione(lezione_id)))
+
+
+@receiver(post_delete, sender=Lezione)
+def notifica_lezione_eliminata(sender, instance, **kwargs):
+    if not ci_sono_iscritti():
+        return
+    evento = {'tipo': 'rimossa', 'id': instance.pk, 'stato': None}
+    transaction.on_commit(lambda: pubblica(evento))
@@ -0,0 +1,240 @@
+"""
+Heatmap di occupazione: giorno della settimana × mezz'ora.
+
+- Ore PRENOTATE: raggruppate in SQL per (giorno, ora, minuto di inizio, durata). Le righe che tornano
+  sono poche centinaia anche con anni di lezioni; le spalmo sulle mezz'ore in Python.
+- Ore OFFERTE: pura aritmetica. Conto quante volte cade ogni giorno della settimana nel periodo,
+  tolgo i giorni di chiusura e moltiplico per la sovrapposizione tra fascia Disponibilita e mezz'ora.
+  Nessun ciclo giorno per giorno sugli slot.
+- I mesi già chiusi vengono messi in cache (senza scadenza): un periodo di più anni costa una get_many
+  più il calcolo dei soli mesi di bordo/in corso.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import ExtractIsoWeekDay, ExtractHour, ExtractMinute
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import versione, bump_dopo_commit
+from .models import Lezione, LezioneArchiviata, Disponibilita, GiornoChiusura
+
+SLOT_MINUTI = 30
+SLOT_GIORNO = 24 * 60 // SLOT_MINUTI
+
+
+def _matrice_vuota():
+    return [[0.0] * SLOT_GIORNO for _ in range(7)]
+
+
+def _somma(destinazione, sorgente):
+    for g in range(7):
+        riga_d, riga_s = destinazione[g], sorgente[g]
+        for s in range(SLOT_GIORNO):
+            riga_d[s] += riga_s[s]
+
+
+def _spalma(matrice, giorno, inizio_minuti, durata_minuti, peso):
+    """Distribuisce `peso` × durata sulle mezz'ore coperte (in ore)."""
+    fine_minuti = min(inizio_minuti + durata_minuti, 24 * 60)
+    slot = inizio_minuti // SLOT_MINUTI
+    while slot < SLOT_GIORNO and slot * SLOT_MINUTI < fine_minuti:
+        inizio_slot = slot * SLOT_MINUTI
+        sovrapposizione = min(fine_minuti, inizio_slot + SLOT_MINUTI) - max(inizio_minuti, inizio_slot)
+        if sovrapposizione > 0:
+            matrice[giorno][slot] += peso * sovrapposizione / 60
+        slot += 1
+
+
+def _conta_giorni_settimana(dal, al):
+    """Quante volte cade ogni giorno della settimana in [dal, al], senza iterare sui giorni."""
+    conteggi = [0] * 7
+    totale = (al - dal).days + 1
+    if totale <= 0:
+        return conteggi
+    settimane, resto = divmod(totale, 7)
+    for g in range(7):
+        conteggi[g] = settimane
+    for i in range(resto):
+        conteggi[(dal.weekday() + i) % 7] += 1
+    return conteggi
+
+
+def _giorni_chiusi(dal, al):
+    """Giorni di chiusura per giorno della settimana, con gli intervalli sovrapposti fusi tra loro."""
+    intervalli = sorted(GiornoChiusura.objects.filter(
+        data_inizio__lte=al, data_fine__gte=dal
+    ).values_list('data_inizio', 'data_fine'))
+
+    conteggi = [0] * 7
+    corrente = None
+    for inizio, fine in intervalli + [(None, None)]:
+        if inizio is not None:
+            inizio, fine = max(inizio, dal), min(fine or inizio, al)
+        if corrente and inizio is not None and inizio <= corrente[1] + timedelta(days=1):
+            corrente = (corrente[0], max(corrente[1], fine))
+            continue
+        if corrente:
+            for g, n in enumerate(_conta_giorni_settimana(*corrente)):
+                conteggi[g] += n
+        corrente = (inizio, fine) if inizio is not None else None
+    return conteggi
+
+
+def _calcola(dal, al, orari_settimana):
+    """(prenotate, offerte) per il periodo [dal, al], entrambe matrici 7 × 48 in ore."""
+    prenotate = _matrice_vuota()
+    offerte = _matrice_vuota()
+
+    aperti = _conta_giorni_settimana(dal, al)
+    chiusi = _giorni_chiusi(dal, al)
+    for disp in orari_settimana:
+        giorni = aperti[disp.giorno] - chiusi[disp.giorno]
+        if giorni <= 0:
+            continue
+        inizio = disp.ora_inizio.hour * 60 + disp.ora_inizio.minute
+        fine = disp.ora_fine.hour * 60 + disp.ora_fine.minute
+        _spalma(offerte, disp.giorno, inizio, fine - inizio, giorni)
+
+    tz = timezone.get_current_timezone()
+    inizio = timezone.make_aware(datetime.combine(dal, time.min), tz)
+    fine = timezone.make_aware(datetime.combine(al + timedelta(days=1), time.min), tz)
+    # Su periodi lunghi buona parte delle lezioni sta nell'archivio: stessa GROUP BY su entrambe le tabelle
+    for modello in (Lezione, LezioneArchiviata):
+        gruppi = modello.objects.filter(
+            stato='CONFERMATA', data_inizio__gte=inizio, data_inizio__lt=fine,
+        ).annotate(
+            giorno=ExtractIsoWeekDay('data_inizio'),
+            ora=ExtractHour('data_inizio'),
+            minuto=ExtractMinute('data_inizio'),
+        ).order_by().values('giorno', 'ora', 'minuto', 'durata_ore').annotate(n=Count('id'))
+
+        for g in gruppi:
+            durata = float(g['durata_ore']) if g['durata_ore'] else 1.0
+            _spalma(prenotate, g['giorno'] - 1, g['ora'] * 60 + g['minuto'], round(durata * 60), g['n'])
+
+    return prenotate, offerte
+
+
+def _chiave_mese(anno, mese, versione_orari):
+    # La versione 'orari' cambia con disponibilità e chiusure: l'offerta di tutti i mesi va ricalcolata.
+    # Chi costruisce più chiavi la legge una volta sola e la passa qui
+    return f"heatmap:{anno}-{mese:02d}:v{versione_orari}"
+
+
+def _mesi(dal, al):
+    """Spezza [dal, al] in tratti mensili: (anno, mese, inizio, fine, mese_intero)."""
+    tratti = []
+    cursore = dal
+    while cursore <= al:
+        primo = cursore.replace(day=1)
+        prossimo = (primo + timedelta(days=32)).replace(day=1)
+        fine = min(al, prossimo - timedelta(days=1))
+        intero = cursore == primo and fine == prossimo - timedelta(days=1)
+        tratti.append((primo.year, primo.month, cursore, fine, intero))
+        cursore = fine + timedelta(days=1)
+    return tratti
+
+
+def occupazione(dal, al):
+    """
+    Ritorna (prenotate, offerte) in ore per giorno × mezz'ora nel periodo [dal, al].
+    I mesi interi già conclusi vengono letti/scritti in cache.
+    """
+    oggi = timezone.localdate()
+    orari_settimana = None
+
+    versione_orari = versione('orari')
+    tratti = [(_chiave_mese(anno, mese, versione_orari), inizio, fine, intero and fine < oggi)
+              for anno, mese, inizio, fine, intero in _mesi(dal, al)]
+    # Una lettura della versione e una get_many, qualunque sia la lunghezza del periodo
+    in_cache = cache.get_many([chiave for chiave, _, _, chiuso in tratti if chiuso])
+
+    prenotate = _matrice_vuota()
+    offerte = _matrice_vuota()
+    da_salvare = {}
+    for chiave, inizio, fine, chiuso in tratti:
+        if chiave in in_cache:
+            p, o = in_cache[chiave]
+        else:
+            if orari_settimana is None:
+                # Letti solo se c'è almeno un mese da calcolare: con tutto in cache la view non fa query
+                orari_settimana = list(Disponibilita.objects.all())
+            p, o = _calcola(inizio, fine, orari_settimana)
+            if chiuso:
+                da_salvare[chiave] = (p, o)
+        _somma(prenotate, p)
+        _somma(offerte, o)
+
+    if da_salvare:
+        cache.set_many(da_salvare, timeout=None)
+
+    return prenotate, offerte
+
+
+def righe_heatmap(prenotate, offerte):
+    """Righe pronte per il template: solo le mezz'ore in cui c'è offerta o almeno una prenotazione."""
+    righe = []
+    for slot in range(SLOT_GIORNO):
+        if not any(offerte[g][slot] or prenotate[g][slot] for g in range(7)):
+            continue
+        celle = []
+        for g in range(7):
+            offerta = offerte[g][slot]
+            prenotata = prenotate[g][slot]
+            tasso = prenotata / offerta if offerta else (1.0 if prenotata else None)
+            celle.append({
+                'prenotate': prenotata,
+                'offerte': offerta,
+                'percentuale': round(tasso * 100) if tasso is not None else None,
+                # Opacità del colore di sfondo: satura al 100% (lezioni fuori orario possono superarlo)
+                'alfa': f"{min(tasso, 1.0):.2f}" if tasso is not None else None,
+            })
+        minuti = slot * SLOT_MINUTI
+        righe.append({'orario': f"{minuti // 60:02d}:{minuti % 60:02d}", 'celle': celle})
+    return righe
+
+
+def invalida_mesi(date_lezioni):
+    """
+    Invalida i mesi toccati (anche per le scritture in blocco: bulk_create salta i signal).
+    Dopo il commit: se cancellassi prima, una richiesta concorrente rimetterebbe in cache il mese coi dati vecchi.
+    """
+    mesi = {(d.year, d.month) for d in date_lezioni}
+
+    def cancella():
+        versione_orari = versione('orari')
+        cache.delete_many([_chiave_mese(anno, mese, versione_orari) for anno, mese in mesi])
+
+    if mesi:
+        transaction.on_commit(cancella)
+
+
+@receiver(post_save, sender=Lezione)
+@receiver(post_delete, sender=Lezione)
+def invalida_mese_lezione(sender, instance, raw=False, **kwargs):
+    # Una modifica a una lezione di un mese già chiuso (es. conferma tardiva) invalida solo quel mese;
+    # se la lezione è stata spostata di mese anche quello di partenza (data com'era nel DB prima del save)
+    if raw:
+        return
+    prima = getattr(instance, '_salvata_prima', None) or {}
+    primo_del_mese = timezone.localdate().replace(day=1)
+    mesi = set()
+    for data_inizio in (instance.data_inizio, prima.get('data_inizio')):
+        if data_inizio is not None:
+            locale = timezone.localtime(data_inizio)
+            if date(locale.year, locale.month, 1) <= primo_del_mese:
+                mesi.add((locale.year, locale.month))
+    if mesi:
+        invalida_mesi(date(anno, mese, 1) for anno, mese in mesi)
+
+
+@receiver(post_save, sender=Disponibilita)
+@receiver(post_delete, sender=Disponibilita)
+@receiver(post_save, sender=GiornoChiusura)
+@receiver(post_delete, sender=GiornoChiusura)
+def invalida_orari(sender, **kwargs):
+    bump_dopo_commit('orari')
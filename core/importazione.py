@@ -0,0 +1,252 @@
+"""
+Import in blocco di studenti e lezioni storiche da CSV (vedi 'manage.py importa_csv').
+
+Una riga = una lezione con i dati del suo studente; le colonne della lezione vuote importano solo lo studente.
+Il file viene letto in streaming e processato a blocchi: per ogni blocco poche query fisse
+(utenti esistenti, lezioni già presenti, bulk_create), qualunque sia il numero di righe.
+
+bulk_create non manda i post_save, quindi qui faccio a mano quello che farebbero i signal:
+Profilo per i nuovi utenti, prezzo e saldo delle lezioni, registro delle variazioni, indice di ricerca,
+cache della heatmap ed ETag.
+"""
+import csv
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import DecimalValidator, validate_email
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import etag, heatmap, search
+from .cache import bump_dopo_commit
+from .models import Lezione, Movimento, Profilo, Impostazioni, VariazioneLezione
+
+COLONNE_STUDENTE = ['username', 'email', 'first_name', 'last_name', 'telefono', 'scuola', 'indirizzo',
+                    'tariffa_specifica']
+COLONNE_LEZIONE = ['data', 'ora', 'durata_ore', 'luogo', 'stato', 'pagata', 'note', 'prezzo']
+
+_LUOGHI = {chiave for chiave, _ in Lezione.LUOGO_SCELTE}
+_STATI = {chiave for chiave, _ in Lezione.STATO_SCELTE}
+_VERO = {'1', 'si', 'sì', 'true', 'x', 'y', 'yes'}
+
+
+@dataclass
+class Resoconto:
+    righe: int = 0
+    studenti_creati: int = 0
+    lezioni_create: int = 0
+    lezioni_gia_presenti: int = 0
+    errori: list = field(default_factory=list)
+
+
+def _decimale(valore, campo, minimo=None):
+    """
+    Numero per il DecimalField `campo`: scarto nan/inf e i valori che non ci stanno (cifre o decimali),
+    così l'errore finisce sulla sua riga e non fa saltare il bulk_create di tutto il blocco.
+    """
+    nome = campo.name
+    try:
+        numero = Decimal(valore.replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"{nome} non valido: '{valore}'")
+    if not numero.is_finite():
+        raise ValueError(f"{nome} non valido: '{valore}'")
+    try:
+        DecimalValidator(campo.max_digits, campo.decimal_places)(numero)
+    except ValidationError:
+        raise ValueError(f"{nome} fuori formato: '{valore}' (massimo {campo.max_digits} cifre, "
+                         f"{campo.decimal_places} decimali)")
+    if minimo is not None and numero < minimo:
+        raise ValueError(f"{nome} deve essere almeno {minimo}")
+    return numero
+
+
+def _valida(riga):
+    """Ritorna (studente, lezione|None) come dict puliti, o solleva ValueError col motivo."""
+    dati = {k: (v or '').strip() for k, v in riga.items() if k}
+
+    username = dati.get('username')
+    if not username:
+        raise ValueError("username mancante")
+    studente = {k: dati.get(k, '') for k in COLONNE_STUDENTE}
+    if studente['email']:
+        try:
+            validate_email(studente['email'])
+        except ValidationError:
+            raise ValueError(f"email non valida: '{studente['email']}'")
+    studente['tariffa_specifica'] = (
+        _decimale(studente['tariffa_specifica'], Profilo._meta.get_field('tariffa_specifica'), 0)
+        if studente['tariffa_specifica'] else None
+    )
+
+    if not dati.get('data'):
+        return studente, None
+
+    try:
+        inizio = datetime.strptime(f"{dati['data']} {dati.get('ora') or '00:00'}", "%Y-%m-%d %H:%M")
+    except ValueError:
+        raise ValueError(f"data/ora non valide: '{dati['data']} {dati.get('ora', '')}' (atteso YYYY-MM-DD HH:MM)")
+
+    luogo = (dati.get('luogo') or 'BASE').upper()
+    if luogo not in _LUOGHI:
+        raise ValueError(f"luogo sconosciuto: '{luogo}'")
+    stato = (dati.get('stato') or 'CONFERMATA').upper()
+    if stato not in _STATI:
+        raise ValueError(f"stato sconosciuto: '{stato}'")
+
+    durata = _decimale(dati.get('durata_ore') or '1', Lezione._meta.get_field('durata_ore'), Decimal('0.5'))
+
+    lezione = {
+        'data_inizio': timezone.make_aware(inizio),
+        'durata_ore': durata,
+        'luogo': luogo,
+        'stato': stato,
+        'pagata': dati.get('pagata', '').lower() in _VERO,
+        'note': dati.get('note') or None,
+        'prezzo': _decimale(dati['prezzo'], Lezione._meta.get_field('prezzo'), 0) if dati.get('prezzo') else None,
+    }
+    return studente, lezione
+
+
+def _crea_studenti(nuovi, dry_run):
+    """Crea User + Profilo per i dati in `nuovi` (username -> dict). Ritorna gli User creati."""
+    utenti = []
+    for studente in nuovi.values():
+        user = User(username=studente['username'], email=studente['email'],
+                    first_name=studente['first_name'], last_name=studente['last_name'])
+        # Nessuna password: lo studente la imposterà con il reset via email
+        user.set_unusable_password()
+        utenti.append(user)
+    if dry_run:
+        return utenti
+
+    User.objects.bulk_create(utenti)
+    # Su SQLite recente bulk_create valorizza già gli id (RETURNING); altrimenti li rileggo
+    if any(u.pk is None for u in utenti):
+        utenti = list(User.objects.filter(username__in=list(nuovi)))
+
+    profili = Profilo.objects.bulk_create([
+        Profilo(
+            user=u,
+            telefono=nuovi[u.username]['telefono'] or None,
+            scuola=nuovi[u.username]['scuola'] or None,
+            indirizzo=nuovi[u.username]['indirizzo'] or None,
+            tariffa_specifica=nuovi[u.username]['tariffa_specifica'],
+        )
+        for u in utenti
+    ])
+    for user, profilo in zip(utenti, profili):
+        user.profilo = profilo
+    return utenti
+
+
+def _importa_blocco(blocco, tariffa_globale, dry_run):
+    """`blocco` è una lista di (numero_riga, studente, lezione). Ritorna (studenti, lezioni, già presenti)."""
+    usernames = {studente['username'] for _, studente, _ in blocco}
+    utenti = {u.username: u for u in User.objects.filter(username__in=usernames).select_related('profilo')}
+
+    # 1. Studenti nuovi: la prima riga di ogni username decide i dati anagrafici
+    nuovi = {}
+    for _, studente, _ in blocco:
+        if studente['username'] not in utenti:
+            nuovi.setdefault(studente['username'], studente)
+    creati = _crea_studenti(nuovi, dry_run) if nuovi else []
+    utenti.update({u.username: u for u in creati})
+
+    # 2. Lezioni, saltando quelle già presenti (stesso studente, stesso inizio): l'import si può rilanciare
+    righe_lezione = [(studente, lezione) for _, studente, lezione in blocco if lezione is not None]
+    esistenti = set()
+    ids = {utenti[s['username']].pk for s, _ in righe_lezione} - {None}
+    if ids:
+        date = [l['data_inizio'] for _, l in righe_lezione]
+        esistenti = set(Lezione.objects.filter(
+            studente_id__in=ids, data_inizio__gte=min(date), data_inizio__lte=max(date)
+        ).values_list('studente_id', 'data_inizio'))
+
+    adesso = timezone.now()
+    lezioni = []
+    gia_presenti = 0
+    for studente, dati in righe_lezione:
+        user = utenti[studente['username']]
+        chiave = (user.pk, dati['data_inizio'])
+        if user.pk and chiave in esistenti:
+            gia_presenti += 1
+            continue
+        esistenti.add(chiave)
+
+        # Prezzo come in Lezione.save(), ma con le tariffe già in memoria: zero query per riga
+        if dati['prezzo'] is None:
+            profilo = getattr(user, 'profilo', None)
+            tariffa = profilo.tariffa_specifica if profilo and profilo.tariffa_specifica else tariffa_globale
+            dati = {**dati, 'prezzo': Lezione.calcola_prezzo(tariffa, dati['durata_ore'], dati['luogo'])}
+
+        # Le lezioni importate non devono finire nel digest del docente
+        lezioni.append(Lezione(studente=user, notifica_docente_il=adesso, **dati))
+
+    if not dry_run:
+        Lezione.objects.bulk_create(lezioni)
+        Movimento.addebita_in_blocco(lezioni, nota="Import CSV")
+        VariazioneLezione.registra_creazioni(lezioni)
+        heatmap.invalida_mesi(timezone.localtime(l.data_inizio) for l in lezioni)
+        bump_dopo_commit(*{etag.scope_studente(l.studente_id) for l in lezioni},
+                         etag.SCOPE_DOCENTE, etag.SCOPE_CALENDARIO)
+        search.indicizza_in_blocco(creati, [l for l in lezioni if l.pk])
+
+    return len(creati), len(lezioni), gia_presenti
+
+
+def importa_csv(file, batch=1000, dry_run=False):
+    """
+    Importa da un file CSV già aperto (testo). Ritorna un Resoconto con gli errori riga per riga.
+    Ogni blocco sta in una transazione: un errore SQL annulla solo il suo blocco.
+    """
+    resoconto = Resoconto()
+    tariffa_globale = Impostazioni.tariffa_corrente()
+
+    lettore = csv.DictReader(file, delimiter=_delimitatore(file))
+    mancanti = {'username'} - set(lettore.fieldnames or [])
+    if mancanti:
+        resoconto.errori.append((1, f"colonne obbligatorie mancanti: {', '.join(sorted(mancanti))}"))
+        return resoconto
+
+    blocco = []
+    for riga in lettore:
+        resoconto.righe += 1
+        numero = lettore.line_num
+        try:
+            studente, lezione = _valida(riga)
+        except ValueError as e:
+            resoconto.errori.append((numero, str(e)))
+            continue
+        blocco.append((numero, studente, lezione))
+
+        if len(blocco) >= batch:
+            _esegui_blocco(blocco, tariffa_globale, resoconto, dry_run)
+            blocco = []
+
+    if blocco:
+        _esegui_blocco(blocco, tariffa_globale, resoconto, dry_run)
+    return resoconto
+
+
+def _esegui_blocco(blocco, tariffa_globale, resoconto, dry_run):
+    try:
+        with transaction.atomic():
+            studenti, lezioni, gia_presenti = _importa_blocco(blocco, tariffa_globale, dry_run)
+    except DatabaseError as e:
+        resoconto.errori.append((blocco[0][0], f"blocco righe {blocco[0][0]}-{blocco[-1][0]} annullato: {e}"))
+        return
+    resoconto.studenti_creati += studenti
+    resoconto.lezioni_create += lezioni
+    resoconto.lezioni_gia_presenti += gia_presenti
+
+
+def _delimitatore(file):
+    """Excel in italiano esporta con ';': lo riconosco dalla prima riga senza consumare il file."""
+    posizione = file.tell()
+    intestazione = file.readline()
+    file.seek(posizione)
+    return ';' if intestazione.count(';') > intestazione.count(',') else ','
@@ -0,0 +1,82 @@
+"""
+Rate limiting a token bucket per gli endpoint pubblici (es. la select HTMX degli orari).
+
+Ogni client (utente loggato, altrimenti IP) ha un secchio di `capacita` gettoni che si ricarica
+di `ricarica` gettoni al secondo; ogni richiesta ne consuma uno, a secchio vuoto si risponde 429.
+Lo stato è una tupla (gettoni, istante) nella cache condivisa: una get e una set per richiesta.
+Get+set non è atomico tra worker: con richieste davvero simultanee qualcuna può passare in più,
+per un limite anti-raffica va benissimo.
+"""
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+PREFISSO = 'limite:'
+
+
+def identita(request, user=None):
+    """L'utente se loggato, altrimenti l'IP del client (dietro proxy: l'hop aggiunto dal primo proxy fidato)."""
+    if user is not None and user.is_authenticated:
+        return f'u{user.pk}'
+    proxy = settings.LIMITE_PROXY_FIDATI
+    if proxy:
+        hop = [h.strip() for h in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if h.strip()]
+        if len(hop) >= proxy:
+            return f'ip{hop[-proxy]}'
+    return f"ip{request.META.get('REMOTE_ADDR', '')}"
+
+
+def consuma(chiave, capacita, ricarica):
+    """Prova a prendere un gettone. Ritorna 0 se la richiesta passa, altrimenti i secondi da aspettare."""
+    adesso = time.time()
+    stato = cache.get(PREFISSO + chiave)
+    gettoni, ultimo = stato if stato else (capacita, adesso)
+    gettoni = min(capacita, gettoni + (adesso - ultimo) * ricarica)
+
+    attesa = 0 if gettoni >= 1 else (1 - gettoni) / ricarica
+    if not attesa:
+        gettoni -= 1
+    # Scade quando il secchio sarebbe comunque di nuovo pieno: i client spariti non restano in cache
+    cache.set(PREFISSO + chiave, (gettoni, adesso), timeout=math.ceil(capacita / ricarica) + 1)
+    return attesa
+
+
+def _troppe_richieste(attesa):
+    response = HttpResponse("<option value=''>Troppe richieste, riprova tra poco</option>", status=429)
+    response['Retry-After'] = str(math.ceil(attesa))
+    return response
+
+
+def limita(scope, capacita=None, ricarica=None):
+    """
+    Decoratore per view sync e async. Default da settings.LIMITE_CAPACITA / LIMITE_RICARICA.
+    Va messo sopra condition(): anche le richieste che finirebbero in 304 consumano un gettone.
+    """
+    def decoratore(view):
+        def attesa(request, user):
+            return consuma(f'{scope}:{identita(request, user)}',
+                           capacita or settings.LIMITE_CAPACITA, ricarica or settings.LIMITE_RICARICA)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def avvolta(request, *args, **kwargs):
+                # request.user caricherebbe la sessione in modo sincrono: dentro l'event loop serve auser()
+                user = await request.auser() if hasattr(request, 'auser') else None
+                secondi = attesa(request, user)
+                if secondi:
+                    return _troppe_richieste(secondi)
+                return await view(request, *args, **kwargs)
+        else:
+            @wraps(view)
+            def avvolta(request, *args, **kwargs):
+                secondi = attesa(request, getattr(request, 'user', None))
+                if secondi:
+                    return _troppe_richieste(secondi)
+                return view(request, *args, **kwargs)
+        return avvolta
+    return decoratore
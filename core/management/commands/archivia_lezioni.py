@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Lezione, LezioneArchiviata, VariazioneLezione
+
+
+class Command(BaseCommand):
+    help = "Sposta in archivio le lezioni rifiutate o già pagate più vecchie dell'orizzonte configurato."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--giorni', type=int, default=settings.ARCHIVIO_ORIZZONTE_GIORNI,
+                            help="Archivia le lezioni iniziate più di N giorni fa")
+        parser.add_argument('--batch', type=int, default=settings.ARCHIVIO_BATCH_SIZE,
+                            help="Righe spostate per ogni transazione")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Conta soltanto, senza spostare nulla")
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(days=options['giorni'])
+        batch = max(1, options['batch'])
+
+        # Candidate: rifiutate vecchie oppure confermate e già saldate.
+        # Le confermate non pagate restano nella tabella calda finché non vengono saldate.
+        candidate = Lezione.objects.filter(data_inizio__lt=limite).filter(
+            Q(stato='RIFIUTATA') | Q(stato='CONFERMATA', pagata=True)
+        ).order_by('id')
+
+        if options['dry_run']:
+            self.stdout.write(f"Da archiviare: {candidate.count()} lezioni (prima del {limite:%d/%m/%Y}).")
+            return
+
+        totale = 0
+        while True:
+            # Un batch per transazione: i lock su SQLite durano poco e le prenotazioni non restano bloccate
+            with transaction.atomic():
+                lezioni = list(candidate[:batch])
+                if not lezioni:
+                    break
+
+                LezioneArchiviata.objects.bulk_create([LezioneArchiviata.da_lezione(l) for l in lezioni])
+                with VariazioneLezione.archiviazione():
+                    Lezione.objects.filter(id__in=[l.id for l in lezioni]).delete()
+
+            totale += len(lezioni)
+            self.stdout.write(f"  ... {totale} lezioni archiviate")
+
+        self.stdout.write(self.style.SUCCESS(f"Archiviazione completata: {totale} lezioni spostate."))
@@ -0,0 +1,110 @@
+import gzip
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+PREFISSO = 'db-'
+
+
+class Command(BaseCommand):
+    help = ("Backup a caldo del database SQLite con l'API di backup online: copia poche pagine per volta "
+            "con una pausa tra un passo e l'altro, così le prenotazioni non restano bloccate. "
+            "Verifica la copia con PRAGMA integrity_check, opzionalmente la comprime e ruota i vecchi backup.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--destinazione', default=settings.BACKUP_DIR, help="Cartella dei backup")
+        parser.add_argument('--pagine', type=int, default=256,
+                            help="Pagine copiate per passo (il lock in lettura dura solo il passo)")
+        parser.add_argument('--pausa', type=float, default=0.05, help="Secondi di pausa tra un passo e l'altro")
+        parser.add_argument('--comprimi', action='store_true', help="Salva il backup come .sqlite3.gz")
+        parser.add_argument('--conserva', type=int, default=settings.BACKUP_CONSERVA,
+                            help="Quanti backup tenere (0 = nessuna rotazione)")
+        parser.add_argument('--database', default='default', help="Alias del database da copiare")
+
+    def handle(self, *args, **options):
+        connessione = connections[options['database']]
+        if connessione.vendor != 'sqlite':
+            raise CommandError("Il backup online è disponibile solo per SQLite.")
+
+        sorgente_path = Path(connessione.settings_dict['NAME'])
+        if not sorgente_path.exists():
+            raise CommandError(f"Database non trovato: {sorgente_path}")
+
+        cartella = Path(options['destinazione'])
+        cartella.mkdir(parents=True, exist_ok=True)
+        nome = f"{PREFISSO}{timezone.localtime():%Y%m%d-%H%M%S}.sqlite3"
+        parziale = cartella / f"{nome}.part"
+
+        inizio = time.perf_counter()
+        passi = 0
+
+        def avanzamento(status, rimanenti, totali):
+            nonlocal passi
+            passi += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  ... {totali - rimanenti}/{totali} pagine")
+            # Tra un passo e l'altro il lock in lettura è rilasciato: in questa pausa scrivono le view.
+            # (Il parametro sleep di backup() agisce solo se il DB risponde BUSY, non tra i passi.)
+            if rimanenti and options['pausa'] > 0:
+                time.sleep(options['pausa'])
+
+        # Connessioni sqlite3 dedicate: quella di Django resta libera e il backup non entra nelle sue transazioni
+        sorgente = sqlite3.connect(sorgente_path)
+        destinazione = sqlite3.connect(parziale)
+        try:
+            sorgente.backup(destinazione, pages=max(1, options['pagine']), progress=avanzamento)
+            esito = destinazione.execute('PRAGMA integrity_check').fetchone()[0]
+        except sqlite3.Error as e:
+            parziale.unlink(missing_ok=True)
+            raise CommandError(f"Backup fallito: {e}")
+        finally:
+            destinazione.close()
+            sorgente.close()
+
+        if esito != 'ok':
+            parziale.unlink(missing_ok=True)
+            raise CommandError(f"Copia corrotta, scartata (integrity_check: {esito})")
+        copia_secondi = time.perf_counter() - inizio
+        dimensione = parziale.stat().st_size
+
+        if options['comprimi']:
+            nome += '.gz'
+            compresso = cartella / f"{nome}.part"
+            with open(parziale, 'rb') as f_in, gzip.open(compresso, 'wb', compresslevel=6) as f_out:
+                shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+            parziale.unlink()
+            parziale = compresso
+
+        # Il nome definitivo compare solo a backup completo e verificato
+        finale = parziale.rename(cartella / nome)
+        durata = time.perf_counter() - inizio
+
+        rimossi = self._ruota(cartella, options['conserva'])
+
+        mb = dimensione / (1024 * 1024)
+        self.stdout.write(self.style.SUCCESS(
+            f"Backup {finale} ({mb:.1f} MB, {passi} passi) in {durata:.2f}s - "
+            f"copia {mb / copia_secondi if copia_secondi else 0:.1f} MB/s"
+            + (f", compresso a {finale.stat().st_size / (1024 * 1024):.1f} MB" if options['comprimi'] else "")
+            + (f". Rimossi {rimossi} backup vecchi." if rimossi else ".")
+        ))
+
+    @staticmethod
+    def _ruota(cartella, conserva):
+        if conserva <= 0:
+            return 0
+        # Il timestamp nel nome rende l'ordine alfabetico uguale a quello cronologico
+        backup = sorted(
+            p for p in cartella.iterdir()
+            if p.name.startswith(PREFISSO) and p.name.endswith(('.sqlite3', '.sqlite3.gz'))
+        )
+        vecchi = backup[:-conserva]
+        for p in vecchi:
+            p.unlink()
+        return len(vecchi)
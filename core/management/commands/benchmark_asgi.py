@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, AsyncClient, override_settings
+from django.urls import path
+from django.utils import timezone
+
+from core import views
+
+# URLconf privata del benchmark: espone entrambe le versioni dell'endpoint, indipendentemente da USA_VIEW_ASYNC
+urlpatterns = [
+    path('sync/', views.get_orari_disponibili),
+    path('async/', views.get_orari_disponibili_async),
+]
+
+
+class Command(BaseCommand):
+    help = ("Confronta il throughput dell'endpoint HTMX degli orari: view sincrona sul percorso WSGI "
+            "(pool di thread) contro view async sul percorso ASGI (un solo event loop).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--richieste', type=int, default=500, help="Richieste totali per ogni percorso")
+        parser.add_argument('--concorrenza', type=int, default=20, help="Thread (WSGI) o coroutine (ASGI) in parallelo")
+        parser.add_argument('--data', help="Data da interrogare (YYYY-MM-DD), default: domani")
+
+    def handle(self, *args, **options):
+        data = options['data'] or (timezone.localdate() + timedelta(days=1)).isoformat()
+        totale = options['richieste']
+        concorrenza = options['concorrenza']
+
+        # Tutte le richieste arrivano dallo stesso client anonimo: il rate limit (core/limiti.py) le
+        # fermerebbe dopo LIMITE_CAPACITA e si misurerebbe la velocità dei 429. Qui il secchio (uno solo per
+        # entrambi i percorsi: stesso scope, stesso IP) basta per tutte le richieste
+        with override_settings(ROOT_URLCONF=__name__, LIMITE_CAPACITA=2 * totale):
+            durata_wsgi, stati_wsgi = self._bench_wsgi(f'/sync/?data={data}', totale, concorrenza)
+            durata_asgi, stati_asgi = asyncio.run(self._bench_asgi(f'/async/?data={data}', totale, concorrenza))
+
+        errori = {nome: stati for nome, stati in (('WSGI', stati_wsgi), ('ASGI', stati_asgi)) if set(stati) != {200}}
+        if errori:
+            # Tempi su risposte d'errore non dicono niente sull'endpoint
+            raise CommandError("Risposte diverse da 200: " + ", ".join(
+                f"{nome} {dict(sorted(stati.items()))}" for nome, stati in errori.items()))
+
+        self.stdout.write(f"Data interrogata: {data} - {totale} richieste, concorrenza {concorrenza}")
+        for nome, durata in (('WSGI (sync)', durata_wsgi), ('ASGI (async)', durata_asgi)):
+            self.stdout.write(f"  {nome:<13} {durata:6.2f}s  {totale / durata:8.1f} req/s")
+
+    def _bench_wsgi(self, url, totale, concorrenza):
+        def worker(n):
+            # Un Client per thread: l'handler WSGI di test non è pensato per essere condiviso
+            client = Client()
+            return Counter(client.get(url).status_code for _ in range(n))
+
+        quote = self._dividi(totale, concorrenza)
+        inizio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concorrenza) as pool:
+            stati = sum(pool.map(worker, quote), Counter())
+        return time.perf_counter() - inizio, stati
+
+    async def _bench_asgi(self, url, totale, concorrenza):
+        client = AsyncClient()
+
+        async def worker(n):
+            return Counter([(await client.get(url)).status_code for _ in range(n)])
+
+        inizio = time.perf_counter()
+        stati = await asyncio.gather(*(worker(n) for n in self._dividi(totale, concorrenza)))
+        return time.perf_counter() - inizio, sum(stati, Counter())
+
+    @staticmethod
+    def _dividi(totale, parti):
+        base, resto = divmod(totale, parti)
+        return [base + (1 if i < resto else 0) for i in range(parti)]
@@ -0,0 +1,297 @@
+import http.cookiejar
+import random
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import time as ora, timedelta
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, OperationalError
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Lezione, Disponibilita
+
+PREFISSO_UTENTI = 'carico_'
+_RE_OPZIONE = re.compile(r"<option value='(\d\d:\d\d)'>")
+_RE_CSRF = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class _Risultati:
+    """Raccoglie latenze ed esiti da tutti i thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latenze = defaultdict(list)
+        self.errori_lock = 0
+        self.errori = 0
+        self.prenotate = 0
+        self.rifiutate = 0
+        self.limitate = 0
+
+    def registra(self, endpoint, durata, esito):
+        with self._lock:
+            if esito == 'limitata':
+                # Un 429 misura il rate limit, non l'endpoint: lo conto a parte e fuori dalle latenze
+                self.limitate += 1
+                return
+            self.latenze[endpoint].append(durata)
+            if esito == 'lock':
+                self.errori_lock += 1
+            elif esito == 'errore':
+                self.errori += 1
+            elif esito == 'prenotata':
+                self.prenotate += 1
+            elif esito == 'rifiutata':
+                self.rifiutate += 1
+
+
+class _SessioneClient:
+    """Test client in-process: niente rete, misura solo Django + SQLite."""
+
+    def __init__(self, utente):
+        self.client = Client()
+        self.client.force_login(utente)
+
+    def richiesta(self, metodo, percorso, dati=None):
+        try:
+            response = getattr(self.client, metodo)(percorso, dati or {})
+        except OperationalError as e:
+            # Il client rilancia le eccezioni della view: qui si vedono i "database is locked"
+            return 'lock' if 'locked' in str(e) else 'errore', ''
+        return response.status_code, response.content.decode()
+
+
+class _SessioneHttp:
+    """Un browser minimale (cookie + CSRF) verso un server già avviato."""
+
+    def __init__(self, base, username, password):
+        self.base = base.rstrip('/')
+        self.cookie = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookie))
+        _, pagina = self.richiesta('get', reverse('login'))
+        self.richiesta('post', reverse('login'), {
+            'username': username, 'password': password, 'csrfmiddlewaretoken': self._token(pagina),
+        })
+
+    def _token(self, pagina=''):
+        trovato = _RE_CSRF.search(pagina)
+        if trovato:
+            return trovato.group(1)
+        return next((c.value for c in self.cookie if c.name == 'csrftoken'), '')
+
+    def richiesta(self, metodo, percorso, dati=None):
+        url = self.base + percorso
+        corpo = None
+        if metodo == 'get' and dati:
+            url += '?' + urllib.parse.urlencode(dati)
+        elif metodo == 'post':
+            dati = dict(dati or {})
+            dati.setdefault('csrfmiddlewaretoken', self._token())
+            corpo = urllib.parse.urlencode(dati).encode()
+        req = urllib.request.Request(url, data=corpo, headers={'Referer': url})
+        try:
+            with self.opener.open(req, timeout=30) as r:
+                # urllib segue i redirect: li riconosco dall'URL finale, come farebbe il test client col 302
+                return 302 if r.geturl() != url else r.status, r.read().decode()
+        except urllib.error.HTTPError as e:
+            # Da fuori non si distingue un lock da un altro 500: finiscono tutti negli errori
+            return e.code, ''
+        except urllib.error.URLError:
+            return 'errore', ''
+
+
+class Command(BaseCommand):
+    help = ("Test di carico del flusso di prenotazione: N studenti in parallelo chiedono gli orari, prenotano "
+            "e aprono la dashboard mentre il docente consulta la sua. Riporta throughput, latenze p50/p95/p99, "
+            "errori di lock di SQLite e doppie prenotazioni. Di default gira col test client su un DB SQLite "
+            "temporaneo; con --server colpisce un server avviato (e semina gli utenti nel DB configurato).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--studenti', type=int, default=20, help="Studenti simulati (un thread ciascuno)")
+        parser.add_argument('--iterazioni', type=int, default=10,
+                            help="Giri orari -> prenota -> dashboard per ogni studente")
+        parser.add_argument('--docenti', type=int, default=1,
+                            help="Thread che aprono dashboard_docente finché gli studenti non finiscono")
+        parser.add_argument('--giorni', type=int, default=3,
+                            help="Su quanti giorni distribuire le prenotazioni (meno giorni = più contesa)")
+        parser.add_argument('--server', help="URL di un server avviato (es. http://127.0.0.1:8000)")
+        parser.add_argument('--seed', type=int, default=None, help="Seme per scelte riproducibili")
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+
+        if options['server']:
+            self.stdout.write(self.style.WARNING(
+                f"Modalità server: utenti '{PREFISSO_UTENTI}*' creati nel DB configurato e rimossi alla fine."))
+            self._esegui(options)
+            return
+
+        # DB usa-e-getta su file (non in memoria): il locking di SQLite è quello vero
+        cartella = tempfile.mkdtemp(prefix='carico_')
+        connection.settings_dict['TEST'] = {**connection.settings_dict.get('TEST', {}),
+                                            'NAME': str(Path(cartella) / 'carico.sqlite3')}
+        nome_originale = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # Il rate limit (core/limiti.py) è per utente: il secchio basta per tutti i giri di ognuno,
+            # altrimenti gli studenti riceverebbero dei 429 invece degli orari e smetterebbero di prenotare
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                                   LIMITE_CAPACITA=options['iterazioni'] + 1):
+                self._esegui(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(nome_originale, verbosity=0)
+            shutil.rmtree(cartella, ignore_errors=True)
+
+    def _esegui(self, options):
+        studenti, docenti, password = self._semina(options)
+        risultati = _Risultati()
+        date = self._date_prenotabili(options['giorni'])
+        fine_studenti = threading.Event()
+
+        def sessione(utente):
+            if options['server']:
+                return _SessioneHttp(options['server'], utente.username, password)
+            return _SessioneClient(utente)
+
+        def misura(s, endpoint, metodo, percorso, dati=None):
+            inizio = time.perf_counter()
+            status, corpo = s.richiesta(metodo, percorso, dati)
+            durata = time.perf_counter() - inizio
+            if status in ('lock', 'errore') or (isinstance(status, int) and status >= 500):
+                esito = status if status == 'lock' else 'errore'
+            elif status == 429:
+                esito = 'limitata'
+            elif endpoint == 'prenota':
+                # Redirect alla dashboard = prenotata; form ripresentato con errori = slot già preso
+                esito = 'prenotata' if status == 302 else 'rifiutata'
+            else:
+                esito = 'ok'
+            risultati.registra(endpoint, durata, esito)
+            return corpo
+
+        def studente(utente):
+            try:
+                s = sessione(utente)
+                for _ in range(options['iterazioni']):
+                    giorno = random.choice(date).isoformat()
+                    opzioni = _RE_OPZIONE.findall(misura(s, 'get_orari', 'get', reverse('get_orari'), {'data': giorno}))
+                    if opzioni:
+                        misura(s, 'prenota', 'post', reverse('prenota'), {
+                            'data': giorno, 'ora': random.choice(opzioni), 'durata_ore': '1', 'luogo': 'BASE', 'note': '',
+                        })
+                    misura(s, 'dashboard', 'get', reverse('dashboard'))
+            finally:
+                connections.close_all()
+
+        def docente(utente):
+            try:
+                s = sessione(utente)
+                while not fine_studenti.is_set():
+                    misura(s, 'dashboard_docente', 'get', reverse('dashboard_docente'))
+            finally:
+                connections.close_all()
+
+        inizio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(studenti) + len(docenti)) as pool:
+            futuri_docenti = [pool.submit(docente, d) for d in docenti]
+            for futuro in [pool.submit(studente, u) for u in studenti]:
+                futuro.result()
+            fine_studenti.set()
+            for futuro in futuri_docenti:
+                futuro.result()
+        durata = time.perf_counter() - inizio
+
+        doppie = self._doppie_prenotazioni()
+        if options['server']:
+            User.objects.filter(username__startswith=PREFISSO_UTENTI).delete()
+
+        self._stampa(risultati, durata, doppie, options)
+
+    def _semina(self, options):
+        password = 'Carico!12345'
+        # Con il test client salto l'hash: il login avviene con force_login
+        hash_password = password if options['server'] else None
+
+        def crea(username, **extra):
+            utente = User(username=username, email=f'{username}@example.com', **extra)
+            utente.set_password(hash_password)
+            return utente
+
+        User.objects.filter(username__startswith=PREFISSO_UTENTI).delete()
+        User.objects.bulk_create(
+            [crea(f'{PREFISSO_UTENTI}{i}') for i in range(options['studenti'])]
+            + [crea(f'{PREFISSO_UTENTI}docente{i}', is_staff=True) for i in range(options['docenti'])]
+        )
+        utenti = list(User.objects.filter(username__startswith=PREFISSO_UTENTI).order_by('id'))
+
+        if not options['server'] and not Disponibilita.objects.exists():
+            Disponibilita.objects.bulk_create([
+                Disponibilita(giorno=g, ora_inizio=ora(14), ora_fine=ora(20)) for g in range(7)
+            ])
+        return [u for u in utenti if not u.is_staff], [u for u in utenti if u.is_staff], password
+
+    @staticmethod
+    def _date_prenotabili(quanti):
+        giorni_aperti = set(Disponibilita.objects.values_list('giorno', flat=True))
+        date, giorno = [], timezone.localdate() + timedelta(days=1)
+        while len(date) < quanti and giorni_aperti:
+            if giorno.weekday() in giorni_aperti:
+                date.append(giorno)
+            giorno += timedelta(days=1)
+        return date
+
+    @staticmethod
+    def _doppie_prenotazioni():
+        """Coppie di lezioni attive degli utenti di carico che si sovrappongono (ordinate per inizio)."""
+        doppie = 0
+        fine_massima = None
+        for inizio, durata in Lezione.objects.filter(
+            studente__username__startswith=PREFISSO_UTENTI, stato__in=['RICHIESTA', 'CONFERMATA']
+        ).order_by('data_inizio').values_list('data_inizio', 'durata_ore'):
+            fine = inizio + timedelta(hours=float(durata))
+            if fine_massima is not None and inizio < fine_massima:
+                doppie += 1
+            fine_massima = max(fine_massima or fine, fine)
+        return doppie
+
+    def _stampa(self, risultati, durata, doppie, options):
+        totale = sum(len(l) for l in risultati.latenze.values()) + risultati.limitate
+        self.stdout.write(
+            f"{options['studenti']} studenti x {options['iterazioni']} giri, {options['docenti']} docenti, "
+            f"{options['giorni']} giorni prenotabili - {totale} richieste in {durata:.2f}s "
+            f"({totale / durata:.1f} req/s)"
+        )
+        self.stdout.write(f"  {'endpoint':<18} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for endpoint, latenze in sorted(risultati.latenze.items()):
+            if len(latenze) > 1:
+                centili = statistics.quantiles(latenze, n=100, method='inclusive')
+                p50, p95, p99 = centili[49], centili[94], centili[98]
+            else:
+                p50 = p95 = p99 = latenze[0]
+            self.stdout.write(
+                f"  {endpoint:<18} {len(latenze):>6} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {p99 * 1000:>9.1f}")
+
+        self.stdout.write(f"  Prenotazioni riuscite: {risultati.prenotate}, rifiutate (slot occupato): {risultati.rifiutate}")
+        stile_errori = self.style.ERROR if risultati.errori_lock or risultati.errori else self.style.SUCCESS
+        self.stdout.write(stile_errori(
+            f"  Errori di lock: {risultati.errori_lock}, altri errori/5xx: {risultati.errori}"))
+        if risultati.limitate:
+            # Capita solo con --server: lì i limiti sono quelli del server (alzare LIMITE_CAPACITA per il test)
+            self.stdout.write(self.style.WARNING(
+                f"  Richieste fermate dal rate limit (429, escluse dalle latenze): {risultati.limitate}"))
+        stile_doppie = self.style.ERROR if doppie else self.style.SUCCESS
+        self.stdout.write(stile_doppie(f"  Doppie prenotazioni: {doppie}"))
@@ -0,0 +1,106 @@
+import gc
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+
+from core.models import Lezione, Profilo
+from core.righe import righe_lezioni
+
+
+def _con_istanze(queryset):
+    """Com'era prima: istanze complete con studente e profilo, valori da visualizzare calcolati riga per riga."""
+    lezioni = list(queryset.select_related('studente', 'studente__profilo'))
+    for lezione in lezioni:
+        lezione.get_luogo_display()
+        lezione.get_google_calendar_url()
+        try:
+            lezione.studente.profilo.telefono
+        except Profilo.DoesNotExist:
+            pass
+    return lezioni
+
+
+def _con_righe(queryset):
+    return righe_lezioni(queryset, calendario=True)
+
+
+class Command(BaseCommand):
+    help = ("Confronta il caricamento di una lista di lezioni come istanze del modello (select_related) "
+            "e come righe leggere (core/righe.py): tempo e memoria di picco. Gira su un DB SQLite temporaneo.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lezioni', type=int, default=5000, help="Lezioni nella lista")
+        parser.add_argument('--studenti', type=int, default=50)
+        parser.add_argument('--ripetizioni', type=int, default=5, help="Misure per variante (vale la migliore)")
+
+    def handle(self, *args, **options):
+        cartella = tempfile.mkdtemp(prefix='righe_')
+        connection.settings_dict['TEST'] = {**connection.settings_dict.get('TEST', {}),
+                                            'NAME': str(Path(cartella) / 'righe.sqlite3')}
+        nome_originale = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._semina(options['studenti'], options['lezioni'])
+            self._confronta(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(nome_originale, verbosity=0)
+            shutil.rmtree(cartella, ignore_errors=True)
+
+    @staticmethod
+    def _semina(quanti_studenti, quante_lezioni):
+        # Il post_save di User crea anche i profili
+        studenti = [User.objects.create(username=f'righe_{i}', first_name=f'Nome{i}', last_name=f'Cognome{i}')
+                    for i in range(quanti_studenti)]
+        Profilo.objects.update(telefono='333 1234567')
+        inizio = timezone.now()
+        luoghi = [codice for codice, _ in Lezione.LUOGO_SCELTE]
+        # bulk_create: niente registro pagamenti/variazioni, qui conta solo la lettura
+        Lezione.objects.bulk_create([
+            Lezione(studente=studenti[i % quanti_studenti], data_inizio=inizio + timedelta(hours=i),
+                    durata_ore=Decimal('1.5'), luogo=luoghi[i % len(luoghi)], stato='CONFERMATA',
+                    prezzo=Decimal('22.00'), note='Ripasso' if i % 3 else None)
+            for i in range(quante_lezioni)
+        ], batch_size=500)
+
+    def _misura(self, funzione, ripetizioni):
+        queryset = Lezione.objects.filter(stato='CONFERMATA').order_by('data_inizio')
+        tempi = []
+        for _ in range(ripetizioni):
+            gc.collect()
+            inizio = time.perf_counter()
+            funzione(queryset)
+            tempi.append(time.perf_counter() - inizio)
+
+        # Memoria a parte: tracemalloc rallenta parecchio e falserebbe i tempi
+        gc.collect()
+        tracemalloc.start()
+        risultato = funzione(queryset)
+        trattenuta, picco = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del risultato
+        return min(tempi), trattenuta, picco
+
+    def _confronta(self, options):
+        risultati = {
+            'istanze del modello': self._misura(_con_istanze, options['ripetizioni']),
+            'righe leggere': self._misura(_con_righe, options['ripetizioni']),
+        }
+        self.stdout.write(f"{options['lezioni']} lezioni, {options['studenti']} studenti "
+                          f"(migliore di {options['ripetizioni']} misure)")
+        self.stdout.write(f"  {'variante':<20} {'tempo ms':>10} {'lista KiB':>10} {'picco KiB':>10}")
+        for nome, (durata, trattenuta, picco) in risultati.items():
+            self.stdout.write(f"  {nome:<20} {durata * 1000:>10.1f} {trattenuta / 1024:>10.0f} {picco / 1024:>10.0f}")
+
+        (t_prima, m_prima, _), (t_dopo, m_dopo, _) = risultati.values()
+        self.stdout.write(self.style.SUCCESS(
+            f"  Righe leggere: {t_prima / t_dopo:.1f}x più veloci, {m_prima / m_dopo:.1f}x meno memoria trattenuta"))
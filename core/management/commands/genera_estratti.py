@@ -0,0 +1,63 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.estratti import genera, mese_precedente, mese_da_stringa
+from core.models import EstrattoConto
+from core.utils import crea_email, invia_email_multiple
+
+
+class Command(BaseCommand):
+    help = ("Genera gli estratti conto mensili degli studenti (HTML + testo, salvati a DB). "
+            "Rilanciarlo è sicuro: gli estratti con dati invariati non vengono rigenerati né rispediti.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mese', help="Mese nel formato YYYY-MM (default: il mese scorso)")
+        parser.add_argument('--invia', action='store_true',
+                            help="Spedisce per email gli estratti non ancora inviati (una sola connessione SMTP)")
+        parser.add_argument('--processi', type=int, default=os.cpu_count() or 1,
+                            help="Processi per il render quando gli studenti sono tanti")
+        parser.add_argument('--forza', action='store_true', help="Rigenera anche gli estratti invariati")
+
+    def handle(self, *args, **options):
+        try:
+            mese = mese_da_stringa(options['mese']) if options['mese'] else mese_precedente()
+        except (TypeError, ValueError):
+            raise CommandError("Mese non valido: usa il formato YYYY-MM.")
+
+        inizio = time.perf_counter()
+        generati, invariati, rimossi = genera(mese, processi=max(1, options['processi']), forza=options['forza'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Estratti di {mese:%m/%Y}: {generati} generati, {invariati} invariati, {rimossi} rimossi "
+            f"in {time.perf_counter() - inizio:.2f}s."
+        ))
+
+        if options['invia']:
+            self._invia(mese)
+
+    def _invia(self, mese):
+        da_inviare = list(
+            EstrattoConto.objects.filter(mese=mese, inviato_il__isnull=True)
+            .exclude(studente__email='')
+            .select_related('studente')
+        )
+        if not da_inviare:
+            self.stdout.write("Nessun estratto da inviare.")
+            return
+
+        messaggi = [
+            crea_email(f"Estratto conto {mese:%m/%Y} - FG Ripetizioni", [e.studente.email], e.html, e.testo)
+            for e in da_inviare
+        ]
+        inviati = invia_email_multiple(messaggi)
+
+        if inviati < len(messaggi):
+            # Con fail_silently non so quali siano partiti: li lascio tutti da inviare per il prossimo giro
+            self.stderr.write(self.style.ERROR(
+                f"Inviati {inviati} su {len(messaggi)}: estratti lasciati da inviare, riprova più tardi."))
+            return
+
+        EstrattoConto.objects.filter(id__in=[e.id for e in da_inviare]).update(inviato_il=timezone.now())
+        self.stdout.write(self.style.SUCCESS(f"Inviati {inviati} estratti."))
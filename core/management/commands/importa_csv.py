@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importazione import COLONNE_STUDENTE, COLONNE_LEZIONE, importa_csv
+
+
+class Command(BaseCommand):
+    help = ("Importa studenti e lezioni storiche da un CSV (separatore ',' o ';', intestazione obbligatoria). "
+            f"Colonne studente: {', '.join(COLONNE_STUDENTE)}. "
+            f"Colonne lezione (opzionali, data in YYYY-MM-DD e ora in HH:MM): {', '.join(COLONNE_LEZIONE)}. "
+            "Si può rilanciare: studenti e lezioni già presenti vengono saltati.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Percorso del file CSV (UTF-8)")
+        parser.add_argument('--batch', type=int, default=1000, help="Righe per blocco/transazione")
+        parser.add_argument('--dry-run', action='store_true', help="Valida e conta senza scrivere nulla")
+        parser.add_argument('--max-errori', type=int, default=50, help="Quanti errori mostrare al massimo")
+
+    def handle(self, *args, **options):
+        inizio = time.perf_counter()
+        try:
+            # utf-8-sig: i CSV salvati da Excel iniziano con il BOM
+            with open(options['file'], newline='', encoding='utf-8-sig') as file:
+                resoconto = importa_csv(file, batch=max(1, options['batch']), dry_run=options['dry_run'])
+        except OSError as e:
+            raise CommandError(f"Impossibile leggere il file: {e}")
+        durata = time.perf_counter() - inizio
+
+        for numero, messaggio in resoconto.errori[:options['max_errori']]:
+            self.stderr.write(f"  riga {numero}: {messaggio}")
+        if len(resoconto.errori) > options['max_errori']:
+            self.stderr.write(f"  ... e altri {len(resoconto.errori) - options['max_errori']} errori")
+
+        prefisso = "[DRY RUN] " if options['dry_run'] else ""
+        stile = self.style.WARNING if resoconto.errori else self.style.SUCCESS
+        self.stdout.write(stile(
+            f"{prefisso}{resoconto.righe} righe in {durata:.2f}s: {resoconto.studenti_creati} studenti nuovi, "
+            f"{resoconto.lezioni_create} lezioni create, {resoconto.lezioni_gia_presenti} già presenti, "
+            f"{len(resoconto.errori)} errori."
+        ))
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Lezione
+from core.righe import righe_lezioni
+from core.utils import invia_email_custom
+
+
+class Command(BaseCommand):
+    help = ("Manda al docente un'unica mail con tutte le richieste arrivate dall'ultimo digest "
+            "(modalità NOTIFICHE_DOCENTE=digest). Da lanciare periodicamente con cron.")
+
+    def handle(self, *args, **options):
+        adesso = timezone.now()
+
+        # Stesso schema dei promemoria: un UPDATE condizionale "prenota" le richieste nuove,
+        # così due esecuzioni sovrapposte non le inseriscono entrambe nel digest
+        with transaction.atomic():
+            nuove = Lezione.objects.filter(
+                stato='RICHIESTA',
+                notifica_docente_il__isnull=True,
+            ).update(notifica_docente_il=adesso)
+
+            lezioni = righe_lezioni(
+                Lezione.objects.filter(stato='RICHIESTA', notifica_docente_il=adesso).order_by('data_inizio')
+            )
+
+        if not nuove:
+            self.stdout.write("Nessuna nuova richiesta dall'ultimo digest.")
+            return
+
+        invia_email_custom(
+            soggetto=f"Nuove richieste di lezione ({len(lezioni)})",
+            destinatari=[settings.EMAIL_HOST_USER],
+            template_name='digest_richieste.html',
+            context={'lezioni': lezioni}
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"Digest inviato con {len(lezioni)} richieste."))
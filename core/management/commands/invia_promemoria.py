@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Lezione
+from core.utils import prepara_email_multiple, invia_email_multiple
+
+
+class Command(BaseCommand):
+    help = ("Invia il promemoria delle lezioni confermate che iniziano entro la finestra indicata. "
+            "Pensato per cron (es. ogni 10 minuti): ogni lezione riceve al massimo un promemoria.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ore', type=float, default=settings.PROMEMORIA_ORE_PRIMA,
+                            help="Ampiezza della finestra in ore a partire da adesso")
+
+    def handle(self, *args, **options):
+        adesso = timezone.now()
+        fine_finestra = adesso + timedelta(hours=options['ore'])
+
+        # 1. "Prenoto" le lezioni con un solo UPDATE condizionale: due cron sovrapposti non possono
+        #    marcare la stessa lezione, perché il secondo trova promemoria_inviato_il già valorizzato.
+        #    La query usa l'indice (stato, data_inizio): il costo dipende dalle lezioni nella finestra.
+        with transaction.atomic():
+            prenotate = Lezione.objects.filter(
+                stato='CONFERMATA',
+                data_inizio__gte=adesso,
+                data_inizio__lt=fine_finestra,
+                promemoria_inviato_il__isnull=True,
+            ).update(promemoria_inviato_il=adesso)
+
+            lezioni = list(
+                Lezione.objects.filter(
+                    stato='CONFERMATA',
+                    data_inizio__gte=adesso,
+                    data_inizio__lt=fine_finestra,
+                    promemoria_inviato_il=adesso,
+                )
+                .select_related('studente')
+                .order_by('data_inizio')
+            )
+
+        if not prenotate:
+            self.stdout.write("Nessun promemoria da inviare.")
+            return
+
+        # 2. Spedisco fuori dalla transazione: l'SMTP può essere lento e non voglio tenere
+        #    bloccato il DB (SQLite) mentre gli studenti prenotano.
+        messaggi = prepara_email_multiple(
+            soggetto='⏰ Promemoria Lezione - FG Ripetizioni',
+            template_name='promemoria_lezione.html',
+            invii=[([lezione.studente.email], {'lezione': lezione}) for lezione in lezioni if lezione.studente.email],
+        )
+        inviati = invia_email_multiple(messaggi)
+
+        if messaggi and not inviati:
+            # Connessione SMTP fallita: libero le lezioni così il prossimo giro ci riprova
+            Lezione.objects.filter(id__in=[l.id for l in lezioni]).update(promemoria_inviato_il=None)
+            self.stderr.write(self.style.ERROR("Invio fallito, promemoria rimandati al prossimo giro."))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Promemoria inviati: {inviati} (lezioni nella finestra: {prenotate})."
+        ))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Ricostruisce da zero l'indice full-text (FTS5) di studenti e note delle lezioni."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help="Righe inserite per ogni executemany")
+
+    def handle(self, *args, **options):
+        inizio = time.perf_counter()
+        righe = search.ricostruisci(batch=options['batch'])
+
+        if not search.fts_disponibile():
+            self.stdout.write(self.style.WARNING(
+                "FTS5 non disponibile su questo database: la ricerca userà il fallback icontains."
+            ))
+            return
+
+        durata = time.perf_counter() - inizio
+        self.stdout.write(self.style.SUCCESS(f"Indice ricostruito: {righe} righe in {durata:.2f}s."))
@@ -0,0 +1,166 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Gira in un processo Python nuovo (questo ha già importato tutto): ricalca ripetizioni/wsgi.py
+# fase per fase e stampa i tempi in JSON sull'ultima riga di stdout.
+_SCRIPT_FIGLIO = r'''
+import io, json, sys, time
+
+tempi = {}
+inizio = time.perf_counter()
+import django
+from django.conf import settings
+settings.INSTALLED_APPS
+tempi['import django + settings'] = time.perf_counter() - inizio
+
+t = time.perf_counter()
+django.setup(set_prefix=False)
+tempi['django.setup (app, modelli, admin)'] = time.perf_counter() - t
+
+t = time.perf_counter()
+from django.core.handlers.wsgi import WSGIHandler
+handler = WSGIHandler()
+tempi['handler WSGI (middleware)'] = time.perf_counter() - t
+
+riscaldamento = {}
+if settings.RISCALDAMENTO_AVVIO:
+    from core.avvio import riscalda
+    t = time.perf_counter()
+    riscaldamento = riscalda()
+    tempi['riscaldamento'] = time.perf_counter() - t
+tempi_avvio = time.perf_counter() - inizio
+
+# Strumento le operazioni "una tantum" per sapere dove va il costo della prima richiesta
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.template.base import Template
+from django.urls.resolvers import URLResolver
+
+misure = {}
+def strumenta(classe, metodo, voce):
+    originale = getattr(classe, metodo)
+    def avvolto(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return originale(*args, **kwargs)
+        finally:
+            misure[voce] = misure.get(voce, 0) + time.perf_counter() - t
+    setattr(classe, metodo, avvolto)
+
+strumenta(Template, 'compile_nodelist', 'compilazione template')
+strumenta(BaseDatabaseWrapper, 'connect', 'connessione DB')
+strumenta(URLResolver, '_populate', 'resolver URL')
+
+def richiesta(percorso):
+    percorso, _, query = percorso.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': percorso, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+    }
+    stato = []
+    t = time.perf_counter()
+    risposta = handler(environ, lambda s, h, *a: stato.append(s))
+    b''.join(risposta)
+    # close() manda request_finished: come un server vero, chiude anche la connessione al DB
+    risposta.close()
+    return time.perf_counter() - t, stato[0] if stato else '?'
+
+percorsi = []
+for percorso in json.loads(sys.argv[1]):
+    moduli_prima = set(sys.modules)
+    misure.clear()
+    prima, stato = richiesta(percorso)
+    dettaglio = dict(misure)
+    nuovi_moduli = sorted(set(sys.modules) - moduli_prima)
+    seconda, _ = richiesta(percorso)
+    percorsi.append({
+        'percorso': percorso, 'stato': stato, 'prima': prima, 'seconda': seconda,
+        'dettaglio': dettaglio, 'moduli_importati': nuovi_moduli,
+    })
+
+print(json.dumps({'avvio': tempi, 'totale_avvio': tempi_avvio, 'riscaldamento': riscaldamento,
+                  'percorsi': percorsi}))
+'''
+
+
+def _tempi_import(stderr, quanti):
+    """Dall'output di -X importtime: i moduli di primo livello più costosi (tempo cumulativo, in secondi)."""
+    moduli = []
+    for riga in stderr.splitlines():
+        if not riga.startswith('import time:') or 'cumulative' in riga:
+            continue
+        _, cumulativo, nome = riga[len('import time:'):].split('|')
+        # Rientro del nome = profondità: tengo solo gli import di primo livello, i figli sono già nel cumulativo
+        if nome[1:].startswith(' '):
+            continue
+        moduli.append((int(cumulativo) / 1e6, nome.strip()))
+    moduli.sort(reverse=True)
+    return moduli[:quanti], sum(secondi for secondi, _ in moduli)
+
+
+class Command(BaseCommand):
+    help = ("Misura il costo di avvio di un worker: tempi di import (python -X importtime), fasi di "
+            "setup, riscaldamento e prima richiesta rispetto alla seconda. Lancia un processo nuovo "
+            "senza riscaldamento e uno con, per confrontarli.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--percorso', action='append', dest='percorsi',
+                            help="Percorso da richiedere a freddo (ripetibile). Default: la pagina di login")
+        parser.add_argument('--top', type=int, default=15, help="Quanti moduli mostrare nella classifica degli import")
+
+    def handle(self, *args, **options):
+        percorsi = options['percorsi'] or ['/accounts/login/']
+
+        risultati = {}
+        for modalita, riscaldamento in (('senza riscaldamento', 'False'), ('con riscaldamento', 'True')):
+            env = {
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'ripetizioni.settings'),
+                'RISCALDAMENTO_AVVIO': riscaldamento,
+            }
+            processo = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', _SCRIPT_FIGLIO, json.dumps(percorsi)],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if processo.returncode != 0:
+                righe_errore = [r for r in processo.stderr.splitlines() if not r.startswith('import time:')]
+                raise CommandError(f"Processo di prova fallito ({modalita}):\n" + "\n".join(righe_errore[-20:]))
+            risultati[modalita] = json.loads(processo.stdout.strip().splitlines()[-1])
+            risultati[modalita]['import'] = _tempi_import(processo.stderr, options['top'])
+
+        self._stampa_import(*risultati['senza riscaldamento']['import'])
+        for modalita, dati in risultati.items():
+            self._stampa_processo(modalita, dati)
+
+    def _stampa_import(self, moduli, totale):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Import (processo senza riscaldamento): {totale * 1000:.0f} ms totali"))
+        for secondi, nome in moduli:
+            self.stdout.write(f"  {secondi * 1000:8.1f} ms  {nome}")
+
+    def _stampa_processo(self, modalita, dati):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nAvvio {modalita}: {dati['totale_avvio'] * 1000:.0f} ms"))
+        for fase, secondi in dati['avvio'].items():
+            self.stdout.write(f"  {fase:<36} {secondi * 1000:8.1f} ms")
+        for fase, secondi in dati['riscaldamento'].items():
+            valore = f"{secondi * 1000:8.1f} ms" if secondi is not None else "   fallita"
+            self.stdout.write(f"    - {fase:<32} {valore}")
+
+        for p in dati['percorsi']:
+            freddo = p['prima'] - p['seconda']
+            self.stdout.write(
+                f"  GET {p['percorso']} [{p['stato']}]: prima {p['prima'] * 1000:.1f} ms, "
+                f"seconda {p['seconda'] * 1000:.1f} ms (costo a freddo {freddo * 1000:.1f} ms)"
+            )
+            for voce, secondi in sorted(p['dettaglio'].items(), key=lambda v: -v[1]):
+                self.stdout.write(f"    - {voce:<32} {secondi * 1000:8.1f} ms")
+            if p['moduli_importati']:
+                esempi = ', '.join(p['moduli_importati'][:8])
+                altri = len(p['moduli_importati']) - 8
+                self.stdout.write(f"    - moduli importati alla prima richiesta: {len(p['moduli_importati'])} "
+                                  f"({esempi}{f', +{altri}' if altri > 0 else ''})")
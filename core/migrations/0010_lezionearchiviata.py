@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-19 16:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_profilo_tariffa_specifica'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LezioneArchiviata',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('data_inizio', models.DateTimeField()),
+                ('durata_ore', models.DecimalField(decimal_places=1, default=1.0, max_digits=3)),
+                ('luogo', models.CharField(choices=[('BASE', '🏠 Online / Casa Mia (Tariffa Base)'), ('RUFINA', '🚶 Rufina Paese (+2€)'), ('FASCIA_15', '🚗 Entro 15 min - Montebonello/Scopeti/Pomino (+4€)'), ('FASCIA_30', '🚗 Entro 30 min - Pontassieve/Sieci/Dicomano/Londa (+8€)'), ('ALTRO', '❓ Altro (Contattami)')], default='BASE', max_length=20)),
+                ('stato', models.CharField(choices=[('RICHIESTA', 'In attesa di conferma'), ('CONFERMATA', 'Confermata'), ('RIFIUTATA', 'Rifiutata')], max_length=20)),
+                ('prezzo', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('pagata', models.BooleanField(default=False)),
+                ('note', models.TextField(blank=True, null=True)),
+                ('archiviata_il', models.DateTimeField(auto_now_add=True)),
+                ('studente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lezioni_archiviate', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Lezioni Archiviate',
+                'ordering': ['-data_inizio'],
+                'indexes': [models.Index(fields=['stato', 'data_inizio'], name='core_lezion_stato_f42e2d_idx')],
+            },
+        ),
+    ]
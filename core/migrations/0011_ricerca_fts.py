@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def crea_indice_fts(apps, schema_editor):
+    # FTS5 esiste solo su SQLite (e solo se compilato con l'estensione): altrove la ricerca usa il fallback
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS core_ricerca "
+            "USING fts5(testo, tokenize='unicode61 remove_diacritics 2')"
+        )
+    except Exception:
+        pass
+
+
+def elimina_indice_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS core_ricerca")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_lezionearchiviata'),
+    ]
+
+    operations = [
+        migrations.RunPython(crea_indice_fts, elimina_indice_fts),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-19 16:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_ricerca_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lezione',
+            name='promemoria_inviato_il',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='lezione',
+            index=models.Index(fields=['stato', 'data_inizio'], name='core_lezion_stato_5d5aa1_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-19 16:24
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def segna_esistenti_come_notificate(apps, schema_editor):
+    # Le lezioni già presenti sono state notificate con la mail immediata: non devono finire nel primo digest
+    Lezione = apps.get_model('core', 'Lezione')
+    Lezione.objects.update(notifica_docente_il=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_lezione_promemoria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lezione',
+            name='notifica_docente_il',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(segna_esistenti_come_notificate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.4 on 2026-10-19 16:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def apri_saldi(apps, schema_editor):
+    # Saldo iniziale di ogni studente = lezioni confermate non pagate al momento della migrazione
+    Lezione = apps.get_model('core', 'Lezione')
+    Profilo = apps.get_model('core', 'Profilo')
+    Movimento = apps.get_model('core', 'Movimento')
+
+    debiti = Lezione.objects.filter(stato='CONFERMATA', pagata=False).order_by() \
+        .values('studente_id').annotate(totale=Sum('prezzo'), numero=Count('id'))
+    for debito in debiti:
+        totale = debito['totale'] or 0
+        profilo, _ = Profilo.objects.get_or_create(user_id=debito['studente_id'])
+        profilo.saldo = totale
+        profilo.lezioni_da_saldare = debito['numero']
+        profilo.save(update_fields=['saldo', 'lezioni_da_saldare'])
+        Movimento.objects.create(
+            studente_id=debito['studente_id'], tipo='APERTURA', importo=totale,
+            lezioni=debito['numero'], saldo_dopo=totale, nota="Saldo all'attivazione del registro",
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_lezione_notifica_docente'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilo',
+            name='lezioni_da_saldare',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profilo',
+            name='saldo',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Totale delle lezioni confermate ancora da pagare', max_digits=8),
+        ),
+        migrations.CreateModel(
+            name='Movimento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lezione_rif', models.BigIntegerField(blank=True, null=True)),
+                ('tipo', models.CharField(choices=[('APERTURA', 'Saldo iniziale'), ('ADDEBITO', 'Lezione confermata'), ('PAGAMENTO', 'Pagamento'), ('STORNO', 'Storno'), ('RETTIFICA', 'Rettifica prezzo')], max_length=20)),
+                ('importo', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('lezioni', models.IntegerField(default=0, help_text='Variazione del numero di lezioni da saldare')),
+                ('saldo_dopo', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('nota', models.CharField(blank=True, max_length=255)),
+                ('creato_il', models.DateTimeField(auto_now_add=True)),
+                ('registrato_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('studente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimenti', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Movimenti',
+                'ordering': ['-creato_il', '-id'],
+                'indexes': [models.Index(fields=['studente', 'creato_il'], name='core_movime_student_915297_idx')],
+            },
+        ),
+        migrations.RunPython(apri_saldi, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-19 16:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_registro_pagamenti'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstrattoConto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mese', models.DateField(help_text='Primo giorno del mese')),
+                ('numero_lezioni', models.IntegerField(default=0)),
+                ('ore', models.DecimalField(decimal_places=1, default=0, max_digits=6)),
+                ('totale', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('da_pagare', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('html', models.TextField()),
+                ('testo', models.TextField()),
+                ('impronta', models.CharField(max_length=64)),
+                ('generato_il', models.DateTimeField()),
+                ('inviato_il', models.DateTimeField(blank=True, null=True)),
+                ('studente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estratti', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Estratti Conto',
+                'ordering': ['-mese', 'studente__first_name'],
+                'constraints': [models.UniqueConstraint(fields=('studente', 'mese'), name='estratto_unico_per_mese')],
+            },
+        ),
+    ]
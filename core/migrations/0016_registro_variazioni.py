@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-19 16:45
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_estratto_conto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariazioneLezione',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('lezione_id', models.BigIntegerField()),
+                ('studente_id', models.IntegerField()),
+                ('operazione', models.CharField(choices=[('CREATA', 'Creata'), ('MODIFICATA', 'Modificata'), ('ELIMINATA', 'Eliminata'), ('ARCHIVIATA', 'Archiviata')], max_length=20)),
+                ('modifiche', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('creata_il', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Variazioni Lezioni',
+                'ordering': ['id'],
+            },
+        ),
+    ]
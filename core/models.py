@@ -1,11 +1,21 @@
-from django.db import models
+import contextlib
+import contextvars
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from decimal import Decimal
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.dispatch import receiver
 from django.utils.http import urlencode
 from datetime import timedelta
 from django.utils import timezone
+from .cache import CacheLocale, bump_dopo_commit
+
+# Le tabelle di configurazione cambiano di rado: le tengo in memoria nel worker,
+# invalidate da tutti i processi tramite la versione condivisa dello scope 'config'
+_cache_config = CacheLocale('config')
 
 class Impostazioni(models.Model):
     tariffa_base = models.DecimalField(max_digits=5, decimal_places=2, default=10.00, help_text="Prezzo all'ora base")
@@ -13,6 +23,13 @@ class Impostazioni(models.Model):
     def __str__(self):
         return f"Configurazione (Tariffa: {self.tariffa_base}€)"
 
+    @classmethod
+    def tariffa_corrente(cls):
+        def calcola():
+            config = cls.objects.first()
+            return config.tariffa_base if config else Decimal(10.00)
+        return _cache_config.get('tariffa_base', calcola)
+
     class Meta:
         verbose_name_plural = "Impostazioni"
 
@@ -36,6 +53,61 @@ class GiornoChiusura(models.Model):
         verbose_name_plural = "Giorni di Chiusura"
         ordering = ['-data_inizio']
 
+# Campi di Lezione che finiscono nel registro delle variazioni (promemoria/notifiche sono interni)
+CAMPI_VARIAZIONE = ('studente_id', 'data_inizio', 'durata_ore', 'luogo', 'stato', 'prezzo', 'pagata', 'note')
+# Quelli da cui dipende l'importo da saldare (registro dei pagamenti)
+CAMPI_DEBITO = ('studente_id', 'stato', 'pagata', 'prezzo')
+
+
+class LezioneQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        return self.aggiorna(kwargs)
+
+    def aggiorna(self, valori, registrato_da=None, nota=''):
+        """
+        Come QuerySet.update, ma le modifiche ai campi tracciati finiscono nel registro delle variazioni
+        e, se cambia il debito (stato/pagata/prezzo/studente), nel registro dei pagamenti: un movimento
+        per studente e tipo, firmato da `registrato_da`. update(**kwargs) passa di qui.
+        Costo extra solo se si toccano quei campi: una SELECT dei valori vecchi (e una dei nuovi se ci sono F()).
+        """
+        campi = {}
+        for nome, valore in valori.items():
+            campo = self.model._meta.get_field(nome)
+            if campo.attname in CAMPI_VARIAZIONE:
+                campi[campo.attname] = (campo, valore)
+        if not campi:
+            return super().update(**valori)
+
+        # Se cambia il debito servono tutti i campi che lo determinano, anche quelli non toccati
+        tocca_debito = bool(set(campi) & set(CAMPI_DEBITO))
+        da_leggere = set(campi) | {'studente_id'} | (set(CAMPI_DEBITO) if tocca_debito else set())
+
+        # Come QuerySet.update: da qui in poi self.db è il DB di scrittura
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            # Letti (e bloccati) nella stessa transazione dell'UPDATE: sono esattamente le righe aggiornate
+            prima = {riga.pop('pk'): riga for riga in self.select_for_update().values('pk', *da_leggere)}
+            aggiornate = super().update(**valori)
+            if not prima:
+                return aggiornate
+
+            if any(hasattr(valore, 'resolve_expression') for _, valore in campi.values()):
+                dopo = {
+                    riga.pop('pk'): riga
+                    for riga in Lezione._base_manager.using(self.db).filter(pk__in=list(prima)).values('pk', *da_leggere)
+                }
+            else:
+                nuovi = {
+                    attname: valore.pk if isinstance(valore, models.Model) else campo.to_python(valore)
+                    for attname, (campo, valore) in campi.items()
+                }
+                dopo = {pk: {**vecchi, **nuovi} for pk, vecchi in prima.items()}
+            VariazioneLezione.registra_aggiornamenti(prima, dopo)
+            if tocca_debito:
+                Movimento.registra_variazioni(prima, dopo, registrato_da=registrato_da, nota=nota)
+        return aggiornate
+
+
 class Lezione(models.Model):
     LUOGO_SCELTE = [
         ('BASE', '🏠 Online / Casa Mia (Tariffa Base)'),
@@ -61,6 +133,58 @@ class Lezione(models.Model):
     pagata = models.BooleanField(default=False)
     note = models.TextField(blank=True, null=True)
 
+    # Valorizzato da 'manage.py invia_promemoria': una lezione riceve al massimo un promemoria
+    promemoria_inviato_il = models.DateTimeField(blank=True, null=True, editable=False)
+    # Quando il docente è stato avvisato della richiesta (subito o nel digest di 'manage.py invia_digest')
+    notifica_docente_il = models.DateTimeField(blank=True, null=True, editable=False)
+
+    # Supplemento trasferta per zona
+    EXTRA_LUOGO = {
+        'RUFINA': 2.00,
+        'FASCIA_15': 4.00,
+        'FASCIA_30': 8.00,
+    }
+
+    objects = LezioneQuerySet.as_manager()
+
+    def _riga_salvata(self):
+        """
+        I campi tracciati com'erano nel DB, letti (e bloccati) dentro la transazione del save; None se la
+        lezione non c'è ancora. Niente valori ricordati al caricamento: un'istanza vecchia, nel frattempo
+        salvata da un'altra richiesta, confronterebbe con dati superati e addebiterebbe due volte.
+        """
+        if self.pk is None:
+            return None
+        # select_for_update va sempre sul DB di scrittura (mai sulla replica)
+        return Lezione._base_manager.select_for_update().filter(pk=self.pk).values(*CAMPI_VARIAZIONE).first()
+
+    def _valori_scritti(self, prima, update_fields=None):
+        """I campi tracciati come sono nel DB dopo il save: con update_fields gli altri restano quelli di prima."""
+        # Normalizzati come tornerebbero dal DB (es. durata 1 -> Decimal): niente falsi "cambiamenti"
+        valori = {c: Lezione._meta.get_field(c).to_python(getattr(self, c)) for c in CAMPI_VARIAZIONE}
+        if update_fields is None or prima is None:
+            return valori
+        scritti = set(update_fields)
+        return {
+            c: valore if c in scritti or c.removesuffix('_id') in scritti else prima[c]
+            for c, valore in valori.items()
+        }
+
+    @staticmethod
+    def debito(stato, pagata, prezzo):
+        if stato == 'CONFERMATA' and not pagata:
+            return prezzo or Decimal(0)
+        return Decimal(0)
+
+    def importo_da_saldare(self):
+        return self.debito(self.stato, self.pagata, self.prezzo)
+
+    @classmethod
+    def calcola_prezzo(cls, tariffa, durata_ore, luogo):
+        """Prezzo a partire da una tariffa già risolta: usato da save() e dagli import in blocco."""
+        costo_ore = tariffa * Decimal(durata_ore)
+        return costo_ore + Decimal(cls.EXTRA_LUOGO.get(luogo, 0))
+
     def save(self, *args, **kwargs):
         if self.pk is None or self.prezzo is None:
 
@@ -72,38 +196,42 @@ class Lezione(models.Model):
                 pass
 
             if tariffa_base_calcolo is None:
-                config = Impostazioni.objects.first()
-                tariffa_base_calcolo = config.tariffa_base if config else Decimal(10.00)
-
-            extra = 0
-            if self.luogo == 'RUFINA':
-                extra = 2.00
-            elif self.luogo == 'FASCIA_15':
-                extra = 4.00
-            elif self.luogo == 'FASCIA_30':
-                extra = 8.00
+                tariffa_base_calcolo = Impostazioni.tariffa_corrente()
 
-            costo_ore = tariffa_base_calcolo * Decimal(self.durata_ore)
-            self.prezzo = costo_ore + Decimal(extra)
+            self.prezzo = self.calcola_prezzo(tariffa_base_calcolo, self.durata_ore, self.luogo)
 
-        super().save(*args, **kwargs)
+        # Lezione e registri (pagamenti, variazioni) si aggiornano insieme o per niente
+        with transaction.atomic():
+            prima = self._riga_salvata()
+            # Per i receiver di post_save che devono sapere da dove arriva la lezione (es. la heatmap)
+            self._salvata_prima = prima
+            super().save(*args, **kwargs)
+            dopo = self._valori_scritti(prima, kwargs.get('update_fields'))
+            Movimento.registra_variazione(self.pk, prima, dopo)
+            VariazioneLezione.registra_salvataggio(self.pk, prima, dopo)
 
     def get_google_calendar_url(self):
         """Genera il link per aggiungere l'evento a Google Calendar"""
+        return self.link_calendario(self.data_inizio, self.durata_ore, self.studente.first_name,
+                                    self.studente.last_name, self.note, self.get_luogo_display())
+
+    @staticmethod
+    def link_calendario(data_inizio, durata_ore, nome, cognome, note, luogo_display):
+        """Link a Google Calendar a partire dai soli valori: usato anche dalle righe leggere (core/righe.py)."""
 
-        inizio_locale = timezone.localtime(self.data_inizio)
+        inizio_locale = timezone.localtime(data_inizio)
 
-        durata = float(self.durata_ore) if self.durata_ore else 1.0
+        durata = float(durata_ore) if durata_ore else 1.0
         fine_locale = inizio_locale + timedelta(hours=durata)
 
         fmt = "%Y%m%dT%H%M%S"
 
         params = {
             'action': 'TEMPLATE',
-            'text': f"Ripetizioni FG: {self.studente.first_name} {self.studente.last_name}",
+            'text': f"Ripetizioni FG: {nome} {cognome}",
             'dates': f"{inizio_locale.strftime(fmt)}/{fine_locale.strftime(fmt)}",
-            'details': f"Note: {self.note or 'Nessuna nota'}",
-            'location': self.get_luogo_display(),
+            'details': f"Note: {note or 'Nessuna nota'}",
+            'location': luogo_display,
             'sprop': 'website:https://francescogori03.eu.pythonanywhere.com',
             'ctz': 'Europe/Rome',
         }
@@ -116,6 +244,147 @@ class Lezione(models.Model):
     class Meta:
         verbose_name_plural = "Lezioni"
         ordering = ['-data_inizio']
+        indexes = [
+            # Range per stato + data: promemoria, lezioni future, storico
+            models.Index(fields=['stato', 'data_inizio']),
+        ]
+
+class LezioneArchiviata(models.Model):
+    """
+    Copia 'fredda' di una Lezione vecchia (rifiutata o già saldata).
+    La tabella calda resta piccola, lo storico resta consultabile.
+    """
+    # Tengo lo stesso id della lezione originale, così i riferimenti (mail, export) restano validi
+    id = models.BigIntegerField(primary_key=True)
+    studente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lezioni_archiviate')
+    data_inizio = models.DateTimeField()
+    durata_ore = models.DecimalField(max_digits=3, decimal_places=1, default=1.0)
+    luogo = models.CharField(max_length=20, choices=Lezione.LUOGO_SCELTE, default='BASE')
+    stato = models.CharField(max_length=20, choices=Lezione.STATO_SCELTE)
+    prezzo = models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True)
+    pagata = models.BooleanField(default=False)
+    note = models.TextField(blank=True, null=True)
+    archiviata_il = models.DateTimeField(auto_now_add=True)
+
+    # Flag letto dai template dello storico per distinguere le righe archiviate
+    archiviata = True
+
+    @classmethod
+    def da_lezione(cls, lezione):
+        return cls(
+            id=lezione.id,
+            studente_id=lezione.studente_id,
+            data_inizio=lezione.data_inizio,
+            durata_ore=lezione.durata_ore,
+            luogo=lezione.luogo,
+            stato=lezione.stato,
+            prezzo=lezione.prezzo,
+            pagata=lezione.pagata,
+            note=lezione.note,
+        )
+
+    def __str__(self):
+        return f"[Archivio] {self.studente.username} - {self.data_inizio.strftime('%d/%m/%Y %H:%M')}"
+
+    class Meta:
+        verbose_name_plural = "Lezioni Archiviate"
+        ordering = ['-data_inizio']
+        indexes = [
+            models.Index(fields=['stato', 'data_inizio']),
+        ]
+
+# Eliminazioni fatte da 'manage.py archivia_lezioni': nel registro risultano ARCHIVIATA, non ELIMINATA
+_archiviazione_in_corso = contextvars.ContextVar('archiviazione_in_corso', default=False)
+
+
+class VariazioneLezione(models.Model):
+    """
+    Registro append-only delle modifiche alle lezioni, per chi vuole aggiornarsi in modo incrementale
+    (cache, report, export) invece di rileggere tutta la tabella.
+
+    L'id è il numero di sequenza: crescente e mai riusato (AUTOINCREMENT su SQLite). Un consumatore
+    si salva l'ultimo id letto e chiede solo le righe successive con VariazioneLezione.leggi().
+    `modifiche` contiene solo i campi cambiati: {campo: [vecchio, nuovo]}.
+    """
+    OPERAZIONE_SCELTE = [
+        ('CREATA', 'Creata'),
+        ('MODIFICATA', 'Modificata'),
+        ('ELIMINATA', 'Eliminata'),
+        ('ARCHIVIATA', 'Archiviata'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    # Interi semplici, niente FK: il registro sopravvive a lezioni eliminate/archiviate e a utenti cancellati
+    lezione_id = models.BigIntegerField()
+    studente_id = models.IntegerField()
+    operazione = models.CharField(max_length=20, choices=OPERAZIONE_SCELTE)
+    modifiche = models.JSONField(encoder=DjangoJSONEncoder)
+    creata_il = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"#{self.id} {self.get_operazione_display()} lezione {self.lezione_id}"
+
+    @staticmethod
+    def _differenze(prima, dopo):
+        return {campo: [prima.get(campo), valore] for campo, valore in dopo.items() if prima.get(campo) != valore}
+
+    @classmethod
+    def registra_salvataggio(cls, lezione_id, prima, dopo):
+        """Da Lezione.save(): `prima` e `dopo` sono i valori nel DB prima e dopo (prima=None: lezione nuova)."""
+        modifiche = cls._differenze(prima or {}, dopo)
+        if modifiche:
+            cls.objects.create(lezione_id=lezione_id, studente_id=dopo['studente_id'],
+                               operazione='MODIFICATA' if prima is not None else 'CREATA', modifiche=modifiche)
+
+    @classmethod
+    def registra_aggiornamenti(cls, prima, dopo):
+        """Da LezioneQuerySet.update(): `prima` e `dopo` sono {pk: {campo: valore}}."""
+        variazioni = []
+        for pk, vecchi in prima.items():
+            modifiche = cls._differenze(vecchi, dopo.get(pk, {}))
+            if modifiche:
+                studente_id = (dopo.get(pk) or {}).get('studente_id') or vecchi['studente_id']
+                variazioni.append(cls(lezione_id=pk, studente_id=studente_id, operazione='MODIFICATA',
+                                      modifiche=modifiche))
+        cls.objects.bulk_create(variazioni)
+
+    @classmethod
+    def registra_creazioni(cls, lezioni):
+        """Per le lezioni create con bulk_create (niente save())."""
+        cls.objects.bulk_create([
+            cls(lezione_id=l.pk, studente_id=l.studente_id, operazione='CREATA',
+                modifiche=cls._differenze({}, {c: getattr(l, c) for c in CAMPI_VARIAZIONE}))
+            for l in lezioni if l.pk is not None
+        ])
+
+    @classmethod
+    @contextlib.contextmanager
+    def archiviazione(cls):
+        """Le lezioni eliminate dentro questo blocco risultano ARCHIVIATA."""
+        token = _archiviazione_in_corso.set(True)
+        try:
+            yield
+        finally:
+            _archiviazione_in_corso.reset(token)
+
+    @classmethod
+    def ultima_sequenza(cls):
+        """Da dove far partire un nuovo consumatore che non vuole lo storico."""
+        return cls.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    @classmethod
+    def leggi(cls, dopo=0, limite=500):
+        """
+        Le variazioni con sequenza > `dopo`, in ordine. Ritorna (variazioni, cursore): il cursore è
+        l'ultima sequenza letta, da ripassare alla chiamata successiva (uguale a `dopo` se non c'è niente).
+        """
+        variazioni = list(cls.objects.filter(id__gt=dopo).order_by('id')[:limite])
+        return variazioni, variazioni[-1].id if variazioni else dopo
+
+    class Meta:
+        verbose_name_plural = "Variazioni Lezioni"
+        ordering = ['id']
+
 
 class Disponibilita(models.Model):
     GIORNI = [
@@ -145,22 +414,251 @@ class Profilo(models.Model):
         help_text="Se impostata, questa tariffa vince su quella globale."
     )
 
+    # Denormalizzati: li aggiorna solo il registro (Movimento), sempre nella stessa transazione
+    saldo = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False,
+                                help_text="Totale delle lezioni confermate ancora da pagare")
+    lezioni_da_saldare = models.IntegerField(default=0, editable=False)
+
     def __str__(self):
         return f"Profilo di {self.user.username}"
 
+    @classmethod
+    def aggiorna_saldo(cls, user_id, importo, lezioni):
+        """Somma atomica (UPDATE ... SET saldo = saldo + x). Ritorna il saldo risultante."""
+        aggiornati = cls.objects.filter(user_id=user_id).update(
+            saldo=F('saldo') + importo,
+            lezioni_da_saldare=F('lezioni_da_saldare') + lezioni,
+        )
+        if not aggiornati:
+            # Utente senza profilo (vecchi account): lo creo già con il saldo giusto
+            return cls.objects.create(user_id=user_id, saldo=importo, lezioni_da_saldare=lezioni).saldo
+        return cls.objects.filter(user_id=user_id).values_list('saldo', flat=True).get()
+
+    @classmethod
+    def per_utente(cls, user):
+        """Profilo dell'utente, creato al volo se manca (idempotente)."""
+        try:
+            return user.profilo
+        except cls.DoesNotExist:
+            profilo, _ = cls.objects.get_or_create(user=user)
+            return profilo
+
     class Meta:
         verbose_name_plural = "Profili"
 
-# Garanzia di consistenza: ogni User DEVE avere un Profilo.
-# Lo creo automaticamente sia al signup che in caso di salvataggi da admin/shell.
+class Movimento(models.Model):
+    """
+    Registro dei pagamenti: ogni variazione del saldo di uno studente lascia una riga qui.
+    importo > 0 = addebito (lezione confermata), importo < 0 = pagamento o storno.
+    """
+    TIPO_SCELTE = [
+        ('APERTURA', 'Saldo iniziale'),
+        ('ADDEBITO', 'Lezione confermata'),
+        ('PAGAMENTO', 'Pagamento'),
+        ('STORNO', 'Storno'),
+        ('RETTIFICA', 'Rettifica prezzo'),
+    ]
+
+    studente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='movimenti')
+    # Id della lezione come intero: l'archivio mantiene lo stesso id e il movimento resta leggibile
+    lezione_rif = models.BigIntegerField(blank=True, null=True)
+    tipo = models.CharField(max_length=20, choices=TIPO_SCELTE)
+    importo = models.DecimalField(max_digits=8, decimal_places=2)
+    lezioni = models.IntegerField(default=0, help_text="Variazione del numero di lezioni da saldare")
+    saldo_dopo = models.DecimalField(max_digits=8, decimal_places=2)
+    registrato_da = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    nota = models.CharField(max_length=255, blank=True)
+    creato_il = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.importo}€ - {self.studente.username}"
+
+    @classmethod
+    def registra(cls, studente_id, tipo, importo, lezioni, lezione_rif=None, registrato_da=None, nota=''):
+        """Aggiorna il saldo del profilo e scrive il movimento. Va chiamato dentro una transazione."""
+        saldo = Profilo.aggiorna_saldo(studente_id, importo, lezioni)
+        return cls.objects.create(
+            studente_id=studente_id, tipo=tipo, importo=importo, lezioni=lezioni, saldo_dopo=saldo,
+            lezione_rif=lezione_rif, registrato_da=registrato_da, nota=nota,
+        )
+
+    @staticmethod
+    def _voci(prima, dopo):
+        """
+        Le voci (studente_id, tipo, importo, lezioni, nota) per una lezione passata da `prima` a `dopo`
+        (dict con i CAMPI_DEBITO com'erano nel DB; prima=None: lezione nuova).
+        """
+        studente_prima, debito_prima = None, Decimal(0)
+        if prima is not None:
+            studente_prima = prima['studente_id']
+            debito_prima = Lezione.debito(prima['stato'], prima['pagata'], prima['prezzo'])
+        debito_ora = Lezione.debito(dopo['stato'], dopo['pagata'], dopo['prezzo'])
+
+        voci = []
+        if studente_prima is not None and studente_prima != dopo['studente_id']:
+            # Lezione spostata su un altro studente (admin): storno al vecchio, addebito al nuovo
+            if debito_prima:
+                voci.append((studente_prima, 'STORNO', -debito_prima, -1, "Lezione spostata"))
+            debito_prima = Decimal(0)
+
+        if debito_ora == debito_prima:
+            return voci
+        if not debito_prima:
+            voci.append((dopo['studente_id'], 'ADDEBITO', debito_ora, 1, ''))
+        elif not debito_ora:
+            tipo = 'PAGAMENTO' if dopo['pagata'] else 'STORNO'
+            voci.append((dopo['studente_id'], tipo, -debito_prima, -1, ''))
+        else:
+            voci.append((dopo['studente_id'], 'RETTIFICA', debito_ora - debito_prima, 0, ''))
+        return voci
+
+    @classmethod
+    def registra_variazione(cls, lezione_id, prima, dopo):
+        """Da Lezione.save(): registra la differenza di debito tra i valori nel DB prima e dopo."""
+        for studente_id, tipo, importo, lezioni, nota in cls._voci(prima, dopo):
+            cls.registra(studente_id, tipo, importo, lezioni, lezione_id, nota=nota)
+
+    @classmethod
+    def registra_variazioni(cls, prima, dopo, registrato_da=None, nota=''):
+        """
+        Da LezioneQuerySet.update(): `prima` e `dopo` sono {pk: {campo: valore}}.
+        Un movimento per studente e tipo (es. un solo PAGAMENTO per il saldo di tante lezioni).
+        """
+        gruppi = {}
+        for pk, vecchi in prima.items():
+            for studente_id, tipo, importo, lezioni, nota_voce in cls._voci(vecchi, dopo[pk]):
+                gruppo = gruppi.setdefault((studente_id, tipo), [Decimal(0), 0, [], nota_voce])
+                gruppo[0] += importo
+                gruppo[1] += lezioni
+                gruppo[2].append(pk)
+        for (studente_id, tipo), (importo, lezioni, pks, nota_voce) in sorted(gruppi.items()):
+            cls.registra(studente_id, tipo, importo, lezioni, pks[0] if len(pks) == 1 else None,
+                         registrato_da=registrato_da, nota=nota or nota_voce)
+
+    @classmethod
+    def addebita_in_blocco(cls, lezioni, nota=''):
+        """Per le lezioni create con bulk_create (niente save()): un addebito per studente."""
+        per_studente = {}
+        for lezione in lezioni:
+            importo = lezione.importo_da_saldare()
+            if importo:
+                totale, numero = per_studente.get(lezione.studente_id, (Decimal(0), 0))
+                per_studente[lezione.studente_id] = (totale + importo, numero + 1)
+        for studente_id, (totale, numero) in per_studente.items():
+            cls.registra(studente_id, 'ADDEBITO', totale, numero, nota=nota)
+
+    @classmethod
+    def salda(cls, studente, registrato_da=None):
+        """
+        Segna come pagate tutte le lezioni confermate da saldare e registra UN pagamento del totale.
+        Tutto in una transazione: o cambia tutto (lezioni, saldo, registro) o niente. Ritorna (lezioni, totale).
+        """
+        with transaction.atomic():
+            righe = list(Lezione.objects.filter(
+                studente=studente, stato='CONFERMATA', pagata=False
+            ).values_list('id', 'prezzo'))
+            if not righe:
+                return 0, Decimal(0)
+
+            # Aggiorno per id: una lezione confermata nel frattempo non viene segnata pagata senza essere nel totale.
+            # Il PAGAMENTO (uno solo, del totale) lo scrive l'update stesso
+            totale = sum((prezzo or Decimal(0) for _, prezzo in righe), Decimal(0))
+            Lezione.objects.filter(id__in=[i for i, _ in righe]).aggiorna(
+                {'pagata': True}, registrato_da=registrato_da, nota=f"Saldo di {len(righe)} lezioni")
+        return len(righe), totale
+
+    class Meta:
+        verbose_name_plural = "Movimenti"
+        ordering = ['-creato_il', '-id']
+        indexes = [
+            models.Index(fields=['studente', 'creato_il']),
+        ]
+
+
+class EstrattoConto(models.Model):
+    """Estratto conto mensile di uno studente, generato da 'manage.py genera_estratti'."""
+    studente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='estratti')
+    mese = models.DateField(help_text="Primo giorno del mese")
+    numero_lezioni = models.IntegerField(default=0)
+    ore = models.DecimalField(max_digits=6, decimal_places=1, default=0)
+    totale = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    da_pagare = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    html = models.TextField()
+    testo = models.TextField()
+    # Hash dei dati di partenza: se non cambia, l'estratto non viene rigenerato (né rispedito)
+    impronta = models.CharField(max_length=64)
+    generato_il = models.DateTimeField()
+    inviato_il = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Estratto {self.mese:%m/%Y} - {self.studente.username}"
+
+    class Meta:
+        verbose_name_plural = "Estratti Conto"
+        ordering = ['-mese', 'studente__first_name']
+        constraints = [
+            models.UniqueConstraint(fields=['studente', 'mese'], name='estratto_unico_per_mese'),
+        ]
+
+
+# Ogni User ha un Profilo: lo creo al signup e, per gli utenti che ne fossero privi
+# (vecchi account, fixture caricate con loaddata), al primo accesso con Profilo.per_utente().
+# Niente sync ad ogni User.save(): il login aggiorna last_login e non deve toccare la tabella dei profili.
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
         Profilo.objects.create(user=instance)
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    try:
-        instance.profilo.save()
-    except Profilo.DoesNotExist:
-        Profilo.objects.create(user=instance)
\ No newline at end of file
+@receiver(post_save, sender=Impostazioni)
+@receiver(post_delete, sender=Impostazioni)
+def invalida_cache_config(sender, **kwargs):
+    bump_dopo_commit('config')
+
+
+def _utente_in_cancellazione(origin, studente_id):
+    """
+    True se la delete in corso è partita dall'utente della lezione (o da un queryset di utenti che lo
+    contiene, es. l'azione dell'admin): le sue lezioni spariscono in cascata insieme a profilo e registro,
+    quindi niente storno (sarebbe un movimento orfano). Uso l'origine passata dal Collector di Django
+    e non l'ordine dei signal, che per la cascata manda i pre_delete delle lezioni prima di quello dell'utente.
+    """
+    if isinstance(origin, User):
+        return origin.pk == studente_id
+    if isinstance(origin, models.QuerySet) and origin.model is User:
+        # Una query sola per tutta la cascata, non una per lezione
+        if not hasattr(origin, '_ids_in_cancellazione'):
+            origin._ids_in_cancellazione = set(origin.values_list('pk', flat=True))
+        return studente_id in origin._ids_in_cancellazione
+    return False
+
+
+@receiver(pre_delete, sender=Lezione)
+def leggi_debito_lezione_eliminata(sender, instance, origin=None, **kwargs):
+    # Gira dentro la transazione della delete: il debito da stornare è quello nel DB, non quello
+    # dell'istanza in memoria (magari caricata prima di una conferma o di un pagamento)
+    if _utente_in_cancellazione(origin, instance.studente_id):
+        return
+    if _archiviazione_in_corso.get():
+        # archivia_lezioni ha appena letto queste righe nella stessa transazione: l'istanza è già aggiornata
+        instance._debito_eliminato = (instance.studente_id, instance.importo_da_saldare())
+        return
+    riga = Lezione._base_manager.select_for_update().filter(pk=instance.pk).values(*CAMPI_DEBITO).first()
+    if riga is not None:
+        instance._debito_eliminato = (riga['studente_id'], Lezione.debito(riga['stato'], riga['pagata'], riga['prezzo']))
+
+
+@receiver(post_delete, sender=Lezione)
+def storna_lezione_eliminata(sender, instance, **kwargs):
+    studente_id, debito = getattr(instance, '_debito_eliminato', (None, None))
+    if debito:
+        Movimento.registra(studente_id, 'STORNO', -debito, -1, instance.pk, nota="Lezione eliminata")
+
+
+@receiver(post_delete, sender=Lezione)
+def registra_lezione_eliminata(sender, instance, **kwargs):
+    prima = {c: Lezione._meta.get_field(c).to_python(getattr(instance, c)) for c in CAMPI_VARIAZIONE}
+    VariazioneLezione.objects.create(
+        lezione_id=instance.pk, studente_id=instance.studente_id,
+        operazione='ARCHIVIATA' if _archiviazione_in_corso.get() else 'ELIMINATA',
+        modifiche={campo: [valore, None] for campo, valore in prima.items() if valore is not None},
+    )
@@ -0,0 +1,102 @@
+"""
+Profilazione a richiesta in produzione, solo per lo staff.
+
+Basta aggiungere `?_prof=1` all'URL (oppure l'header `X-Profile: 1`): la view gira sotto cProfile
+e il risultato finisce in un buffer circolare in memoria (PROFILER_MAX_CATTURE per processo,
+le catture più vecchie escono da sole). Le catture si consultano su /dashboard-docente/profili/
+e si scaricano come .prof (si aprono con `python -m pstats`, snakeviz, ecc.).
+
+Se il parametro non c'è il costo è un controllo su un dict: l'utente non viene nemmeno caricato.
+Le view async non vengono profilate (cProfile segue un solo thread, l'event loop no).
+"""
+import cProfile
+import itertools
+import marshal
+import pstats
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+
+PARAMETRO = '_prof'
+HEADER = 'HTTP_X_PROFILE'
+TOP_FUNZIONI = 25
+
+_catture = deque(maxlen=settings.PROFILER_MAX_CATTURE)
+_lock = threading.Lock()
+_contatore = itertools.count(1)
+
+
+def _richiesto(request):
+    return PARAMETRO in request.GET or request.META.get(HEADER) == '1'
+
+
+def _top_funzioni(statistiche, quante=TOP_FUNZIONI):
+    """Le funzioni più costose per tempo cumulativo, già pronte per il template."""
+    righe = []
+    for (file, riga, funzione), (_, chiamate, tempo_proprio, tempo_cumulativo, _) in statistiche.stats.items():
+        righe.append({
+            'funzione': funzione,
+            'posizione': f"{file}:{riga}" if riga else file,
+            'chiamate': chiamate,
+            'tempo_proprio_ms': tempo_proprio * 1000,
+            'tempo_cumulativo_ms': tempo_cumulativo * 1000,
+        })
+    righe.sort(key=lambda r: r['tempo_cumulativo_ms'], reverse=True)
+    return righe[:quante]
+
+
+def _salva(request, profiler, durata, status):
+    statistiche = pstats.Stats(profiler)
+    cattura = {
+        'id': next(_contatore),
+        'quando': timezone.now(),
+        'metodo': request.method,
+        'percorso': request.get_full_path(),
+        'utente': request.user.get_username(),
+        'status': status,
+        'durata_ms': durata * 1000,
+        'top': _top_funzioni(statistiche),
+        # Stesso formato scritto da Stats.dump_stats: il file si apre con pstats
+        'dump': marshal.dumps(statistiche.stats),
+    }
+    with _lock:
+        _catture.append(cattura)
+
+
+def catture():
+    """Le catture del processo corrente, dalla più recente."""
+    with _lock:
+        return list(reversed(_catture))
+
+
+def cattura(id_cattura):
+    with _lock:
+        return next((c for c in _catture if c['id'] == id_cattura), None)
+
+
+class ProfilerMiddleware:
+    """Va messo dopo AuthenticationMiddleware: serve request.user per il controllo sullo staff."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not _richiesto(request) or iscoroutinefunction(view_func):
+            return None
+        if not request.user.is_staff:
+            return None
+
+        profiler = cProfile.Profile()
+        inizio = time.perf_counter()
+        response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+        durata = time.perf_counter() - inizio
+
+        _salva(request, profiler, durata, getattr(response, 'status_code', None))
+        return response
@@ -0,0 +1,60 @@
+"""
+Righe leggere per le liste lunghe (dashboard, storico, email con elenchi di lezioni).
+
+Le liste mostrano una manciata di campi: invece di istanze di Lezione con User e Profilo agganciati
+leggo solo quelle colonne con values_list() e le metto in oggetti con __slots__ (niente __dict__,
+niente stato dell'ORM). I valori da visualizzare (luogo, link al calendario) si calcolano una volta qui,
+non a ogni accesso nel template. Guadagno misurato con 'manage.py benchmark_righe'.
+
+Le righe sono in sola lettura: per modificare una lezione serve sempre l'istanza del modello.
+"""
+from .models import Lezione, LezioneArchiviata
+
+LUOGHI = dict(Lezione.LUOGO_SCELTE)
+
+_CAMPI = ('id', 'studente_id', 'data_inizio', 'durata_ore', 'luogo', 'stato', 'prezzo', 'pagata', 'note')
+_CAMPI_STUDENTE = ('studente__first_name', 'studente__last_name', 'studente__profilo__telefono')
+
+
+class RigaLezione:
+    __slots__ = ('id', 'studente_id', 'data_inizio', 'durata_ore', 'luogo', 'stato', 'prezzo', 'pagata',
+                 'note', 'studente_nome', 'studente_cognome', 'telefono', 'luogo_display', 'archiviata',
+                 'calendario_url')
+
+    def __init__(self, id, studente_id, data_inizio, durata_ore, luogo, stato, prezzo, pagata, note,
+                 studente_nome='', studente_cognome='', telefono=None, archiviata=False):
+        self.id = id
+        self.studente_id = studente_id
+        self.data_inizio = data_inizio
+        self.durata_ore = durata_ore
+        self.luogo = luogo
+        self.stato = stato
+        self.prezzo = prezzo
+        self.pagata = pagata
+        self.note = note
+        self.studente_nome = studente_nome
+        self.studente_cognome = studente_cognome
+        # Studente senza profilo (LEFT JOIN vuota) o senza numero: stringa vuota come nei template di prima
+        self.telefono = telefono or ''
+        self.luogo_display = LUOGHI.get(luogo, luogo)
+        self.archiviata = archiviata
+        self.calendario_url = ''
+
+    def __repr__(self):
+        return f"<RigaLezione {self.id} {self.data_inizio:%d/%m/%Y %H:%M}>"
+
+
+def righe_lezioni(queryset, studente=True, calendario=False):
+    """
+    Lista di RigaLezione dal queryset (di Lezione o LezioneArchiviata, filtri e ordinamento inclusi).
+    studente=False salta la join su utente e profilo (es. la dashboard dello studente stesso);
+    calendario=True precalcola il link a Google Calendar.
+    """
+    archiviata = queryset.model is LezioneArchiviata
+    campi = _CAMPI + _CAMPI_STUDENTE if studente else _CAMPI
+    righe = [RigaLezione(*valori, archiviata=archiviata) for valori in queryset.values_list(*campi)]
+    if calendario:
+        for riga in righe:
+            riga.calendario_url = Lezione.link_calendario(riga.data_inizio, riga.durata_ore, riga.studente_nome,
+                                                          riga.studente_cognome, riga.note, riga.luogo_display)
+    return righe
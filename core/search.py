@@ -0,0 +1,237 @@
+"""
+Ricerca full-text su studenti e lezioni.
+
+Su SQLite uso una tabella virtuale FTS5 (core_ricerca) tenuta in sync dai signal qui sotto.
+Il rowid codifica il tipo di oggetto: pari = studente (user.id * 2), dispari = lezione (id * 2 + 1),
+così aggiornare/cancellare una riga è una lookup per chiave e non una scansione.
+Su altri database (o SQLite senza FTS5) ripiego su una ricerca icontains classica.
+"""
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction, OperationalError
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .db_router import alias_lettura
+from .models import Lezione, Profilo
+
+TABELLA = 'core_ricerca'
+
+TIPO_STUDENTE = 0
+TIPO_LEZIONE = 1
+
+_fts_attivo = None
+
+
+def fts_disponibile():
+    """True se il DB è SQLite e la tabella FTS5 esiste (risultato memorizzato per processo)."""
+    global _fts_attivo
+    if _fts_attivo is None:
+        if connection.vendor != 'sqlite':
+            _fts_attivo = False
+        else:
+            _fts_attivo = TABELLA in connection.introspection.table_names()
+    return _fts_attivo
+
+
+def crea_tabella():
+    """Crea la tabella FTS5. Ritorna False se SQLite è compilato senza FTS5."""
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELLA} "
+                f"USING fts5(testo, tokenize='unicode61 remove_diacritics 2')"
+            )
+    except OperationalError:
+        return False
+    return True
+
+
+def _testo_studente(user, profilo=None):
+    parti = [user.username, user.first_name, user.last_name, user.email]
+    if profilo is not None:
+        parti += [profilo.telefono, profilo.scuola]
+    return ' '.join(p for p in parti if p)
+
+
+def _profilo_di(user):
+    try:
+        return user.profilo
+    except Profilo.DoesNotExist:
+        return None
+
+
+def indicizza_studente(user, profilo=None):
+    if not fts_disponibile():
+        return
+    if profilo is None:
+        profilo = _profilo_di(user)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {TABELLA}(rowid, testo) VALUES (%s, %s)",
+            [user.id * 2 + TIPO_STUDENTE, _testo_studente(user, profilo)]
+        )
+
+
+def indicizza_lezione(lezione):
+    if not fts_disponibile():
+        return
+    rowid = lezione.id * 2 + TIPO_LEZIONE
+    with connection.cursor() as cursor:
+        # Indicizzo solo le note: il nome dello studente è già nella riga dello studente
+        if lezione.note:
+            cursor.execute(f"INSERT OR REPLACE INTO {TABELLA}(rowid, testo) VALUES (%s, %s)", [rowid, lezione.note])
+        else:
+            cursor.execute(f"DELETE FROM {TABELLA} WHERE rowid = %s", [rowid])
+
+
+def indicizza_in_blocco(studenti=(), lezioni=()):
+    """Indicizza in un colpo oggetti creati con bulk_create (che non manda i post_save)."""
+    if not fts_disponibile():
+        return
+    righe = [(u.id * 2 + TIPO_STUDENTE, _testo_studente(u, _profilo_di(u))) for u in studenti]
+    righe += [(l.id * 2 + TIPO_LEZIONE, l.note) for l in lezioni if l.note]
+    if righe:
+        with connection.cursor() as cursor:
+            cursor.executemany(f"INSERT OR REPLACE INTO {TABELLA}(rowid, testo) VALUES (%s, %s)", righe)
+
+
+def rimuovi(tipo, oggetto_id):
+    if not fts_disponibile():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABELLA} WHERE rowid = %s", [oggetto_id * 2 + tipo])
+
+
+def ricostruisci(batch=1000):
+    """Svuota e ricarica l'indice da zero. Ritorna il numero di righe indicizzate."""
+    if not crea_tabella():
+        return 0
+
+    global _fts_attivo
+    _fts_attivo = True
+
+    righe = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABELLA}")
+
+        buffer = []
+        for user in User.objects.select_related('profilo').iterator(chunk_size=batch):
+            buffer.append((user.id * 2 + TIPO_STUDENTE, _testo_studente(user, _profilo_di(user))))
+            if len(buffer) >= batch:
+                cursor.executemany(f"INSERT INTO {TABELLA}(rowid, testo) VALUES (%s, %s)", buffer)
+                righe += len(buffer)
+                buffer = []
+
+        lezioni = Lezione.objects.exclude(note__isnull=True).exclude(note='').values_list('id', 'note')
+        for lezione_id, note in lezioni.iterator(chunk_size=batch):
+            buffer.append((lezione_id * 2 + TIPO_LEZIONE, note))
+            if len(buffer) >= batch:
+                cursor.executemany(f"INSERT INTO {TABELLA}(rowid, testo) VALUES (%s, %s)", buffer)
+                righe += len(buffer)
+                buffer = []
+
+        if buffer:
+            cursor.executemany(f"INSERT INTO {TABELLA}(rowid, testo) VALUES (%s, %s)", buffer)
+            righe += len(buffer)
+
+        # Compatto i segmenti dell'indice dopo il caricamento massivo
+        cursor.execute(f"INSERT INTO {TABELLA}({TABELLA}) VALUES ('optimize')")
+
+    return righe
+
+
+def _query_fts(testo):
+    """Trasforma l'input libero in una query FTS5 sicura: ogni parola diventa un prefisso tra virgolette."""
+    parole = re.findall(r'\w+', testo)
+    return ' '.join(f'"{p}"*' for p in parole)
+
+
+def cerca(testo, limite=30):
+    """
+    Cerca studenti e lezioni. Ritorna (studenti, lezioni) già ordinati per rilevanza.
+    """
+    testo = (testo or '').strip()
+    if not testo:
+        return [], []
+
+    if fts_disponibile():
+        query = _query_fts(testo)
+        if not query:
+            return [], []
+        # Una query per tipo, così tante lezioni non "spingono fuori" gli studenti dal LIMIT
+        with connections[alias_lettura()].cursor() as cursor:
+            ids = {}
+            for tipo in (TIPO_STUDENTE, TIPO_LEZIONE):
+                cursor.execute(
+                    f"SELECT rowid FROM {TABELLA} WHERE {TABELLA} MATCH %s AND rowid %% 2 = %s "
+                    f"ORDER BY rank LIMIT %s",
+                    [query, tipo, limite]
+                )
+                ids[tipo] = [r[0] // 2 for r in cursor.fetchall()]
+
+        studenti_ids = ids[TIPO_STUDENTE]
+        lezioni_ids = ids[TIPO_LEZIONE]
+
+        # Recupero gli oggetti in blocco e ripristino l'ordine di rilevanza
+        studenti_map = User.objects.select_related('profilo').in_bulk(studenti_ids)
+        lezioni_map = Lezione.objects.select_related('studente').in_bulk(lezioni_ids)
+        return (
+            [studenti_map[i] for i in studenti_ids if i in studenti_map],
+            [lezioni_map[i] for i in lezioni_ids if i in lezioni_map],
+        )
+
+    # Fallback: LIKE su ogni parola (lento sui grandi volumi, ma sempre funzionante)
+    filtro_studenti = Q()
+    filtro_lezioni = Q()
+    for parola in testo.split():
+        filtro_studenti &= (
+            Q(username__icontains=parola) | Q(first_name__icontains=parola) |
+            Q(last_name__icontains=parola) | Q(email__icontains=parola) |
+            Q(profilo__telefono__icontains=parola) | Q(profilo__scuola__icontains=parola)
+        )
+        filtro_lezioni &= Q(note__icontains=parola)
+
+    studenti = list(User.objects.filter(filtro_studenti).select_related('profilo').order_by('first_name')[:limite])
+    lezioni = list(Lezione.objects.filter(filtro_lezioni).select_related('studente')[:limite])
+    return studenti, lezioni
+
+
+# --- SYNC AUTOMATICO ---
+
+@receiver(post_save, sender=User)
+def aggiorna_indice_studente(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Il login salva solo last_login: non serve toccare l'indice
+    if raw or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    indicizza_studente(instance)
+
+
+@receiver(post_save, sender=Profilo)
+def aggiorna_indice_profilo(sender, instance, created=False, raw=False, **kwargs):
+    # Un profilo appena creato e vuoto non aggiunge testo: la riga la scrive già il signal dello User
+    if raw or (created and not instance.telefono and not instance.scuola):
+        return
+    indicizza_studente(instance.user, instance)
+
+
+@receiver(post_delete, sender=User)
+def rimuovi_indice_studente(sender, instance, **kwargs):
+    rimuovi(TIPO_STUDENTE, instance.id)
+
+
+@receiver(post_save, sender=Lezione)
+def aggiorna_indice_lezione(sender, instance, created=False, raw=False, **kwargs):
+    # Una lezione appena creata senza note non ha niente da indicizzare (né da cancellare)
+    if raw or (created and not instance.note):
+        return
+    indicizza_lezione(instance)
+
+
+@receiver(post_delete, sender=Lezione)
+def rimuovi_indice_lezione(sender, instance, **kwargs):
+    rimuovi(TIPO_LEZIONE, instance.id)
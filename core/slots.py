@@ -0,0 +1,194 @@
+"""
+Calcolo degli orari liberi: di un giorno (select HTMX) o i primi N liberi da una data in avanti.
+
+La logica pura (orari_liberi) è separata dall'accesso al DB, così la stessa funzione
+serve sia alla view sincrona (WSGI) che a quella async (ASGI).
+Le view HTMX passano dalle versioni *_condivise: risultato in cache per data e calcoli concorrenti fusi in uno.
+"""
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .cache import versioni, condividi_calcolo, acondividi_calcolo
+from .models import Lezione, Disponibilita, GiornoChiusura
+
+PASSO_SLOT = timedelta(minutes=30)
+# Le <option> di un giorno restano in cache finché non cambia il calendario; la scadenza è solo per pulizia
+TTL_OPZIONI = 600
+# Il finder dei prossimi slot non parte oltre questo orizzonte (date assurde dall'URL non arrivano al calcolo)
+ORIZZONTE_GIORNI = 365
+
+
+def orari_liberi(data_scelta, disp, lezioni):
+    """
+    Ritorna gli orari di inizio (datetime naive) liberi nella fascia di disponibilità.
+    `lezioni` è un iterabile di coppie (data_inizio, durata_ore).
+    """
+    occupati = []
+    for inizio, durata in lezioni:
+        durata = float(durata) if durata else 1.0
+        occupati.append((inizio, inizio + timedelta(hours=durata)))
+
+    liberi = []
+    ora_corrente = datetime.combine(data_scelta, disp.ora_inizio)
+    ora_fine = datetime.combine(data_scelta, disp.ora_fine)
+
+    while ora_corrente < ora_fine:
+        inizio_slot = timezone.make_aware(ora_corrente)
+        if not any(inizio <= inizio_slot < fine for inizio, fine in occupati):
+            liberi.append(ora_corrente)
+        ora_corrente += PASSO_SLOT
+
+    return liberi
+
+
+def _lezioni_giorno(data_scelta):
+    return Lezione.objects.filter(
+        data_inizio__date=data_scelta,
+        stato__in=['RICHIESTA', 'CONFERMATA']
+    ).values_list('data_inizio', 'durata_ore')
+
+
+def _chiusura(data_scelta):
+    return GiornoChiusura.objects.filter(
+        data_inizio__lte=data_scelta,
+        data_fine__gte=data_scelta
+    )
+
+
+def opzioni_html(orari):
+    if not orari:
+        return "<option value=''>Tutto occupato!</option>"
+    opzioni = []
+    for orario in orari:
+        str_orario = orario.strftime("%H:%M")
+        opzioni.append(f"<option value='{str_orario}'>{str_orario}</option>")
+    return "".join(opzioni)
+
+
+def opzioni_giorno(data_scelta):
+    """Le <option> HTML per la select degli orari (versione sincrona)."""
+    chiusura = _chiusura(data_scelta).first()
+    if chiusura:
+        return f"<option value=''>Non disponibile: {chiusura.motivo or 'Chiuso'}</option>"
+
+    try:
+        disp = Disponibilita.objects.get(giorno=data_scelta.weekday())
+    except Disponibilita.DoesNotExist:
+        return "<option value=''>Nessuna lezione in questo giorno</option>"
+
+    return opzioni_html(orari_liberi(data_scelta, disp, _lezioni_giorno(data_scelta)))
+
+
+async def aopzioni_giorno(data_scelta):
+    """Come opzioni_giorno, ma con l'ORM async: non blocca l'event loop del worker ASGI."""
+    chiusura = await _chiusura(data_scelta).afirst()
+    if chiusura:
+        return f"<option value=''>Non disponibile: {chiusura.motivo or 'Chiuso'}</option>"
+
+    try:
+        disp = await Disponibilita.objects.aget(giorno=data_scelta.weekday())
+    except Disponibilita.DoesNotExist:
+        return "<option value=''>Nessuna lezione in questo giorno</option>"
+
+    lezioni = [riga async for riga in _lezioni_giorno(data_scelta)]
+    return opzioni_html(orari_liberi(data_scelta, disp, lezioni))
+
+
+def _chiave_opzioni(data_scelta):
+    # Versione letta PRIMA del calcolo: se nel frattempo arriva una prenotazione il risultato
+    # finisce sotto la versione vecchia e nessuno lo rilegge
+    calendario, orari = versioni('calendario', 'orari')
+    return f"opzioni:{data_scelta.isoformat()}:v{calendario}-{orari}"
+
+
+def opzioni_giorno_condivise(data_scelta):
+    """
+    opzioni_giorno con cache condivisa tra i worker e coalescing tra i thread: sotto una raffica
+    di richieste per la stessa data il DB vede un solo calcolo per data (per versione del calendario).
+    """
+    chiave = _chiave_opzioni(data_scelta)
+    opzioni = cache.get(chiave)
+    if opzioni is None:
+        def calcola():
+            risultato = opzioni_giorno(data_scelta)
+            cache.set(chiave, risultato, TTL_OPZIONI)
+            return risultato
+        opzioni = condividi_calcolo(chiave, calcola)
+    return opzioni
+
+
+async def aopzioni_giorno_condivise(data_scelta):
+    """Versione async di opzioni_giorno_condivise (coalescing sulle coroutine dell'event loop)."""
+    chiave = _chiave_opzioni(data_scelta)
+    opzioni = await cache.aget(chiave)
+    if opzioni is None:
+        async def calcola():
+            risultato = await aopzioni_giorno(data_scelta)
+            await cache.aset(chiave, risultato, TTL_OPZIONI)
+            return risultato
+        opzioni = await acondividi_calcolo(chiave, calcola)
+    return opzioni
+
+
+def prossimi_slot_liberi(dal, durata_ore, quanti=5, max_giorni=60):
+    """
+    I primi `quanti` inizi liberi (datetime aware) dal giorno `dal` in avanti, per una lezione di `durata_ore`.
+
+    Query fisse, indipendenti da quanto è lontano il primo buco: orari settimanali, chiusure del periodo
+    e UNA query a range sulle lezioni, letta in streaming in ordine di data. Se trovo gli slot
+    nella prima settimana smetto di consumare il cursore e il resto del periodo non viene nemmeno letto.
+    """
+    durata = timedelta(hours=float(durata_ore))
+    fine_periodo = dal + timedelta(days=max_giorni)
+    adesso = timezone.now()
+
+    orari_settimana = {d.giorno: d for d in Disponibilita.objects.all()}
+    if not orari_settimana:
+        return []
+
+    chiusure = list(GiornoChiusura.objects.filter(
+        data_inizio__lte=fine_periodo,
+        data_fine__gte=dal
+    ).values_list('data_inizio', 'data_fine'))
+
+    inizio_range = timezone.make_aware(datetime.combine(dal, datetime.min.time()))
+    fine_range = timezone.make_aware(datetime.combine(fine_periodo, datetime.min.time()))
+    lezioni = Lezione.objects.filter(
+        stato__in=['RICHIESTA', 'CONFERMATA'],
+        data_inizio__gte=inizio_range,
+        data_inizio__lt=fine_range,
+    ).order_by('data_inizio').values_list('data_inizio', 'durata_ore').iterator(chunk_size=200)
+
+    # Lezione "in sospeso": letta dal cursore ma appartenente a un giorno successivo
+    prossima = next(lezioni, None)
+
+    trovati = []
+    giorno = dal
+    while giorno < fine_periodo and len(trovati) < quanti:
+        fine_giorno = timezone.make_aware(datetime.combine(giorno + timedelta(days=1), datetime.min.time()))
+
+        # Consumo dal cursore solo le lezioni di questo giorno
+        occupati = []
+        while prossima is not None and prossima[0] < fine_giorno:
+            inizio, durata_lezione = prossima
+            occupati.append((inizio, inizio + timedelta(hours=float(durata_lezione) if durata_lezione else 1.0)))
+            prossima = next(lezioni, None)
+
+        disp = orari_settimana.get(giorno.weekday())
+        chiuso = any(c_inizio <= giorno <= c_fine for c_inizio, c_fine in chiusure)
+
+        if disp and not chiuso:
+            slot = timezone.make_aware(datetime.combine(giorno, disp.ora_inizio))
+            ultimo_inizio = timezone.make_aware(datetime.combine(giorno, disp.ora_fine)) - durata
+
+            while slot <= ultimo_inizio and len(trovati) < quanti:
+                fine_slot = slot + durata
+                if slot > adesso and not any(slot < fine and fine_slot > inizio for inizio, fine in occupati):
+                    trovati.append(slot)
+                slot += PASSO_SLOT
+
+        giorno += timedelta(days=1)
+
+    return trovati
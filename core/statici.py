@@ -0,0 +1,137 @@
+"""
+File statici con nome "hashato", precompressi, serviti con cache di lunga durata.
+
+- collectstatic (storage StaticiCompressi): nomi con l'hash del contenuto (es. base.3f2a9c.css, via manifest)
+  e, accanto a ogni file testuale, le varianti .gz e, se è installato il pacchetto `brotli`, .br.
+  La compressione al massimo livello si paga una volta al deploy, non a ogni richiesta.
+- StaticiMiddleware: serve STATIC_ROOT quando davanti a Django non c'è un proxy che lo faccia
+  (SERVI_STATICI=True). Sceglie la variante compressa in base ad Accept-Encoding; i file con l'hash nel nome
+  non cambiano mai, quindi `immutable` per un anno: alle visite successive il browser non li richiede nemmeno.
+"""
+import gzip
+import mimetypes
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ESTENSIONI_COMPRIMIBILI = {'.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico',
+                           '.ttf', '.otf', '.eot'}
+# Sotto questa soglia gli header costano più del risparmio
+DIMENSIONE_MINIMA = 512
+CACHE_IMMUTABILE = 'public, max-age=31536000, immutable'
+CACHE_RIVALIDA = 'public, max-age=0, must-revalidate'
+
+
+def _comprimi(percorso):
+    """Scrive .gz (e .br) accanto al file se non esistono o sono più vecchi. Ritorna le varianti scritte."""
+    dati = None
+    scritte = []
+    varianti = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        varianti.append(('.br', lambda d: brotli.compress(d, quality=11)))
+
+    for estensione, comprimi in varianti:
+        destinazione = percorso.with_name(percorso.name + estensione)
+        if destinazione.exists() and destinazione.stat().st_mtime >= percorso.stat().st_mtime:
+            continue
+        if dati is None:
+            dati = percorso.read_bytes()
+        compressi = comprimi(dati)
+        # Se non si guadagna almeno il 5% non vale la pena (immagini già compresse dentro un .svg, ecc.)
+        if len(compressi) < len(dati) * 0.95:
+            destinazione.write_bytes(compressi)
+            scritte.append(destinazione)
+    return scritte
+
+
+class StaticiCompressi(ManifestStaticFilesStorage):
+    # Senza collectstatic (es. sviluppo, test) {% static %} ripiega sul nome originale invece di sollevare errore
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for cartella, _, file in os.walk(self.location):
+            for nome in file:
+                percorso = Path(cartella) / nome
+                if percorso.suffix in ESTENSIONI_COMPRIMIBILI and percorso.stat().st_size >= DIMENSIONE_MINIMA:
+                    _comprimi(percorso)
+
+
+def _codifiche_accettate(request):
+    accettate = set()
+    for voce in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        codifica, _, parametri = voce.strip().partition(';')
+        if parametri.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accettate.add(codifica.strip().lower())
+    return accettate
+
+
+class StaticiMiddleware:
+    """Da mettere subito dopo SecurityMiddleware: le richieste dei file statici non attraversano il resto."""
+
+    def __init__(self, get_response):
+        url = settings.STATIC_URL or ''
+        if not settings.SERVI_STATICI or not settings.STATIC_ROOT or '://' in url:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefisso = '/' + url.lstrip('/')
+        self.radice = str(settings.STATIC_ROOT)
+        # I nomi con l'hash presi dal manifest: solo questi sono immutabili
+        self.immutabili = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefisso):
+            response = self._servi(request, request.path_info[len(self.prefisso):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def _servi(self, request, nome):
+        try:
+            percorso = safe_join(self.radice, nome)
+        except SuspiciousFileOperation:
+            return None
+        if not nome or not os.path.isfile(percorso):
+            # Lascio proseguire: risponderà il 404 normale di Django
+            return None
+
+        da_servire, codifica = percorso, None
+        accettate = _codifiche_accettate(request)
+        for candidata, estensione in (('br', '.br'), ('gzip', '.gz')):
+            if candidata in accettate and os.path.isfile(percorso + estensione):
+                da_servire, codifica = percorso + estensione, candidata
+                break
+
+        info = os.stat(da_servire)
+        etag = f'"{info.st_mtime_ns:x}-{info.st_size:x}"'
+        immutabile = nome in self.immutabili
+        intestazioni = {
+            'Cache-Control': CACHE_IMMUTABILE if immutabile else CACHE_RIVALIDA,
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+        }
+
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponseNotModified()
+        else:
+            tipo, _ = mimetypes.guess_type(percorso)
+            # File piccoli (e già compressi): li leggo interi, niente iteratori sincroni sotto ASGI
+            with open(da_servire, 'rb') as f:
+                response = HttpResponse(f.read(), content_type=tipo or 'application/octet-stream')
+            if codifica:
+                response['Content-Encoding'] = codifica
+        for chiave, valore in intestazioni.items():
+            response[chiave] = valore
+        return response
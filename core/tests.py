@@ -1,3 +1,896 @@
-from django.test import TestCase
+import asyncio
+import re
+import threading
+import time as time_mod
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, DatabaseError
+from django.db.models import F, Q
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+
+from . import eventi, heatmap, limiti, search, slots
+from .cache import acondividi_calcolo, condividi_calcolo
+from .db_router import COOKIE_PIN, ReplicaPinMiddleware, ReplicaRouter, usa_replica
+from .importazione import importa_csv
+from .models import Lezione, LezioneArchiviata, Profilo, Movimento, VariazioneLezione, Disponibilita, GiornoChiusura
+from .righe import righe_lezioni
+from .utils import prepara_email, prepara_email_multiple
+
+
+# Il numero di query dipende dal backend delle sessioni: fisso quello di default (DB)
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.db',
+    MESSAGE_STORAGE='django.contrib.messages.storage.fallback.FallbackStorage',
+)
+class PercorsoLoginTest(TestCase):
+    """Login, registrazione e profilo non devono più toccare il Profilo a ogni User.save()."""
+
+    password = 'Xyz!12345abc'
+
+    def setUp(self):
+        # Il controllo "FTS5 presente?" si fa una volta per processo: lo tolgo dal conteggio
+        search.fts_disponibile()
+
+    def _crea_studente(self):
+        return User.objects.create_user('mario', 'm@x.it', self.password, first_name='Mario', last_name='Rossi')
+
+    def test_registrazione(self):
+        # 2 check username, INSERT user, INSERT profilo, indice di ricerca
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse('register'), {
+                'username': 'mario', 'email': 'm@x.it', 'first_name': 'Mario', 'last_name': 'Rossi',
+                'password1': self.password, 'password2': self.password,
+            })
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        self.assertTrue(Profilo.objects.filter(user__username='mario').exists())
+
+    def test_login_non_salva_il_profilo(self):
+        self._crea_studente()
+        # SELECT user, creazione sessione (check + INSERT in savepoint), UPDATE last_login, salvataggio sessione
+        with self.assertNumQueries(9):
+            response = self.client.post(reverse('login'), {'username': 'mario', 'password': self.password})
+        self.assertEqual(response.status_code, 302)
+
+    def test_profilo_view(self):
+        self.client.force_login(self._crea_studente())
+        # sessione, user, profilo
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('profilo'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_profilo_creato_al_primo_accesso(self):
+        studente = self._crea_studente()
+        Profilo.objects.filter(user=studente).delete()
+        self.client.force_login(studente)
+
+        self.client.get(reverse('profilo'))
+        self.client.get(reverse('profilo'))
+        self.assertEqual(Profilo.objects.filter(user=studente).count(), 1)
+
+
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.db',
+    MESSAGE_STORAGE='django.contrib.messages.storage.fallback.FallbackStorage',
+)
+class EtagDashboardTest(TestCase):
+    """Con l'ETag giusto la dashboard risponde 304 senza eseguire la view."""
+
+    def setUp(self):
+        search.fts_disponibile()
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc')
+        self.client.force_login(self.studente)
+
+    def test_304_costa_una_lettura_di_cache(self):
+        # La prima risposta imposta il cookie CSRF, che fa parte dell'ETag
+        self.client.get(reverse('dashboard'))
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            # Solo sessione e utente (login_required): nessuna query della view
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(get_many.call_count, 1)
+
+    def test_nuova_lezione_cambia_etag_al_commit(self):
+        self.client.get(reverse('dashboard'))
+        etag = self.client.get(reverse('dashboard'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Lezione.objects.create(studente=self.studente, data_inizio=timezone.now() + timedelta(days=1))
+            # Transazione ancora aperta: la versione non cambia, altrimenti una GET concorrente
+            # legherebbe l'ETag nuovo ai dati vecchi
+            response = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class RegistroVariazioniTest(TestCase):
+    """Save, update in blocco ed eliminazioni finiscono nel registro, leggibile a partire da un cursore."""
+
+    def setUp(self):
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc')
+        self.lezione = Lezione.objects.create(studente=self.studente, data_inizio=timezone.now() + timedelta(days=1))
+
+    def test_save_registra_solo_i_campi_cambiati(self):
+        cursore = VariazioneLezione.ultima_sequenza()
+        self.lezione.stato = 'CONFERMATA'
+        self.lezione.save()
+        self.lezione.save()
+
+        variazioni, nuovo_cursore = VariazioneLezione.leggi(cursore)
+        self.assertEqual([(v.operazione, v.modifiche) for v in variazioni],
+                         [('MODIFICATA', {'stato': ['RICHIESTA', 'CONFERMATA']})])
+        self.assertEqual(VariazioneLezione.leggi(nuovo_cursore), ([], nuovo_cursore))
+
+    def test_update_in_blocco_ed_eliminazione(self):
+        self.lezione.stato = 'CONFERMATA'
+        self.lezione.save()
+        cursore = VariazioneLezione.ultima_sequenza()
+
+        # Movimento.salda segna le lezioni pagate con un queryset.update()
+        Movimento.salda(self.studente)
+        Lezione.objects.filter(pk=self.lezione.pk).delete()
+
+        variazioni, _ = VariazioneLezione.leggi(cursore)
+        self.assertEqual([v.operazione for v in variazioni], ['MODIFICATA', 'ELIMINATA'])
+        self.assertEqual(variazioni[0].modifiche, {'pagata': [False, True]})
+        self.assertEqual(variazioni[1].lezione_id, self.lezione.pk)
+
+
+class RegistroPagamentiTest(TestCase):
+    """Il saldo sul profilo è sempre la somma delle lezioni confermate non pagate, qualunque sia la strada."""
+
+    def setUp(self):
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc')
+        self.lezione = self.crea(timedelta(days=1), Decimal('10.00'))
+
+    def crea(self, tra, prezzo, **campi):
+        # Alla creazione save() ricalcola il prezzo dalla tariffa: lo fisso dopo
+        lezione = Lezione.objects.create(studente=self.studente, data_inizio=timezone.now() + tra, **campi)
+        Lezione.objects.filter(pk=lezione.pk).update(prezzo=prezzo)
+        return Lezione.objects.get(pk=lezione.pk)
+
+    def assertSaldoCoerente(self, atteso=None):
+        profilo = Profilo.objects.get(user=self.studente)
+        da_saldare = Lezione.objects.filter(studente=self.studente, stato='CONFERMATA', pagata=False)
+        totale = sum((l.prezzo for l in da_saldare), Decimal(0))
+        self.assertEqual((profilo.saldo, profilo.lezioni_da_saldare), (totale, da_saldare.count()))
+        ultimo = Movimento.objects.filter(studente=self.studente).first()
+        self.assertEqual(ultimo.saldo_dopo if ultimo else Decimal(0), totale)
+        if atteso is not None:
+            self.assertEqual(totale, atteso)
+
+    def test_conferma_rifiuto_pagamento_e_prezzo(self):
+        self.lezione.stato = 'CONFERMATA'
+        self.lezione.save()
+        self.assertSaldoCoerente(Decimal('10.00'))
+
+        self.lezione.prezzo = Decimal('15.00')
+        self.lezione.save()
+        self.assertSaldoCoerente(Decimal('15.00'))
+
+        self.lezione.pagata = True
+        self.lezione.save()
+        self.assertSaldoCoerente(Decimal(0))
+
+        self.lezione.pagata = False
+        self.lezione.stato = 'RIFIUTATA'
+        self.lezione.save()
+        self.assertSaldoCoerente(Decimal(0))
+
+    def test_istanze_vecchie_non_addebitano_due_volte(self):
+        prima, seconda = Lezione.objects.get(pk=self.lezione.pk), Lezione.objects.get(pk=self.lezione.pk)
+        for copia in (prima, seconda):
+            copia.stato = 'CONFERMATA'
+            copia.save()
+        self.assertSaldoCoerente(Decimal('10.00'))
+        self.assertEqual(Movimento.objects.filter(studente=self.studente, tipo='ADDEBITO').count(), 1)
+
+    def test_update_fields_registra_solo_i_campi_scritti(self):
+        self.lezione.stato = 'CONFERMATA'
+        self.lezione.save()
+        # stato cambiato solo in memoria: nel DB resta CONFERMATA, il debito non cambia
+        self.lezione.stato = 'RIFIUTATA'
+        self.lezione.note = 'portare il libro'
+        self.lezione.save(update_fields=['note'])
+        self.assertSaldoCoerente(Decimal('10.00'))
+
+    def test_update_in_blocco(self):
+        altra = self.crea(timedelta(days=2), Decimal('20.00'))
+        Lezione.objects.filter(studente=self.studente).update(stato='CONFERMATA')
+        self.assertSaldoCoerente(Decimal('30.00'))
+
+        Lezione.objects.filter(pk=altra.pk).update(prezzo=F('prezzo') + 5)
+        self.assertSaldoCoerente(Decimal('35.00'))
+
+        Lezione.objects.filter(pk=self.lezione.pk).update(stato='RIFIUTATA')
+        self.assertSaldoCoerente(Decimal('25.00'))
+
+        numero, totale = Movimento.salda(self.studente)
+        self.assertEqual((numero, totale), (1, Decimal('25.00')))
+        self.assertSaldoCoerente(Decimal(0))
+        pagamento = Movimento.objects.filter(studente=self.studente).first()
+        self.assertEqual((pagamento.tipo, pagamento.importo), ('PAGAMENTO', Decimal('-25.00')))
+
+    def test_eliminazione_e_archiviazione(self):
+        vecchia = self.crea(-timedelta(days=400), Decimal('12.00'), stato='CONFERMATA')
+        self.lezione.stato = 'CONFERMATA'
+        self.lezione.save()
+        self.assertSaldoCoerente(Decimal('22.00'))
+
+        vecchia.pagata = True
+        vecchia.save()
+        call_command('archivia_lezioni', giorni=30, stdout=StringIO())
+        self.assertTrue(LezioneArchiviata.objects.filter(pk=vecchia.pk).exists())
+        self.assertSaldoCoerente(Decimal('10.00'))
+
+        # Istanza caricata prima del pagamento: lo storno deve usare il debito nel DB (zero), non quello in memoria
+        da_eliminare = Lezione.objects.get(pk=self.lezione.pk)
+        Movimento.salda(self.studente)
+        da_eliminare.delete()
+        self.assertSaldoCoerente(Decimal(0))
+
+    def test_cancellare_uno_studente_con_debito(self):
+        # Profilo e registro spariscono in cascata con l'utente: niente storno orfano (IntegrityError)
+        self.lezione.stato = 'CONFERMATA'
+        self.lezione.save()
+        self.studente.delete()
+        self.assertFalse(Movimento.objects.exists())
+        self.assertFalse(Lezione.objects.exists())
+
+        # Dall'admin: pagina di conferma del singolo utente e azione sulla lista
+        self.client.force_login(User.objects.create_superuser('prof', 'p@x.it', 'Xyz!12345abc'))
+        for i, (url, dati) in enumerate([
+            (lambda u: reverse('admin:auth_user_delete', args=[u.pk]), lambda u: {'post': 'yes'}),
+            (lambda u: reverse('admin:auth_user_changelist'),
+             lambda u: {'action': 'delete_selected', '_selected_action': [u.pk], 'post': 'yes'}),
+        ]):
+            self.studente = User.objects.create_user(f'studente{i}', 's@x.it', 'Xyz!12345abc')
+            self.crea(timedelta(days=1), Decimal('10.00'), stato='CONFERMATA')
+            self.assertSaldoCoerente(Decimal('10.00'))
+            self.assertEqual(self.client.post(url(self.studente), dati(self.studente)).status_code, 302)
+            self.assertFalse(User.objects.filter(pk=self.studente.pk).exists())
+            self.assertFalse(Movimento.objects.filter(studente_id=self.studente.pk).exists())
+
+
+class ArchivioTest(TestCase):
+    """archivia_lezioni sposta solo rifiutate e saldate vecchie; storico ed export le vedono ancora."""
+
+    def setUp(self):
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc', first_name='Mario', last_name='Rossi')
+        adesso = timezone.now()
+
+        def crea(giorni, **campi):
+            lezione = Lezione.objects.create(studente=self.studente, data_inizio=adesso - timedelta(days=giorni))
+            Lezione.objects.filter(pk=lezione.pk).update(**campi)
+            return lezione.pk
+
+        self.saldata = crea(60, stato='CONFERMATA', pagata=True)
+        self.rifiutata = crea(61, stato='RIFIUTATA')
+        self.da_saldare = crea(62, stato='CONFERMATA')
+        self.recente = crea(5, stato='CONFERMATA', pagata=True)
+
+    def test_sposta_a_batch_mantenendo_gli_id(self):
+        uscita = StringIO()
+        call_command('archivia_lezioni', giorni=30, batch=1, stdout=uscita)
+        self.assertIn('2 lezioni spostate', uscita.getvalue())
+        self.assertEqual(set(LezioneArchiviata.objects.values_list('id', flat=True)), {self.saldata, self.rifiutata})
+        self.assertEqual(set(Lezione.objects.values_list('id', flat=True)), {self.da_saldare, self.recente})
+
+        # Secondo giro: niente da fare
+        call_command('archivia_lezioni', giorni=30, stdout=StringIO())
+        self.assertEqual(LezioneArchiviata.objects.count(), 2)
+
+    def test_dry_run_non_sposta(self):
+        uscita = StringIO()
+        call_command('archivia_lezioni', giorni=30, dry_run=True, stdout=uscita)
+        self.assertIn('Da archiviare: 2 lezioni', uscita.getvalue())
+        self.assertFalse(LezioneArchiviata.objects.exists())
+
+    def test_export_include_l_archivio(self):
+        call_command('archivia_lezioni', giorni=30, stdout=StringIO())
+        self.client.force_login(User.objects.create_superuser('prof', 'p@x.it', 'Xyz!12345abc'))
+        righe = self.client.get(reverse('esporta_storico')).content.decode().splitlines()[1:]
+        archiviata = {int(r.split(';')[0]): r.split(';')[-1] for r in righe}
+        # Solo confermate passate, dalle due tabelle, più recenti prima
+        self.assertEqual(list(archiviata), [self.recente, self.saldata, self.da_saldare])
+        self.assertEqual(archiviata[self.saldata], 'Si')
+        self.assertEqual(archiviata[self.da_saldare], 'No')
+
+
+class RicercaTest(TestCase):
+    """Ricerca full-text: studenti per nome/scuola/telefono, lezioni per note; indice in sync con le modifiche."""
+
+    def setUp(self):
+        search.fts_disponibile()
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc', first_name='Mario', last_name='Rossi')
+        profilo = self.studente.profilo
+        profilo.scuola, profilo.telefono = 'Liceo Galilei', '3331234567'
+        profilo.save()
+        User.objects.create_user('luigi', 'l@x.it', 'Xyz!12345abc', first_name='Luigi', last_name='Verdi')
+        self.lezione = Lezione.objects.create(studente=self.studente, data_inizio=timezone.now() + timedelta(days=1),
+                                              note='Perché le equazioni di secondo grado')
+
+    def test_trova_studenti_e_note(self):
+        self.assertTrue(search.fts_disponibile())
+        # Una MATCH per tipo più il recupero degli studenti trovati (nessuna lezione: niente in_bulk)
+        with self.assertNumQueries(3):
+            self.assertEqual(search.cerca('ross'), ([self.studente], []))
+        self.assertEqual(search.cerca('galilei mario'), ([self.studente], []))
+        self.assertEqual(search.cerca('3331234567'), ([self.studente], []))
+        # Prefissi e accenti ignorati
+        self.assertEqual(search.cerca('perche equaz'), ([], [self.lezione]))
+        self.assertEqual(search.cerca('"*)'), ([], []))
+
+    def test_indice_segue_le_modifiche(self):
+        self.lezione.note = 'Derivate'
+        self.lezione.save()
+        self.assertEqual(search.cerca('equazioni'), ([], []))
+        self.assertEqual(search.cerca('derivate'), ([], [self.lezione]))
+
+        self.lezione.delete()
+        self.assertEqual(search.cerca('derivate'), ([], []))
+
+        # Ricostruzione da zero: stesso risultato dei signal
+        call_command('ricostruisci_ricerca', stdout=StringIO())
+        self.assertEqual(search.cerca('galilei'), ([self.studente], []))
+
+    def test_fallback_senza_fts(self):
+        with mock.patch.object(search, '_fts_attivo', False):
+            self.assertEqual(search.cerca('Galilei'), ([self.studente], []))
+            self.assertEqual(search.cerca('equazioni'), ([], [self.lezione]))
+
+
+class ReplicaRouterTest(TestCase):
+    """Letture sulla replica solo nelle GET delle view marcate, mai dopo un POST recente; scritture su default."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+        @usa_replica
+        def vista(request):
+            return HttpResponse(' '.join([self.router.db_for_read(Lezione), self.router.db_for_write(Lezione),
+                                          self.router.db_for_read(Session)]))
+
+        self.vista = vista
+
+    def alias(self, request):
+        return self.vista(request).content.decode().split()
+
+    def test_instradamento(self):
+        with mock.patch('core.db_router.replica_configurata', return_value=True):
+            self.assertEqual(self.alias(self.factory.get('/')), ['replica', 'default', 'default'])
+            self.assertEqual(self.alias(self.factory.post('/')), ['default', 'default', 'default'])
+            # Fuori dalle view marcate si legge dal primario
+            self.assertEqual(self.router.db_for_read(Lezione), 'default')
+
+        # Replica non configurata (DATABASE_REPLICA_NAME vuoto): tutto su default
+        self.assertEqual(self.alias(self.factory.get('/')), ['default', 'default', 'default'])
+
+    def test_pin_dopo_una_scrittura(self):
+        with mock.patch('core.db_router.replica_configurata', return_value=True):
+            with override_settings(REPLICA_PIN_SECONDI=10):
+                response = ReplicaPinMiddleware(lambda r: HttpResponse())(self.factory.post('/'))
+            pin = response.cookies[COOKIE_PIN]
+            self.assertEqual(pin['max-age'], 10)
+
+            richiesta = self.factory.get('/')
+            richiesta.COOKIES[COOKIE_PIN] = pin.value
+            self.assertEqual(self.alias(richiesta)[0], 'default')
+            # Pin scaduto o cookie manomesso: si torna sulla replica
+            for valore in (str(time_mod.time() - 1), 'x'):
+                richiesta.COOKIES[COOKIE_PIN] = valore
+                self.assertEqual(self.alias(richiesta)[0], 'replica')
+
+            self.assertNotIn(COOKIE_PIN, ReplicaPinMiddleware(lambda r: HttpResponse())(self.factory.get('/')).cookies)
+
+
+class ImportazioneCsvTest(TestCase):
+    """Import CSV in blocco: studenti, profili, prezzi e saldo come con i signal, errori riga per riga."""
+
+    INTESTAZIONE = 'username;first_name;scuola;tariffa_specifica;data;ora;durata_ore;luogo;stato;pagata;note;prezzo\n'
+
+    def setUp(self):
+        search.fts_disponibile()
+        cache.clear()
+
+    def csv(self, righe):
+        return StringIO(self.INTESTAZIONE + ''.join(f'{r}\n' for r in righe))
+
+    def righe_lezioni(self, username, quante):
+        return [f'{username};Nome;Liceo Galilei;;2024-03-{g:02d};15:00;1,5;BASE;CONFERMATA;;' for g in range(1, quante + 1)]
+
+    def test_importa_e_segnala_gli_errori(self):
+        resoconto = importa_csv(self.csv([
+            'mario;Mario;Liceo Galilei;;2024-03-01;15:00;1;BASE;CONFERMATA;;Limiti',
+            'mario;Mario;;;2024-03-08;15:00;2;BASE;CONFERMATA;si;',
+            'luigi;Luigi;;30;2024-03-02;16:00;1;BASE;;;',
+            'anna;Anna;;;2024-13-01;15:00;1;BASE;;;',
+            ';Senza;;;;;;;;;',
+            'paolo;Paolo;;;;;;;;;',
+            # Numeri non finiti o che non stanno nella colonna: errore sulla riga, non sul bulk_create
+            'nan1;;;;2024-03-03;15:00;nan;BASE;;;',
+            'nan2;;;;2024-03-03;15:00;sNaN;BASE;;;',
+            'inf1;;;;2024-03-03;15:00;inf;BASE;;;',
+            'gran1;;;;2024-03-03;15:00;1e9;BASE;;;',
+            'dec1;;;;2024-03-03;15:00;1,25;BASE;;;',
+            'gran2;;;;2024-03-03;15:00;1;BASE;;;;1e9',
+            'nan3;;;;2024-03-03;15:00;1;BASE;;;;-NaN',
+            'inf2;;;Infinity;;;;;;;',
+        ]))
+        self.assertEqual((resoconto.righe, resoconto.studenti_creati, resoconto.lezioni_create), (14, 3, 3))
+        self.assertEqual([numero for numero, _ in resoconto.errori], [5, 6, *range(8, 16)])
+        self.assertIn('durata_ore fuori formato', dict(resoconto.errori)[11])
+
+        mario = User.objects.select_related('profilo').get(username='mario')
+        luigi = User.objects.select_related('profilo').get(username='luigi')
+        self.assertFalse(mario.has_usable_password())
+        self.assertEqual(luigi.profilo.tariffa_specifica, Decimal('30'))
+        self.assertEqual(Lezione.objects.get(studente=luigi).prezzo,
+                         Lezione.calcola_prezzo(Decimal('30'), Decimal('1'), 'BASE'))
+        # Saldo come se le lezioni fossero passate da save(): solo quella non pagata
+        da_saldare = Lezione.objects.get(studente=mario, pagata=False)
+        self.assertEqual(mario.profilo.saldo, da_saldare.importo_da_saldare())
+        self.assertEqual(search.cerca('limiti'), ([], [da_saldare]))
+        self.assertTrue(User.objects.filter(username='paolo').exists())
+
+        # Rilanciare lo stesso file non duplica nulla
+        resoconto = importa_csv(self.csv(['mario;Mario;;;2024-03-01;15:00;1;BASE;CONFERMATA;;Limiti']))
+        self.assertEqual((resoconto.studenti_creati, resoconto.lezioni_create, resoconto.lezioni_gia_presenti), (0, 0, 1))
+
+    def test_query_fisse_per_blocco(self):
+        with CaptureQueriesContext(connection) as poche:
+            self.assertEqual(importa_csv(self.csv(self.righe_lezioni('mario', 3))).lezioni_create, 3)
+        with CaptureQueriesContext(connection) as tante:
+            self.assertEqual(importa_csv(self.csv(self.righe_lezioni('luigi', 28))).lezioni_create, 28)
+        self.assertEqual(len(tante), len(poche))
+
+
+class RigheLezioniTest(TestCase):
+    """Le righe leggere delle liste mostrano gli stessi valori delle istanze del modello."""
+
+    def setUp(self):
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc', first_name='Mario', last_name='Rossi')
+        Profilo.objects.filter(user=self.studente).update(telefono='333 1234567')
+        self.lezione = Lezione.objects.create(studente=self.studente, data_inizio=timezone.now() + timedelta(days=1),
+                                              luogo='RUFINA', note='Equazioni')
+
+    def test_valori_come_il_modello(self):
+        lezione = Lezione.objects.select_related('studente__profilo').get(pk=self.lezione.pk)
+        riga, = righe_lezioni(Lezione.objects.filter(pk=lezione.pk), calendario=True)
+
+        self.assertEqual(riga.luogo_display, lezione.get_luogo_display())
+        self.assertEqual(riga.calendario_url, lezione.get_google_calendar_url())
+        self.assertEqual((riga.studente_nome, riga.studente_cognome, riga.telefono), ('Mario', 'Rossi', '333 1234567'))
+        self.assertEqual((riga.prezzo, riga.stato, riga.archiviata), (lezione.prezzo, 'RICHIESTA', False))
+        with self.assertRaises(AttributeError):
+            riga.altro = 1
+
+    def test_archiviata_e_senza_studente(self):
+        LezioneArchiviata.da_lezione(self.lezione).save()
+        riga, = righe_lezioni(LezioneArchiviata.objects.all())
+        self.assertTrue(riga.archiviata)
+
+        riga, = righe_lezioni(Lezione.objects.all(), studente=False)
+        self.assertEqual((riga.studente_nome, riga.telefono, riga.calendario_url), ('', '', ''))
+
+
+class EmailTest(TestCase):
+    """Render in blocco delle email: versione testuale dal template .txt quando c'è, altrimenti dall'HTML."""
+
+    def setUp(self):
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc', first_name="D'Angelo")
+        self.lezione = Lezione.objects.create(studente=self.studente, data_inizio=timezone.now() + timedelta(days=1),
+                                              luogo='RUFINA')
+
+    def test_promemoria_dal_template_testuale(self):
+        with mock.patch('core.utils.html_a_testo') as da_html:
+            messaggi = prepara_email_multiple('Promemoria', 'promemoria_lezione.html',
+                                              [(['m@x.it'], {'lezione': self.lezione})] * 3)
+        da_html.assert_not_called()
+        self.assertEqual(len(messaggi), 3)
+        testo = messaggi[0].body
+        self.assertIn("Ciao D'Angelo", testo)
+        self.assertIn(f"Dove: {self.lezione.get_luogo_display()}", testo)
+        self.assertEqual(messaggi[0].alternatives[0][1], 'text/html')
+
+    def test_senza_template_testuale_converte_l_html(self):
+        messaggio = prepara_email('Rifiuto', 'm@x.it', 'rifiuto_lezione.html', {'lezione': self.lezione})
+        self.assertIn("Ciao D'Angelo", messaggio.body)
+        self.assertNotIn('<', messaggio.body)
+        self.assertNotIn('font-family', messaggio.body)
+
+
+class ProssimiSlotTest(TestCase):
+    """Finder dei prossimi slot liberi: chiusure, lezioni occupate, limite di risultati, fine del periodo."""
+
+    def setUp(self):
+        cache.clear()
+        Disponibilita.objects.bulk_create([
+            Disponibilita(giorno=g, ora_inizio=time(14), ora_fine=time(16)) for g in range(7)
+        ])
+        self.dal = timezone.localdate() + timedelta(days=10)
+        GiornoChiusura.objects.create(data_inizio=self.dal, data_fine=self.dal, motivo="Ferie")
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc')
+
+    def alle(self, giorni, ore, minuti=0):
+        return timezone.make_aware(datetime.combine(self.dal + timedelta(days=giorni), time(ore, minuti)))
+
+    def test_salta_chiusure_e_slot_occupati(self):
+        # Il primo giorno è chiuso, il secondo è coperto dalla lezione delle 14:30 (nessuna ora intera libera)
+        Lezione.objects.create(studente=self.studente, data_inizio=self.alle(1, 14, 30))
+        trovati = slots.prossimi_slot_liberi(self.dal, 1, quanti=4)
+        self.assertEqual(trovati, [self.alle(2, 14), self.alle(2, 14, 30), self.alle(2, 15), self.alle(3, 14)])
+
+    def test_si_ferma_a_fine_periodo(self):
+        self.assertEqual(slots.prossimi_slot_liberi(self.dal, 1, quanti=10, max_giorni=2),
+                         [self.alle(1, 14), self.alle(1, 14, 30), self.alle(1, 15)])
+        # Più lunga di ogni fascia oraria: nessuno slot, ma la ricerca termina
+        self.assertEqual(slots.prossimi_slot_liberi(self.dal, 3, quanti=1), [])
+
+    def test_parametri_non_validi(self):
+        for parametri in ({'durata_ore': 'nan'}, {'durata_ore': 'inf'}, {'durata_ore': 'x'},
+                          {'data': '9999-12-31'}, {'data': '0001-01-01'}, {'data': 'ieri'}):
+            with self.subTest(**parametri):
+                self.assertEqual(self.client.get(reverse('prossimi_slot'), parametri).status_code, 200)
+
+
+class HeatmapTest(TestCase):
+    """Cache dei mesi chiusi della heatmap: una lettura per periodo, invalidata anche dal mese di partenza."""
+
+    def setUp(self):
+        cache.clear()
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc')
+        primo = timezone.localdate().replace(day=1)
+        self.mese_prima = (primo - timedelta(days=1)).replace(day=1)
+        self.due_mesi_fa = (self.mese_prima - timedelta(days=1)).replace(day=1)
+
+    def ore_prenotate(self, mese):
+        fine = (mese + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        prenotate, _ = heatmap.occupazione(mese, fine)
+        return sum(map(sum, prenotate))
+
+    def test_mesi_chiusi_dalla_cache(self):
+        self.ore_prenotate(self.due_mesi_fa)
+        with self.assertNumQueries(0):
+            self.ore_prenotate(self.due_mesi_fa)
+
+    def test_spostare_una_lezione_invalida_anche_il_mese_di_partenza(self):
+        lezione = Lezione.objects.create(studente=self.studente, stato='CONFERMATA', durata_ore=Decimal('1'),
+                                         data_inizio=timezone.make_aware(datetime.combine(self.mese_prima.replace(day=10), time(15))))
+        self.assertEqual((self.ore_prenotate(self.mese_prima), self.ore_prenotate(self.due_mesi_fa)), (1.0, 0.0))
+
+        # Istanza ricaricata: la data di partenza va presa dal DB, non da quella in memoria
+        lezione = Lezione.objects.get(pk=lezione.pk)
+        lezione.data_inizio = timezone.make_aware(datetime.combine(self.due_mesi_fa.replace(day=10), time(15)))
+        # L'invalidazione parte al commit
+        with self.captureOnCommitCallbacks(execute=True) as callback:
+            lezione.save()
+        self.assertTrue(callback)
+        self.assertEqual((self.ore_prenotate(self.mese_prima), self.ore_prenotate(self.due_mesi_fa)), (0.0, 1.0))
+
+
+class EventiLiveTest(TestCase):
+    """Pub/sub delle notifiche SSE: una richiesta salvata arriva agli iscritti dopo il commit."""
+
+    def setUp(self):
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc', first_name='Mario')
+
+    def test_richiesta_arriva_all_iscritto(self):
+        def prenota():
+            with self.captureOnCommitCallbacks(execute=True):
+                return Lezione.objects.create(studente=self.studente, data_inizio=timezone.now() + timedelta(days=1))
+
+        async def ricevi():
+            iscrizione = eventi.iscrivi()
+            try:
+                lezione = await sync_to_async(prenota)()
+                return lezione, await asyncio.wait_for(iscrizione[1].get(), 5)
+            finally:
+                eventi.disiscrivi(iscrizione)
+
+        lezione, evento = async_to_sync(ricevi)()
+        self.assertEqual((evento['tipo'], evento['id'], evento['stato']), ('richiesta', lezione.pk, 'RICHIESTA'))
+        self.assertIn('Mario', evento['html'])
+        self.assertFalse(eventi.ci_sono_iscritti())
+
+    def test_niente_stream_sotto_wsgi(self):
+        # USA_VIEW_ASYNC spento (default dei test): l'URL non esiste e la dashboard non apre lo stream
+        with self.assertRaises(NoReverseMatch):
+            reverse('eventi_docente')
+        self.client.force_login(User.objects.create_superuser('prof', 'p@x.it', 'Xyz!12345abc'))
+        self.assertNotContains(self.client.get(reverse('dashboard_docente')), 'EventSource')
+
+
+class LimitiTest(TestCase):
+    """Token bucket del rate limit e coalescing dei calcoli concorrenti (core/limiti.py, core/cache.py)."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_consuma_e_ricarica(self):
+        with mock.patch('core.limiti.time.time', return_value=1000.0) as orologio:
+            self.assertEqual([limiti.consuma('k', 3, 2) for _ in range(3)], [0, 0, 0])
+            # Secchio vuoto: mezzo secondo per il prossimo gettone (2 al secondo)
+            self.assertAlmostEqual(limiti.consuma('k', 3, 2), 0.5)
+            orologio.return_value = 1000.25
+            self.assertAlmostEqual(limiti.consuma('k', 3, 2), 0.25)
+            orologio.return_value = 1000.5
+            self.assertEqual(limiti.consuma('k', 3, 2), 0)
+
+            # Dopo tanto tempo il secchio è pieno, ma non oltre la capacità
+            orologio.return_value = 2000.0
+            self.assertEqual([limiti.consuma('k', 3, 2) > 0 for _ in range(4)], [False, False, False, True])
+            # Chiavi diverse, secchi diversi
+            self.assertEqual(limiti.consuma('altro', 3, 2), 0)
+
+    @override_settings(LIMITE_CAPACITA=2, LIMITE_RICARICA=0.1)
+    def test_429_con_retry_after(self):
+        url = reverse('get_orari') + '?data=' + (timezone.localdate() + timedelta(days=1)).isoformat()
+        self.assertEqual([self.client.get(url).status_code for _ in range(2)], [200, 200])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_view_async(self):
+        @limiti.limita('prova', capacita=1, ricarica=0.1)
+        async def vista(request):
+            return HttpResponse('ok')
+
+        richiesta = RequestFactory().get('/')
+        self.assertEqual([async_to_sync(vista)(richiesta).status_code for _ in range(2)], [200, 429])
+
+    def test_condividi_calcolo(self):
+        iniziato, via = threading.Event(), threading.Event()
+        chiamate = []
+
+        def calcola():
+            chiamate.append(1)
+            iniziato.set()
+            via.wait(5)
+            return 'risultato'
+
+        risultati = []
+        thread = [threading.Thread(target=lambda: risultati.append(condividi_calcolo('k', calcola)))
+                  for _ in range(5)]
+        thread[0].start()
+        iniziato.wait(5)
+        for t in thread[1:]:
+            t.start()
+        # Gli altri thread trovano il calcolo in volo e aspettano quello
+        time_mod.sleep(0.1)
+        via.set()
+        for t in thread:
+            t.join(5)
+        self.assertEqual((len(chiamate), risultati), (1, ['risultato'] * 5))
+        # Finito il volo si ricalcola
+        self.assertEqual(condividi_calcolo('k', lambda: 'nuovo'), 'nuovo')
+
+    def test_acondividi_calcolo(self):
+        chiamate = []
+
+        async def acalcola():
+            chiamate.append(1)
+            await asyncio.sleep(0.05)
+            return 'risultato'
+
+        async def scenario():
+            primo = asyncio.ensure_future(acondividi_calcolo('k', acalcola))
+            altri = [asyncio.ensure_future(acondividi_calcolo('k', acalcola)) for _ in range(4)]
+            await asyncio.sleep(0)
+            # Il client che ha avviato il calcolo se ne va: gli altri ricevono comunque il risultato
+            primo.cancel()
+            return await asyncio.gather(*altri)
+
+        self.assertEqual(asyncio.run(scenario()), ['risultato'] * 4)
+        self.assertEqual(len(chiamate), 1)
+
+
+# "SCAN core_lezione", "SCAN U0" (alias di una subquery), "SCAN TABLE x" sulle versioni vecchie di SQLite
+_RE_SCAN = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?')
+# Gli alias che Django dà alle tabelle nelle join e nelle subquery: "core_lezione" U0, "auth_user" T3
+_RE_ALIAS = re.compile(r'"(\w+)"(?:\s+AS)?\s+"?([A-Z]\d+)"?')
+
+
+def piano_query(sql):
+    """Le righe di EXPLAIN QUERY PLAN per una query già catturata (parametri già sostituiti)."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [riga[-1] for riga in cursor.fetchall()]
+
+
+def _ambiti(sql):
+    """
+    Per ogni carattere della query: in quale SELECT si trova (0 = query principale, poi uno per ogni
+    "(SELECT" annidato) e se è dentro '...' o "...". Ritorna (ambiti, citato, genitore di ogni ambito).
+    """
+    ambiti, citato, genitore = [], [], {0: None}
+    pila = [0]
+    virgolette = None
+    for i, c in enumerate(sql):
+        if virgolette or c in '\'"':
+            # '' dentro una stringa chiude e riapre subito: torna comunque
+            virgolette = None if c == virgolette else virgolette or c
+            ambiti.append(pila[-1])
+            citato.append(True)
+            continue
+        if c == '(':
+            if re.match(r'\(\s*SELECT\b', sql[i:i + 20], re.IGNORECASE):
+                genitore[len(genitore)] = pila[-1]
+                pila.append(len(genitore) - 1)
+            else:
+                pila.append(pila[-1])
+        ambiti.append(pila[-1])
+        citato.append(False)
+        if c == ')' and len(pila) > 1:
+            pila.pop()
+    return ambiti, citato, genitore
+
+
+def alias_univoci(sql):
+    """
+    Django chiama U0 la tabella di ogni subquery: con due subquery su tabelle diverse "SCAN U0" è ambiguo.
+    Riscrive la query con un alias per SELECT (U0 -> U0_1, U0_2, ...), risolvendo ogni riferimento
+    sull'ambito che lo dichiara (anche dalle subquery correlate). Ritorna (sql, {alias: tabella}).
+    """
+    ambiti, citato, genitore = _ambiti(sql)
+    dichiarati = {(ambiti[m.start(2)], m.group(2)): m.group(1) for m in _RE_ALIAS.finditer(sql)}
+
+    pezzi, alias, fine = [], {}, 0
+    for m in re.finditer(r'\b[A-Z]\d+\b', sql):
+        if citato[m.start()]:
+            continue
+        ambito = ambiti[m.start()]
+        while ambito is not None and (ambito, m.group()) not in dichiarati:
+            ambito = genitore[ambito]
+        if ambito is None:
+            continue
+        nuovo = f"{m.group()}_{ambito}"
+        alias[nuovo] = dichiarati[(ambito, m.group())]
+        pezzi += [sql[fine:m.start()], nuovo]
+        fine = m.end()
+    return ''.join(pezzi) + sql[fine:], alias
+
+
+def scansioni(sql, tabelle):
+    """(piano, righe del piano che leggono per intero una delle `tabelle`)."""
+    riscritta, univoci = alias_univoci(sql)
+    try:
+        piano = piano_query(riscritta)
+        alias = {a: {tabella} for a, tabella in univoci.items()}
+    except DatabaseError:
+        # Riscrittura non riuscita: uno SCAN su un alias conta per tutte le tabelle che lo usano
+        piano = piano_query(sql)
+        alias = {}
+        for tabella, a in _RE_ALIAS.findall(sql):
+            alias.setdefault(a, set()).add(tabella)
+    trovate = [riga for riga in piano
+               if (m := _RE_SCAN.match(riga)) and alias.get(m.group(1), {m.group(1)}) & tabelle]
+    return piano, trovate
+
+
+class PianiQueryTest(TestCase):
+    """
+    Le query dei percorsi caldi su lezioni e utenti devono usare un indice (SEARCH), mai leggere tutta
+    la tabella (SCAN). Se un test fallisce, il messaggio riporta la query e il suo piano completo.
+    """
+
+    TABELLE_CALDE = {'core_lezione', 'auth_user'}
+
+    def setUp(self):
+        cache.clear()
+        search.fts_disponibile()
+        self.docente = User.objects.create_user('docente', 'd@x.it', 'Xyz!12345abc', is_staff=True)
+        self.studente = User.objects.create_user('mario', 'm@x.it', 'Xyz!12345abc', first_name='Mario')
+        altro = User.objects.create_user('luigi', 'l@x.it', 'Xyz!12345abc', first_name='Luigi')
+
+        Disponibilita.objects.bulk_create([
+            Disponibilita(giorno=g, ora_inizio=time(8), ora_fine=time(22)) for g in range(7)
+        ])
+        GiornoChiusura.objects.create(data_inizio=timezone.localdate() + timedelta(days=30), motivo="Ferie")
+
+        adesso = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for i in range(40):
+            Lezione.objects.create(
+                studente=self.studente if i % 2 else altro, data_inizio=adesso + timedelta(days=i - 20, hours=i % 5),
+                stato=['RICHIESTA', 'CONFERMATA', 'CONFERMATA', 'RIFIUTATA'][i % 4], pagata=i % 3 == 0,
+            )
+        LezioneArchiviata.objects.create(id=10_000, studente=self.studente, stato='CONFERMATA', pagata=True,
+                                         data_inizio=adesso - timedelta(days=800))
+        self.giorno_libero = timezone.localdate() + timedelta(days=60)
+
+    @contextmanager
+    def assertNessunaScansione(self, percorso):
+        with CaptureQueriesContext(connection) as catturate:
+            yield
+        problemi = []
+        for query in catturate.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+                continue
+            piano, trovate = scansioni(sql, self.TABELLE_CALDE)
+            if trovate:
+                problemi.append(f"{sql}\n" + "\n".join(f"    {riga}" for riga in piano))
+        if problemi:
+            self.fail(f"{percorso}: {len(problemi)} query con SCAN su {', '.join(sorted(self.TABELLE_CALDE))}\n\n"
+                      + "\n\n".join(problemi))
+
+    def test_rileva_una_scansione(self):
+        # Il controllo stesso: un filtro su una colonna senza indice deve far fallire il test
+        with self.assertRaisesMessage(AssertionError, 'SCAN core_lezione'):
+            with self.assertNessunaScansione('note'):
+                list(Lezione.objects.filter(note='x'))
+
+    def test_rileva_una_scansione_in_una_subquery(self):
+        # Due subquery con lo stesso alias U0 su tabelle diverse: la scansione è su core_lezione (la prima),
+        # anche se l'ultimo U0 della query è l'archivio
+        with self.assertRaisesMessage(AssertionError, 'SCAN U0_1'):
+            with self.assertNessunaScansione('subquery'):
+                list(User.objects.filter(
+                    Q(id__in=Lezione.objects.filter(note='x').values('studente_id')) |
+                    Q(id__in=LezioneArchiviata.objects.filter(stato='CONFERMATA').values('studente_id'))
+                ))
+
+    def test_alias_univoci(self):
+        sql, alias = alias_univoci(
+            'SELECT T1."id" FROM "auth_user" T1 WHERE T1."id" IN (SELECT U0."studente_id" FROM "core_lezione" U0 '
+            'WHERE U0."studente_id" = T1."id" AND U0."note" = \'U0 (\'\'x\'\')\') '
+            'OR T1."id" IN (SELECT U0."studente_id" FROM "core_lezionearchiviata" U0)'
+        )
+        self.assertEqual(alias, {'T1_0': 'auth_user', 'U0_1': 'core_lezione', 'U0_2': 'core_lezionearchiviata'})
+        self.assertIn('U0_1."studente_id" = T1_0."id" AND U0_1."note" = \'U0 (\'\'x\'\')\'', sql)
+
+    def test_orari_e_prenotazione(self):
+        self.client.force_login(self.studente)
+        with self.assertNessunaScansione('get_orari_disponibili'):
+            response = self.client.get(reverse('get_orari'), {'data': self.giorno_libero.isoformat()})
+        self.assertEqual(response.status_code, 200)
+
+        # PrenotazioneForm.clean: controllo disponibilità e sovrapposizioni
+        with self.assertNessunaScansione('prenota'):
+            response = self.client.post(reverse('prenota'), {
+                'data': self.giorno_libero.isoformat(), 'ora': '15:00', 'durata_ore': '1', 'luogo': 'BASE', 'note': '',
+            })
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+
+    def test_dashboard(self):
+        self.client.force_login(self.studente)
+        with self.assertNessunaScansione('dashboard'):
+            self.assertEqual(self.client.get(reverse('dashboard')).status_code, 200)
+
+    def test_dashboard_docente(self):
+        self.client.force_login(self.docente)
+        with self.assertNessunaScansione('dashboard_docente'):
+            self.assertEqual(self.client.get(reverse('dashboard_docente')).status_code, 200)
+
+        # Storico filtrato per studente e periodo (UNION con l'archivio)
+        filtri = {'studente': self.studente.id, 'dal': '2020-01-01', 'al': timezone.localdate().isoformat()}
+        with self.assertNessunaScansione('dashboard_docente (storico filtrato)'):
+            self.assertEqual(self.client.get(reverse('dashboard_docente'), filtri).status_code, 200)
+
+    def test_gestione_pagamenti(self):
+        self.client.force_login(self.docente)
+        for azione in ('invia_riepilogo', 'segna_pagato'):
+            with self.subTest(azione=azione), self.assertNessunaScansione(f'gestione_pagamenti/{azione}'):
+                response = self.client.get(reverse('gestione_pagamenti', args=[self.studente.id, azione]))
+                self.assertEqual(response.status_code, 302)
@@ -1,15 +1,67 @@
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+import asyncio
+import re
+from html import unescape
+
+from asgiref.sync import sync_to_async
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
 from django.utils.html import strip_tags
 from django.conf import settings
 
-def invia_email_custom(soggetto, destinatari, template_name, context):
+# Riferimenti forti ai task di invio in background (altrimenti il GC può cancellarli a metà)
+_invii_in_corso = set()
+
+
+# <head> (con il CSS) non serve alla versione testuale: lo tolgo prima di strip_tags,
+# così il parser HTML lavora solo sul corpo e nel testo non finiscono le regole di stile
+_RE_HEAD = re.compile(r'<head\b.*?</head>|<style\b.*?</style>', re.IGNORECASE | re.DOTALL)
+_RE_A_CAPO = re.compile(r'[ \t]*\n[ \t]*')
+_RE_RIGHE_VUOTE = re.compile(r'\n{3,}')
+
+
+def html_a_testo(html_content):
+    testo = unescape(strip_tags(_RE_HEAD.sub('', html_content)))
+    testo = _RE_A_CAPO.sub('\n', testo)
+    return _RE_RIGHE_VUOTE.sub('\n\n', testo).strip()
+
+
+def _template_testo(template_name):
     """
-    Wrapper per inviare mail HTML + Plain Text in modo pulito.
+    Versione testuale scritta a mano (emails/<nome>.txt), se c'è: per le email spedite in blocco
+    (promemoria) o piene di righe (riepilogo pagamenti) evita html_a_testo su ogni messaggio.
     """
-    html_content = render_to_string(f'emails/{template_name}', context)
-    text_content = strip_tags(html_content) # La versione testuale è fondamentale per non finire nello spam
+    try:
+        return get_template(f"emails/{template_name.rsplit('.', 1)[0]}.txt")
+    except TemplateDoesNotExist:
+        return None
+
+
+def prepara_email(soggetto, destinatari, template_name, context):
+    return prepara_email_multiple(soggetto, template_name, [(destinatari, context)])[0]
+
+
+def prepara_email_multiple(soggetto, template_name, invii):
+    """
+    Render in blocco: `invii` è un iterabile di coppie (destinatari, context).
+    I template vengono risolti una volta sola e riusati per tutti i destinatari
+    (compilati li tiene già il cached loader di Django, riscaldato all'avvio da core/avvio.py).
+    Da abbinare a invia_email_multiple per spedire tutto su una connessione.
+    """
+    template = get_template(f'emails/{template_name}')
+    template_testo = _template_testo(template_name)
+
+    messaggi = []
+    for destinatari, context in invii:
+        html_content = template.render(context)
+        # La versione testuale è fondamentale per non finire nello spam
+        text_content = template_testo.render(context).strip() if template_testo else html_a_testo(html_content)
+        messaggi.append(crea_email(soggetto, destinatari, html_content, text_content))
+    return messaggi
+
 
+def crea_email(soggetto, destinatari, html_content, text_content):
+    """Messaggio HTML + testo da contenuti già pronti (es. documenti salvati a DB)."""
     msg = EmailMultiAlternatives(
         subject=soggetto,
         body=text_content,
@@ -17,8 +69,44 @@ def invia_email_custom(soggetto, destinatari, template_name, context):
         # Comodità: accetto sia una lista ['a@b.it'] che una stringa singola 'a@b.it'
         to=destinatari if isinstance(destinatari, list) else [destinatari]
     )
-
     msg.attach_alternative(html_content, "text/html")
+    return msg
+
+
+def invia_email_custom(soggetto, destinatari, template_name, context):
+    """
+    Wrapper per inviare mail HTML + Plain Text in modo pulito.
+    """
+    msg = prepara_email(soggetto, destinatari, template_name, context)
 
     # Se l'SMTP ha problemi temporanei, meglio fallire silenziosamente che mostrare Error 500 all'utente
-    msg.send(fail_silently=True)
\ No newline at end of file
+    msg.send(fail_silently=True)
+
+
+def invia_email_multiple(messaggi):
+    """
+    Invia tanti messaggi (preparati con prepara_email) su una sola connessione SMTP:
+    un solo handshake TLS + login invece di uno per mail. Ritorna quanti ne sono partiti.
+    """
+    if not messaggi:
+        return 0
+    with get_connection(fail_silently=True) as connessione:
+        return connessione.send_messages(messaggi) or 0
+
+
+async def ainvia_email_custom(soggetto, destinatari, template_name, context):
+    """
+    Versione async di invia_email_custom.
+    Il render può toccare l'ORM (es. lezione.studente), quindi gira nel thread "sync" di Django;
+    lo scambio SMTP invece va in un thread del pool, così l'event loop resta libero.
+    """
+    msg = await sync_to_async(prepara_email)(soggetto, destinatari, template_name, context)
+    await sync_to_async(msg.send, thread_sensitive=False)(fail_silently=True)
+
+
+def invia_in_background(coroutine):
+    """Lancia l'invio senza attendere la fine (solo sotto ASGI, dove l'event loop sopravvive alla richiesta)."""
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _invii_in_corso.add(task)
+    task.add_done_callback(_invii_in_corso.discard)
+    return task
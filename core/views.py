@@ -1,30 +1,40 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum
+from django.db.models import Sum, Q
 from django.contrib import messages
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404, StreamingHttpResponse
 from datetime import datetime, timedelta
 from django.utils import timezone
 from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.contrib.auth.models import User
 import csv
+import math
+from asgiref.sync import sync_to_async
 
 from .forms import (
     PrenotazioneForm, RegistrazioneForm, ProfiloForm,
     ChiusuraForm, DisponibilitaForm, ImpostazioniForm
 )
-from .models import Lezione, Disponibilita, Profilo, GiornoChiusura, Impostazioni
-from .utils import invia_email_custom
+from .models import Lezione, LezioneArchiviata, Disponibilita, Profilo, GiornoChiusura, Impostazioni, Movimento
+from .righe import righe_lezioni
+from .utils import invia_email_custom, ainvia_email_custom, invia_in_background
+from . import etag, eventi, heatmap, limiti, profiling, search, slots
+from .db_router import usa_replica
 
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag.etag_dashboard)
+@usa_replica
 def dashboard(request):
-    lezioni = Lezione.objects.filter(studente=request.user) \
-        .select_related('studente', 'studente__profilo') \
-        .order_by('-data_inizio')
+    # Solo i campi mostrati, in righe leggere: lo studente è request.user, niente join
+    lezioni = righe_lezioni(Lezione.objects.filter(studente=request.user).order_by('-data_inizio'), studente=False)
 
-    da_pagare = lezioni.filter(stato='CONFERMATA', pagata=False).aggregate(Sum('prezzo'))['prezzo__sum'] or 0
+    # Saldo tenuto aggiornato dal registro dei pagamenti: una riga, nessuna SUM
+    da_pagare = Profilo.per_utente(request.user).saldo
 
     return render(request, 'core/dashboard.html', {
         'lezioni': lezioni,
@@ -39,14 +49,21 @@ def prenota(request):
         if form.is_valid():
             lezione = form.save(commit=False)
             lezione.studente = request.user
+
+            # In modalità digest la richiesta resta "da notificare" e la raccoglie 'manage.py invia_digest':
+            # la prenotazione non paga l'handshake SMTP
+            notifica_subito = settings.NOTIFICHE_DOCENTE == 'immediata'
+            if notifica_subito:
+                lezione.notifica_docente_il = timezone.now()
             lezione.save()
 
-            invia_email_custom(
-                soggetto=f"Nuova Lezione: {request.user.username}",
-                destinatari=[settings.EMAIL_HOST_USER],
-                template_name='nuova_richiesta.html',
-                context={'lezione': lezione}
-            )
+            if notifica_subito:
+                invia_email_custom(
+                    soggetto=f"Nuova Lezione: {request.user.username}",
+                    destinatari=[settings.EMAIL_HOST_USER],
+                    template_name='nuova_richiesta.html',
+                    context={'lezione': lezione}
+                )
 
             messages.success(request, 'Richiesta inviata! Riceverai una mail di conferma.')
             return redirect('dashboard')
@@ -56,6 +73,41 @@ def prenota(request):
     return render(request, 'core/prenota.html', {'form': form})
 
 
+@login_required
+async def prenota_async(request):
+    """
+    Versione ASGI di prenota: la validazione usa l'ORM sincrono (nel thread dedicato di Django),
+    la mail al docente parte in background e la risposta non aspetta l'SMTP.
+    """
+    request.user = await request.auser()
+
+    if request.method == 'POST':
+        form = PrenotazioneForm(request.POST)
+        if await sync_to_async(form.is_valid)():
+            lezione = form.save(commit=False)
+            lezione.studente = request.user
+
+            notifica_subito = settings.NOTIFICHE_DOCENTE == 'immediata'
+            if notifica_subito:
+                lezione.notifica_docente_il = timezone.now()
+            await lezione.asave()
+
+            if notifica_subito:
+                invia_in_background(ainvia_email_custom(
+                    soggetto=f"Nuova Lezione: {request.user.username}",
+                    destinatari=[settings.EMAIL_HOST_USER],
+                    template_name='nuova_richiesta.html',
+                    context={'lezione': lezione}
+                ))
+
+            messages.success(request, 'Richiesta inviata! Riceverai una mail di conferma.')
+            return redirect('dashboard')
+    else:
+        form = PrenotazioneForm()
+
+    return await sync_to_async(render)(request, 'core/prenota.html', {'form': form})
+
+
 def registrazione(request):
     if request.method == 'POST':
         form = RegistrazioneForm(request.POST)
@@ -69,74 +121,74 @@ def registrazione(request):
     return render(request, 'registration/register.html', {'form': form})
 
 
-def get_orari_disponibili(request):
+def _data_da_request(request):
+    """Ritorna (data, None) oppure (None, messaggio d'errore già pronto come <option>)."""
     data_str = request.GET.get('data')
     if not data_str:
-        return HttpResponse("<option value=''>Seleziona prima una data</option>")
+        return None, "<option value=''>Seleziona prima una data</option>"
 
     try:
-        data_scelta = datetime.strptime(data_str, "%Y-%m-%d").date()
+        return datetime.strptime(data_str, "%Y-%m-%d").date(), None
     except ValueError:
-        return HttpResponse("<option value=''>Data non valida</option>")
-
-    chiusura = GiornoChiusura.objects.filter(
-        data_inizio__lte=data_scelta,
-        data_fine__gte=data_scelta
-    ).first()
-
-    if chiusura:
-        return HttpResponse(f"<option value=''>Non disponibile: {chiusura.motivo or 'Chiuso'}</option>")
+        return None, "<option value=''>Data non valida</option>"
 
-    giorno_settimana = data_scelta.weekday()
 
-    try:
-        disp = Disponibilita.objects.get(giorno=giorno_settimana)
-    except Disponibilita.DoesNotExist:
-        return HttpResponse("<option value=''>Nessuna lezione in questo giorno</option>")
+@limiti.limita('orari')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag.etag_orari)
+def get_orari_disponibili(request):
+    data_scelta, errore = _data_da_request(request)
+    if errore:
+        return HttpResponse(errore)
 
-    orari_possibili = []
-    ora_corrente = datetime.combine(data_scelta, disp.ora_inizio)
-    ora_fine = datetime.combine(data_scelta, disp.ora_fine)
+    return HttpResponse(slots.opzioni_giorno_condivise(data_scelta))
 
-    while ora_corrente < ora_fine:
-        orari_possibili.append(ora_corrente)
-        ora_corrente += timedelta(minutes=30)
 
-    lezioni_giorno = Lezione.objects.filter(
-        data_inizio__date=data_scelta,
-        stato__in=['RICHIESTA', 'CONFERMATA']
-    )
+@limiti.limita('orari')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag.etag_orari)
+async def get_orari_disponibili_async(request):
+    # Stessa logica della versione sincrona, ma con ORM async: sotto ASGI un solo worker
+    # regge molte richieste del date-picker senza tenere occupato un thread ciascuna
+    data_scelta, errore = _data_da_request(request)
+    if errore:
+        return HttpResponse(errore)
 
-    orari_liberi = []
-    for orario in orari_possibili:
-        occupato = False
-        inizio_slot = timezone.make_aware(orario)
+    return HttpResponse(await slots.aopzioni_giorno_condivise(data_scelta))
 
-        for lezione in lezioni_giorno:
-            lezione_inizio = lezione.data_inizio
-            durata = float(lezione.durata_ore) if lezione.durata_ore else 1.0
-            lezione_fine = lezione_inizio + timedelta(hours=durata)
 
-            if lezione_inizio <= inizio_slot < lezione_fine:
-                occupato = True
-                break
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag.etag_prossimi_slot)
+def get_prossimi_slot(request):
+    """Frammento HTMX con i primi slot liberi da una data in avanti, per la durata scelta."""
+    oggi = timezone.localdate()
+    try:
+        dal = datetime.strptime(request.GET.get('data') or '', "%Y-%m-%d").date()
+    except ValueError:
+        dal = oggi
+    # Endpoint pubblico: da oggi a un orizzonte ragionevole (con 9999-12-31 la fine del periodo andrebbe in overflow)
+    dal = min(max(dal, oggi), oggi + timedelta(days=slots.ORIZZONTE_GIORNI))
 
-        if not occupato:
-            str_orario = orario.strftime("%H:%M")
-            orari_liberi.append(f"<option value='{str_orario}'>{str_orario}</option>")
+    try:
+        durata = float(request.GET.get('durata_ore') or 1)
+    except ValueError:
+        durata = 1.0
+    # float() accetta anche 'nan' e 'inf'
+    if not math.isfinite(durata):
+        durata = 1.0
+    # Stessi limiti del form di prenotazione
+    durata = min(max(durata, 0.5), 4)
 
-    if not orari_liberi:
-        return HttpResponse("<option value=''>Tutto occupato!</option>")
+    trovati = slots.prossimi_slot_liberi(dal, durata, quanti=6)
 
-    return HttpResponse("".join(orari_liberi))
+    return render(request, 'core/partials/prossimi_slot.html', {
+        'slot': [timezone.localtime(s) for s in trovati],
+    })
 
 
 @login_required
 def profilo_view(request):
-    try:
-        profilo = request.user.profilo
-    except Profilo.DoesNotExist:
-        profilo = Profilo.objects.create(user=request.user)
+    profilo = Profilo.per_utente(request.user)
 
     if request.method == 'POST':
         form = ProfiloForm(request.POST, instance=profilo)
@@ -151,6 +203,9 @@ def profilo_view(request):
 
 
 @staff_member_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag.etag_dashboard_docente)
+@usa_replica
 def dashboard_docente(request):
     config_obj = Impostazioni.objects.first()
 
@@ -192,13 +247,13 @@ def dashboard_docente(request):
     # --- CARICAMENTO DATI BASE ---
     oggi = timezone.now()
 
-    richieste = Lezione.objects.filter(stato='RICHIESTA') \
-        .select_related('studente', 'studente__profilo') \
-        .order_by('data_inizio')
+    # Righe leggere (core/righe.py): solo le colonne mostrate, luogo e link al calendario già pronti
+    richieste = righe_lezioni(Lezione.objects.filter(stato='RICHIESTA').order_by('data_inizio'))
 
-    future = Lezione.objects.filter(stato='CONFERMATA', data_inizio__gte=oggi) \
-        .select_related('studente', 'studente__profilo') \
-        .order_by('data_inizio')
+    future = righe_lezioni(
+        Lezione.objects.filter(stato='CONFERMATA', data_inizio__gte=oggi).order_by('data_inizio'),
+        calendario=True,
+    )
 
     inizio_mese = timezone.now().date().replace(day=1)
     guadagno = Lezione.objects.filter(
@@ -211,22 +266,15 @@ def dashboard_docente(request):
     disponibilita_list = Disponibilita.objects.all().order_by('giorno')
 
     # --- PAGAMENTI IN SOSPESO RAGGRUPPATI ---
-    studenti_debitori_ids = Lezione.objects.filter(
-        stato='CONFERMATA', pagata=False
-    ).order_by().values_list('studente', flat=True).distinct()
-
-    lista_pagamenti = []
-    for s_id in studenti_debitori_ids:
-        studente = User.objects.get(id=s_id)
-        lezioni_da_pagare = Lezione.objects.filter(studente=studente, stato='CONFERMATA', pagata=False)
-        totale_s = lezioni_da_pagare.aggregate(Sum('prezzo'))['prezzo__sum'] or 0
-        conta_s = lezioni_da_pagare.count()
-
-        lista_pagamenti.append({
-            'studente': studente,
-            'numero_lezioni': conta_s,
-            'totale': totale_s
-        })
+    # Saldi denormalizzati sul profilo: una sola query invece di SUM + COUNT per ogni studente
+    lista_pagamenti = [
+        {
+            'studente': profilo.user,
+            'numero_lezioni': profilo.lezioni_da_saldare,
+            'totale': profilo.saldo,
+        }
+        for profilo in Profilo.objects.filter(saldo__gt=0).select_related('user').order_by('user__first_name')
+    ]
 
     # --- STORICO LEZIONI PASSATE E FILTRI ---
     # Recupero i parametri dall'URL (se ci sono)
@@ -234,27 +282,13 @@ def dashboard_docente(request):
     filtro_dal = request.GET.get('dal')
     filtro_al = request.GET.get('al')
 
-    # Prendo tutte le lezioni passate confermate
-    passate = Lezione.objects.filter(stato='CONFERMATA', data_inizio__lt=oggi).select_related('studente').order_by(
-        '-data_inizio')
-
-    # Applico i filtri se l'utente li ha selezionati
-    if filtro_studente:
-        passate = passate.filter(studente_id=filtro_studente)
-    if filtro_dal:
-        passate = passate.filter(data_inizio__date__gte=filtro_dal)
-    if filtro_al:
-        passate = passate.filter(data_inizio__date__lte=filtro_al)
+    storico = _storico_filtrato(oggi, filtro_studente, filtro_dal, filtro_al)
 
-    # Calcolo i totali della query filtrata
-    totale_ore_passate = passate.aggregate(Sum('durata_ore'))['durata_ore__sum'] or 0
-    totale_importo_passate = passate.aggregate(Sum('prezzo'))['prezzo__sum'] or 0
-
-    # Lista studenti per il menu a tendina (solo chi ha almeno una lezione passata)
+    # Lista studenti per il menu a tendina (solo chi ha almeno una lezione passata, anche archiviata)
     studenti_con_lezioni = User.objects.filter(
-        lezioni__stato='CONFERMATA',
-        lezioni__data_inizio__lt=oggi
-    ).distinct().order_by('first_name')
+        Q(id__in=Lezione.objects.filter(stato='CONFERMATA', data_inizio__lt=oggi).values('studente_id')) |
+        Q(id__in=LezioneArchiviata.objects.filter(stato='CONFERMATA').values('studente_id'))
+    ).order_by('first_name')
 
     return render(request, 'core/dashboard_docente.html', {
         'richieste': richieste,
@@ -266,11 +300,12 @@ def dashboard_docente(request):
         'disponibilita_list': disponibilita_list,
         'form_tariffa': form_tariffa,
         'lista_pagamenti': lista_pagamenti,
+        'eventi_live': settings.USA_VIEW_ASYNC,
 
         # Variabili per lo storico
-        'passate': passate,
-        'totale_ore_passate': totale_ore_passate,
-        'totale_importo_passate': totale_importo_passate,
+        'passate': storico['lezioni'],
+        'totale_ore_passate': storico['totale_ore'],
+        'totale_importo_passate': storico['totale_importo'],
         'studenti_con_lezioni': studenti_con_lezioni,
         'filtro_studente': filtro_studente,
         'filtro_dal': filtro_dal,
@@ -278,6 +313,160 @@ def dashboard_docente(request):
     })
 
 
+@staff_member_required
+async def eventi_docente(request):
+    """
+    Stream SSE delle richieste di lezione (vedi core/eventi.py). Richiede ASGI: la connessione resta aperta,
+    per questo l'URL esiste solo con USA_VIEW_ASYNC.
+    """
+    response = StreamingHttpResponse(eventi.flusso(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx non deve bufferizzare lo stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _storico_filtrato(oggi, filtro_studente=None, filtro_dal=None, filtro_al=None):
+    """
+    Lezioni passate confermate (tabella calda + archivio) con gli stessi filtri
+    dello storico. Usato sia dalla dashboard che dall'export CSV.
+    """
+    querysets = [
+        Lezione.objects.filter(stato='CONFERMATA', data_inizio__lt=oggi),
+        LezioneArchiviata.objects.filter(stato='CONFERMATA'),
+    ]
+
+    totale_ore = 0
+    totale_importo = 0
+    lezioni = []
+    for qs in querysets:
+        # Applico i filtri se l'utente li ha selezionati
+        if filtro_studente:
+            qs = qs.filter(studente_id=filtro_studente)
+        if filtro_dal:
+            qs = qs.filter(data_inizio__date__gte=filtro_dal)
+        if filtro_al:
+            qs = qs.filter(data_inizio__date__lte=filtro_al)
+
+        # Calcolo i totali della query filtrata (una sola aggregate per tabella)
+        totali = qs.aggregate(ore=Sum('durata_ore'), importo=Sum('prezzo'))
+        totale_ore += totali['ore'] or 0
+        totale_importo += totali['importo'] or 0
+
+        lezioni.extend(righe_lezioni(qs.order_by('-data_inizio')))
+
+    # Archivio e tabella calda possono intrecciarsi nelle date: riordino l'unione (timsort, due run già ordinate)
+    lezioni.sort(key=lambda l: l.data_inizio, reverse=True)
+
+    return {
+        'lezioni': lezioni,
+        'totale_ore': totale_ore,
+        'totale_importo': totale_importo,
+    }
+
+
+@staff_member_required
+@usa_replica
+def esporta_storico(request):
+    """Export CSV dello storico, con gli stessi filtri della dashboard (archivio incluso)."""
+    storico = _storico_filtrato(
+        timezone.now(),
+        request.GET.get('studente'),
+        request.GET.get('dal'),
+        request.GET.get('al'),
+    )
+
+    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="storico_lezioni.csv"'
+
+    writer = csv.writer(response, delimiter=';')
+    writer.writerow(['ID', 'Data', 'Ora', 'Studente', 'Ore', 'Luogo', 'Prezzo', 'Pagata', 'Archiviata'])
+    for lezione in storico['lezioni']:
+        inizio = timezone.localtime(lezione.data_inizio)
+        writer.writerow([
+            lezione.id,
+            inizio.strftime('%d/%m/%Y'),
+            inizio.strftime('%H:%M'),
+            f"{lezione.studente_nome} {lezione.studente_cognome}",
+            lezione.durata_ore,
+            lezione.luogo_display,
+            lezione.prezzo,
+            'Si' if lezione.pagata else 'No',
+            'Si' if lezione.archiviata else 'No',
+        ])
+
+    return response
+
+
+@staff_member_required
+@usa_replica
+def ricerca(request):
+    q = request.GET.get('q', '').strip()
+    studenti, lezioni = search.cerca(q)
+
+    return render(request, 'core/ricerca.html', {
+        'q': q,
+        'studenti': studenti,
+        'lezioni': lezioni,
+    })
+
+
+@staff_member_required
+@usa_replica
+def heatmap_occupazione(request):
+    oggi = timezone.localdate()
+    try:
+        al = datetime.strptime(request.GET.get('al', ''), "%Y-%m-%d").date()
+    except ValueError:
+        al = oggi
+    try:
+        dal = datetime.strptime(request.GET.get('dal', ''), "%Y-%m-%d").date()
+    except ValueError:
+        dal = (al - timedelta(days=365)).replace(day=1)
+    if dal > al:
+        dal, al = al, dal
+
+    prenotate, offerte = heatmap.occupazione(dal, al)
+    totale_prenotate = sum(map(sum, prenotate))
+    totale_offerte = sum(map(sum, offerte))
+
+    return render(request, 'core/heatmap.html', {
+        'dal': dal,
+        'al': al,
+        'giorni': [nome for _, nome in Disponibilita.GIORNI],
+        'righe': heatmap.righe_heatmap(prenotate, offerte),
+        'totale_prenotate': totale_prenotate,
+        'totale_offerte': totale_offerte,
+        'tasso_totale': totale_prenotate / totale_offerte * 100 if totale_offerte else 0,
+    })
+
+
+@staff_member_required
+def profili_catturati(request):
+    catture = profiling.catture()
+    selezionata = None
+    if request.GET.get('id', '').isdigit():
+        selezionata = profiling.cattura(int(request.GET['id']))
+    elif catture:
+        selezionata = catture[0]
+
+    return render(request, 'core/profili.html', {
+        'catture': catture,
+        'selezionata': selezionata,
+    })
+
+
+@staff_member_required
+def scarica_profilo(request, cattura_id):
+    cattura = profiling.cattura(cattura_id)
+    if cattura is None:
+        raise Http404("Cattura non più disponibile")
+
+    response = HttpResponse(cattura['dump'], content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="richiesta-{cattura_id}.prof"'
+    return response
+
+
 @staff_member_required
 def elimina_disponibilita(request, disp_id):
     disp = get_object_or_404(Disponibilita, id=disp_id)
@@ -337,22 +526,21 @@ def gestisci_lezione(request, lezione_id, azione):
 
 @staff_member_required
 def gestione_pagamenti(request, studente_id, azione):
-    studente = get_object_or_404(User, id=studente_id)
+    studente = get_object_or_404(User.objects.select_related('profilo'), id=studente_id)
+    totale = Profilo.per_utente(studente).saldo
 
-    lezioni_da_pagare = Lezione.objects.filter(
-        studente=studente,
-        stato='CONFERMATA',
-        pagata=False
-    ).order_by('data_inizio')
-
-    if not lezioni_da_pagare:
+    if not totale:
         messages.warning(request, f"Nessuna lezione da pagare per {studente.first_name}.")
         return redirect('dashboard_docente')
 
-    totale = lezioni_da_pagare.aggregate(Sum('prezzo'))['prezzo__sum'] or 0
-
     if azione == 'invia_riepilogo':
         if studente.email:
+            lezioni_da_pagare = righe_lezioni(Lezione.objects.filter(
+                studente=studente,
+                stato='CONFERMATA',
+                pagata=False
+            ).order_by('data_inizio'), studente=False)
+
             invia_email_custom(
                 soggetto=f'Riepilogo Lezioni da Saldare - {studente.first_name}',
                 destinatari=[studente.email],
@@ -368,8 +556,9 @@ def gestione_pagamenti(request, studente_id, azione):
             messages.error(request, "Lo studente non ha un'email salvata.")
 
     elif azione == 'segna_pagato':
-        numero_lezioni = lezioni_da_pagare.update(pagata=True)
+        # Lezioni, saldo e movimento a registro in un'unica transazione
+        numero_lezioni, incasso = Movimento.salda(studente, registrato_da=request.user)
         messages.success(request,
-                         f"Segnate come pagate {numero_lezioni} lezioni per {studente.first_name}. Incasso di € {totale} registrato!")
+                         f"Segnate come pagate {numero_lezioni} lezioni per {studente.first_name}. Incasso di € {incasso} registrato!")
 
-    return redirect('dashboard_docente')
\ No newline at end of file
+    return redirect('dashboard_docente')
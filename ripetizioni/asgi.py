@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
+
+Per sfruttare le view async (date-picker e prenotazione) avviare con USA_VIEW_ASYNC=True,
+es. `USA_VIEW_ASYNC=True uvicorn ripetizioni.asgi:application`.
+Con lo stesso flag la dashboard docente si collega a /dashboard-docente/eventi/ (SSE) per le richieste live:
+le notifiche passano da un pub/sub in memoria, quindi conviene un solo worker (vedi core/eventi.py).
 """
 
 import os
@@ -14,3 +19,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ripetizioni.settings')
 
 application = get_asgi_application()
+
+# Template, URL e DB pronti prima della prima richiesta (vedi core/avvio.py)
+from core.avvio import riscalda_se_attivo  # noqa: E402
+
+riscalda_se_attivo()
@@ -35,12 +35,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.statici.StaticiMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.db_router.ReplicaPinMiddleware',
+    'core.profiling.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'ripetizioni.urls'
@@ -72,6 +75,75 @@ DATABASES = {
     }
 }
 
+# Replica in sola lettura per dashboard, storico ed export (vedi core/db_router.py).
+# In locale basta una seconda copia del file SQLite: DATABASE_REPLICA_NAME=db_replica.sqlite3
+DATABASE_REPLICA_NAME = os.getenv('DATABASE_REPLICA_NAME')
+if DATABASE_REPLICA_NAME:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / DATABASE_REPLICA_NAME,
+        # Nei test la replica è lo stesso DB di default (niente lag, niente dati da copiare)
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
+# Per quanti secondi dopo un POST l'utente legge dal primario ("read your own writes")
+REPLICA_PIN_SECONDI = int(os.getenv('REPLICA_PIN_SECONDI', '10'))
+
+
+# --- CACHE, SESSIONI E MESSAGGI (profilo di deploy) ---
+# DEPLOY_PROFILE=single -> un solo processo: cache in memoria, sessioni su DB (comportamento storico).
+# DEPLOY_PROFILE=multi  -> più worker WSGI/ASGI: cache condivisa su file, sessioni cached_db, messaggi su cookie.
+# Ogni singola voce si può comunque forzare con la sua variabile d'ambiente.
+DEPLOY_PROFILE = os.getenv('DEPLOY_PROFILE', 'single')
+_MULTI_WORKER = DEPLOY_PROFILE == 'multi'
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'file' if _MULTI_WORKER else 'locmem')
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', '')
+
+_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': _CACHE_BACKENDS[CACHE_BACKEND],
+        # Per il backend su file la location è una cartella condivisa da tutti i worker
+        'LOCATION': CACHE_LOCATION or (str(BASE_DIR / '.cache') if CACHE_BACKEND == 'file' else 'ripetizioni'),
+        'TIMEOUT': 300,
+        'KEY_PREFIX': 'fg',
+    }
+}
+
+# 'db' = una query per ogni richiesta autenticata; 'cached_db' = letture dalla cache, DB solo come backup;
+# 'cookies' = sessione firmata nel cookie, zero accessi al DB (ma niente logout forzato lato server).
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cached_db' if _MULTI_WORKER else 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_BACKEND]
+
+# Con i messaggi su cookie un redirect + messages.success() non scrive più la sessione
+MESSAGE_BACKEND = os.getenv('MESSAGE_BACKEND', 'cookie' if _MULTI_WORKER else 'fallback')
+MESSAGE_STORAGE = {
+    'fallback': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    'session': 'django.contrib.messages.storage.session.SessionStorage',
+    'cookie': 'django.contrib.messages.storage.cookie.CookieStorage',
+}[MESSAGE_BACKEND]
+
+
+# --- VIEW ASYNC ---
+# Sotto ASGI (uvicorn/daphne) instrado date-picker e prenotazione sulle versioni async.
+# Sotto WSGI lasciarlo a False: una view async costerebbe un cambio di thread in più per richiesta.
+# Attiva anche gli aggiornamenti live (SSE) della dashboard docente, che tengono aperta una connessione.
+USA_VIEW_ASYNC = os.getenv('USA_VIEW_ASYNC', 'False') == 'True'
+
 
 # Password validation
 
@@ -103,6 +175,14 @@ USE_TZ = True
 # Quando lanciamo 'collectstatic', Django copia tutto qui.
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / "static"
+# collectstatic aggiunge l'hash del contenuto ai nomi e scrive le varianti .gz (e .br con il pacchetto
+# brotli installato) accanto ai file (vedi core/statici.py). Dopo ogni deploy va rilanciato collectstatic.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'core.statici.StaticiCompressi'},
+}
+# Serve STATIC_ROOT da Django con cache di un anno sui file con l'hash. False se c'è un proxy (nginx) che lo fa già.
+SERVI_STATICI = os.getenv('SERVI_STATICI', 'True') == 'True'
 
 # Redirect dopo login/logout
 LOGIN_REDIRECT_URL = 'dashboard'
@@ -119,4 +199,43 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_PASSWORD')
 
 DEFAULT_FROM_EMAIL = f'FG Ripetizioni <{EMAIL_HOST_USER}>'
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# 'immediata' = una mail al docente per ogni richiesta (dentro la view di prenotazione);
+# 'digest' = le richieste si accumulano e 'python manage.py invia_digest' (da cron) manda un'unica mail riassuntiva.
+NOTIFICHE_DOCENTE = os.getenv('NOTIFICHE_DOCENTE', 'immediata')
+
+# Con quante ore di anticipo parte il promemoria (vedi 'python manage.py invia_promemoria')
+PROMEMORIA_ORE_PRIMA = float(os.getenv('PROMEMORIA_ORE_PRIMA', '24'))
+
+# --- ARCHIVIO LEZIONI ---
+# Le lezioni rifiutate o già saldate più vecchie di così finiscono in LezioneArchiviata
+# (vedi 'python manage.py archivia_lezioni').
+ARCHIVIO_ORIZZONTE_GIORNI = int(os.getenv('ARCHIVIO_ORIZZONTE_GIORNI', '730'))
+ARCHIVIO_BATCH_SIZE = int(os.getenv('ARCHIVIO_BATCH_SIZE', '500'))
+
+# --- BACKUP ---
+# Dove 'python manage.py backup_db' salva le copie e quante ne tiene.
+BACKUP_DIR = os.getenv('BACKUP_DIR', str(BASE_DIR / 'backup'))
+BACKUP_CONSERVA = int(os.getenv('BACKUP_CONSERVA', '7'))
+
+# --- ETAG ---
+# Entra in tutti gli ETag delle dashboard (vedi core/etag.py): cambiarlo a ogni rilascio (es. hash del commit)
+# fa scartare le pagine in cache nei browser quando cambiano i template.
+ETAG_RILASCIO = os.getenv('ETAG_RILASCIO', '1')
+
+# --- PROFILAZIONE ---
+# Lo staff può aggiungere ?_prof=1 a qualsiasi pagina per profilarla (vedi core/profiling.py).
+# Quante catture tenere in memoria per processo.
+PROFILER_MAX_CATTURE = int(os.getenv('PROFILER_MAX_CATTURE', '20'))
+
+# --- AVVIO ---
+# Al caricamento dell'app WSGI/ASGI compila i template, prepara gli URL e apre il DB (vedi core/avvio.py).
+RISCALDAMENTO_AVVIO = os.getenv('RISCALDAMENTO_AVVIO', 'True') == 'True'
+
+# --- RATE LIMITING ---
+# Token bucket per client sugli endpoint pubblici (vedi core/limiti.py): raffica massima e gettoni al secondo.
+LIMITE_CAPACITA = int(os.getenv('LIMITE_CAPACITA', '20'))
+LIMITE_RICARICA = float(os.getenv('LIMITE_RICARICA', '2'))
+# Quanti reverse proxy fidati stanno davanti a Django (0 = si usa REMOTE_ADDR, X-Forwarded-For ignorato)
+LIMITE_PROXY_FIDATI = int(os.getenv('LIMITE_PROXY_FIDATI', '0'))
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from core import views
@@ -11,18 +12,31 @@ urlpatterns = [
 
     # Area Studente
     path('', views.dashboard, name='dashboard'),
-    path('prenota/', views.prenota, name='prenota'),
+    path('prenota/', views.prenota_async if settings.USA_VIEW_ASYNC else views.prenota, name='prenota'),
     path('profilo/', views.profilo_view, name='profilo'),
 
     # API interne (usate da HTMX nel form prenotazione)
-    path('htmx/get-orari/', views.get_orari_disponibili, name='get_orari'),
+    path('htmx/get-orari/',
+         views.get_orari_disponibili_async if settings.USA_VIEW_ASYNC else views.get_orari_disponibili,
+         name='get_orari'),
+    path('htmx/prossimi-slot/', views.get_prossimi_slot, name='prossimi_slot'),
 
     # Area Docente
     path('dashboard-docente/', views.dashboard_docente, name='dashboard_docente'),
+    path('dashboard-docente/esporta-storico/', views.esporta_storico, name='esporta_storico'),
+    path('dashboard-docente/cerca/', views.ricerca, name='ricerca'),
+    path('dashboard-docente/occupazione/', views.heatmap_occupazione, name='heatmap_occupazione'),
+    path('dashboard-docente/profili/', views.profili_catturati, name='profili_catturati'),
+    path('dashboard-docente/profili/<int:cattura_id>.prof', views.scarica_profilo, name='scarica_profilo'),
 
     # Action URLs (Logic only, redirect immediato)
     path('gestisci-lezione/<int:lezione_id>/<str:azione>/', views.gestisci_lezione, name='gestisci_lezione'),
     path('elimina-chiusura/<int:chiusura_id>/', views.elimina_chiusura, name='elimina_chiusura'),
     path('elimina-disponibilita/<int:disp_id>/', views.elimina_disponibilita, name='elimina_disponibilita'),
     path('gestione-pagamenti/<int:studente_id>/<str:azione>/', views.gestione_pagamenti, name='gestione_pagamenti'),
-]
\ No newline at end of file
+]
+
+if settings.USA_VIEW_ASYNC:
+    # Stream SSE della dashboard docente: la connessione resta aperta, sotto WSGI terrebbe occupato un worker
+    # per ogni dashboard aperta. Senza ASGI la pagina non apre lo stream (vedi 'eventi_live').
+    urlpatterns.append(path('dashboard-docente/eventi/', views.eventi_docente, name='eventi_docente'))
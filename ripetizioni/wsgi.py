@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ripetizioni.settings')
 
 application = get_wsgi_application()
+
+# Template, URL e DB pronti prima della prima richiesta (vedi core/avvio.py)
+from core.avvio import riscalda_se_attivo  # noqa: E402
+
+riscalda_se_attivo()